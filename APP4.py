@@ -1,89 +1,31 @@
 import streamlit as st
-import joblib
-import numpy as np
+import io
+import uuid
 import pandas as pd
-import shap
-import matplotlib.pyplot as plt
-import matplotlib
-import seaborn as sns
-from PIL import Image
-import plotly.graph_objects as go
-import plotly.express as px
-from matplotlib.font_manager import FontProperties
-import matplotlib.colors as mcolors
-import os
 import warnings
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from functools import partial
+from charts import (build_model_comparison, build_risk_curve, build_risk_gauge, build_risk_heatmap,
+                    build_shap_beeswarm, build_shap_dependence, build_shap_importance, build_shap_waterfall)
+from model_core import MODEL_PATH, death_class_explanation, feature_ranges, risk_category
+from batch_scoring import DEFAULT_CHUNK_SIZE, iter_input_chunks, score_file
+from cohort_explain import explain_cohort, global_importance, prepare_cohort
+from model_reload import ModelReloader
+from model_registry import DEFAULT_MODEL_NAME, MODEL_REGISTRY_DIR, ModelRegistry
+from metrics import MetricsRegistry, RequestTimer, configure_timing_log
+from audit_log import AUDIT_DB_PATH, AuditLog
+from result_cache import PredictionCache, make_cache_key
+from what_if import risk_at, sweep_feature, sweep_pair
+from counterfactual import DEFAULT_MODIFIABLE_FEATURES, search_counterfactuals
+from explanation_jobs import ExplanationCancelled, ExplanationService
+from memory_guard import MemoryGuard
 warnings.filterwarnings('ignore')
 
-# 直接设置matplotlib字体路径来解决中文显示问题
-def set_matplotlib_font_path():
-    # 检查常见的Microsoft YaHei字体路径
-    possible_paths = [
-        'C:/Windows/Fonts/msyh.ttc',  # Windows 标准路径
-        'C:/Windows/Fonts/msyh.ttf',
-        '/usr/share/fonts/windows/msyh.ttf'  # Linux 可能路径
-    ]
-    for path in possible_paths:
-        if os.path.exists(path):
-            # 直接为matplotlib添加字体文件路径
-            import matplotlib.font_manager as fm
-            fm.fontManager.addfont(path)
-            # 刷新字体缓存
-            fm._rebuild()
-            return path
-    return None
-
-# 应用启动时设置字体路径
-font_path = set_matplotlib_font_path()
-
-# 辅助函数：配置中文字体
-def setup_chinese_fonts(font_path=None):
-    # 如果没有传入字体路径，检查常见路径
-    if font_path is None:
-        # 检查多个可能的微软雅黑字体路径
-        possible_paths = [
-            'C:/Windows/Fonts/msyh.ttc',  # Windows 标准路径
-            'C:/Windows/Fonts/msyh.ttf',
-            '/usr/share/fonts/windows/msyh.ttf'  # Linux 可能路径
-        ]
-        for path in possible_paths:
-            if os.path.exists(path):
-                font_path = path
-                break
-    
-    # 设置matplotlib字体，只用Microsoft YaHei
-    plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-    plt.rcParams['axes.unicode_minus'] = False
-    plt.rcParams.update({'font.family': 'Microsoft YaHei'})
-    
-    # 如果找到了字体文件路径，使用它
-    if font_path:
-        chinese_font = FontProperties(fname=font_path)
-        matplotlib.rcParams['font.family'] = 'sans-serif'
-        matplotlib.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-        # 为所有matplotlib文本元素设置字体
-        from matplotlib import rc
-        rc('font', family='Microsoft YaHei', weight='normal', size=9)
-        # 特别处理shap瀑布图中的字体
-        import matplotlib as mpl
-        mpl.rcParams['font.family'] = ['Microsoft YaHei']
-        mpl.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-        mpl.rcParams['axes.unicode_minus'] = False
-        return chinese_font
-    return None
-
-# 设置matplotlib中文字体，只用Microsoft YaHei
-plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-plt.rcParams['axes.unicode_minus'] = False
-plt.rcParams.update({'font.family': 'Microsoft YaHei'})
-# 确保plotly也能显示中文
-import plotly.io as pio
-pio.templates.default = "simple_white"
-# 设置plotly的默认字体为Microsoft YaHei
-pio.templates["simple_white"].layout.font.family = "Microsoft YaHei"
-
-# 应用启动时设置中文字体
-chinese_font = setup_chinese_fonts(font_path)
+# 等待后台解释时刷新状态的间隔（秒）
+EXPLANATION_POLL_SECONDS = 0.1
+
+# 会话状态过大时可以丢弃的条目，都可以重新计算
+SESSION_DROPPABLE_KEYS = ('cohort_explanation', 'last_timings')
 
 # 设置页面配置
 st.set_page_config(
@@ -158,7 +100,7 @@ st.markdown("""
         border-top: 1px solid #E5E7EB;
         font-family: 'Microsoft YaHei', sans-serif;
     }
-    .stButton>button {
+    .stButton>button, div[data-testid="stFormSubmitButton"]>button {
         background-color: #1E3A8A;
         color: white;
         font-weight: bold;
@@ -169,7 +111,7 @@ st.markdown("""
         margin-top: 0.5rem;
         width: 100%;
     }
-    .stButton>button:hover {
+    .stButton>button:hover, div[data-testid="stFormSubmitButton"]>button:hover {
         background-color: #1E40AF;
     }
     /* 改善小型设备上的响应式布局 */
@@ -285,30 +227,134 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 加载保存的随机森林模型
+# 预热候选的预测核心：构建解释器、跑一次完整预测并构建plotly图表，首次点击不再承担初始化开销
+def warm_up_predictor(predictor):
+    prediction, shap_values = predictor.warm_up()
+    build_risk_gauge(prediction.proba[0, 1] * 100)
+    contributions, base_value, shown_values = death_class_explanation(shap_values)
+    build_shap_waterfall(contributions, base_value, predictor.feature_order, shown_values)
+
+# 加载预测核心并在后台监视模型文件，新模型校验、预热完成后原子替换，无需重启服务
+# 首次加载失败时抛出异常，不会被缓存，下次刷新页面会重试
+@st.cache_resource(show_spinner="正在加载模型并预热...")
+def get_model_reloader():
+    return ModelReloader(MODEL_PATH, warm_up=warm_up_predictor).start()
+
+# 在后台线程中计算SHAP值并构建瀑布图，返回 (SHAP值, 图表, 各阶段耗时)；两步之间检查任务是否已被取消
+def compute_explanation(predictor, features_df, shap_values, cancelled):
+    worker_timer = RequestTimer()
+    if shap_values is None:
+        with worker_timer.stage("shap"):
+            shap_values = predictor.explain(features_df)
+    if cancelled.is_set():
+        raise ExplanationCancelled()
+    # 直接由SHAP值绘制交互式瀑布图，不再经过matplotlib和磁盘文件
+    with worker_timer.stage("figure"):
+        contributions, base_value, shown_values = death_class_explanation(shap_values)
+        waterfall_fig = build_shap_waterfall(contributions, base_value, features_df.columns.tolist(),
+                                             shown_values, max_display=7)
+    return shap_values, waterfall_fig, worker_timer.stages
+
+# 所有会话共享的后台解释线程池
 @st.cache_resource
-def load_model():
-    try:
-        model = joblib.load('rf1.pkl')
-        # 添加模型信息
-        if hasattr(model, 'n_features_in_'):
-            st.session_state['model_n_features'] = model.n_features_in_
-            st.session_state['model_feature_names'] = model.feature_names_in_ if hasattr(model, 'feature_names_in_') else None
-        return model
-    except Exception as e:
-        st.error(f"⚠️ 模型文件 'rf.pkl' 加载错误: {str(e)}。请确保模型文件在正确的位置。")
-        return None
-
-model = load_model()
+def get_explanation_service():
+    return ExplanationService()
+
+# 所有会话共享的预测结果缓存（LRU），条目按模型区分
+@st.cache_resource
+def get_prediction_cache():
+    return PredictionCache()
+
+# 进程内共享的指标汇总，定期写出Prometheus文本格式的指标文件
+@st.cache_resource
+def get_metrics():
+    configure_timing_log()
+    return MetricsRegistry()
+
+# 进程内共享的预测审计日志，后台线程批量写入SQLite；PREDICTION_AUDIT_DB设为空时不记录
+@st.cache_resource
+def get_audit_log():
+    return AuditLog(AUDIT_DB_PATH) if AUDIT_DB_PATH else None
+
+# 进程内共享的内存监控：后台定期检查常驻内存、存活的图表对象和各会话状态的大小并写入指标，
+# 超过清理阈值时清空结果缓存并释放内存
+@st.cache_resource
+def get_memory_guard():
+    return MemoryGuard(get_metrics(), cleanups=[get_prediction_cache().clear, get_model_registry().clear]).start()
+
+# 模型目录中的其他模型（如不同医院、不同训练日期的版本），第一次选用时加载并预热，驻留内存的模型数有上限，
+# 超过时淘汰最久未使用的模型；默认模型取自热更新器
+@st.cache_resource
+def get_model_registry():
+    return ModelRegistry(MODEL_REGISTRY_DIR, default=lambda: get_model_reloader().current,
+                         warm_up=warm_up_predictor)
+
+# 本会话的标识，用于在输入变化时取消本会话尚未完成的解释任务
+explanation_owner = st.session_state.setdefault('explanation_owner', uuid.uuid4().hex)
+
+# 本次运行只取一次当前版本，运行期间即使发生热更新也在同一版本上完成
+try:
+    model_reloader = get_model_reloader()
+    predictor = model_reloader.current
+except Exception as e:
+    st.error(f"⚠️ 模型文件 '{MODEL_PATH}' 加载错误: {str(e)}。请确保模型文件在正确的位置。")
+    model_reloader = None
+    predictor = None
+
+# 模型目录中有其他模型时，在侧边栏选择本会话使用的模型
+model_registry = get_model_registry()
+model_entries = model_registry.entries()
+selected_model = DEFAULT_MODEL_NAME
+if len(model_entries) > 1:
+    selected_model = st.sidebar.selectbox("预测模型", list(model_entries), key="selected_model",
+                                          format_func=lambda name: model_entries[name].label)
+    if selected_model != DEFAULT_MODEL_NAME:
+        try:
+            with st.spinner(f"正在加载模型 {model_entries[selected_model].label}..."):
+                predictor = model_registry.get(selected_model)
+        except Exception as e:
+            st.error(f"⚠️ 模型 '{model_entries[selected_model].label}' 加载错误: {str(e)}")
+            predictor = None
+model_version = predictor.version if predictor is not None else None
+# 模型结构信息取自推理引擎；使用紧凑格式时无需反序列化sklearn模型
+model = predictor.engine if predictor is not None else None
 
 # 侧边栏配置和调试信息
 with st.sidebar:
     st.markdown("### 模型信息")
+    if model_reloader is not None and selected_model == DEFAULT_MODEL_NAME:
+        reload_status = model_reloader.status()
+        st.caption(f"模型版本 {reload_status['model_version']} ｜ 加载于 {reload_status['loaded_at']}")
+        if reload_status['last_error']:
+            st.warning(f"检测到新的模型文件但未能启用，仍在使用当前版本: {reload_status['last_error']}")
+    elif predictor is not None:
+        model_description = model_entries[selected_model].description
+        st.caption(f"模型版本 {predictor.version}" + (f" ｜ {model_description}" if model_description else ""))
+    if predictor is not None:
+        # 本会话上次运行之后同一模型发生了更新
+        previous_version = st.session_state.get('model_version')
+        if (previous_version is not None and previous_version[0] == selected_model
+                and previous_version[1] != predictor.version):
+            st.info(f"模型已更新: {previous_version[1]} → {predictor.version}")
+        st.session_state['model_version'] = (selected_model, predictor.version)
     if model is not None and hasattr(model, 'n_features_in_'):
         st.info(f"模型期望特征数量: {model.n_features_in_}")
         if hasattr(model, 'feature_names_in_'):
-            expected_features = model.feature_names_in_
-            st.write("模型期望特征列表:", expected_features)
+            # 纯文本展示，不必每次运行都序列化一个表格
+            st.caption("模型期望特征列表: " + "、".join(map(str, model.feature_names_in_)))
+    
+    # 结果缓存命中统计，在脚本末尾填充，以包含本次预测
+    cache_stats_placeholder = st.empty()
+    
+    # 快速模式：逐棵累加决策树，剩余的树无论取何值都不会改变风险类别时即停止（只用确定性界），
+    # 类别与完整预测严格一致，仪表盘上的概率为估计值
+    fast_mode = st.checkbox("快速预测（提前停止）", value=False,
+                            help="剩余的决策树无论结果如何都不会改变风险类别时即停止计算，"
+                                 "类别与完整预测严格一致，概率为估计值")
+    
+    # 调试面板：显示最近一次预测各阶段的耗时
+    show_debug = st.checkbox("显示调试信息", value=False)
+    debug_placeholder = st.empty()
     
     st.markdown("---")
     st.markdown("### 应用说明")
@@ -321,46 +367,18 @@ with st.sidebar:
     3. 查看预测结果与解释
     """)
 
-# 特征范围定义
-feature_ranges = {
-    "术中出血量": {"type": "numerical", "min": 0.000, "max": 800.000, "default": 50, 
-                                 "description": "手术期间的出血量 (ml)", "unit": "ml"},
-    "CEA": {"type": "numerical", "min": 0, "max": 150.000, "default": 8.68, 
-           "description": "癌胚抗原水平", "unit": "ng/ml"},
-    "白蛋白": {"type": "numerical", "min": 1.0, "max": 80.0, "default": 38.60, 
-               "description": "血清白蛋白水平", "unit": "g/L"},
-    "TNM分期": {"type": "categorical", "options": [1, 2, 3, 4], "default": 2, 
-                 "description": "肿瘤分期", "unit": ""},
-    "年龄": {"type": "numerical", "min": 25, "max": 90, "default": 76, 
-           "description": "患者年龄", "unit": "岁"},
-    "术中肿瘤最大直径": {"type": "numerical", "min": 0.2, "max": 20, "default": 4, 
-                          "description": "肿瘤最大直径", "unit": "cm"},
-    "淋巴血管侵犯": {"type": "categorical", "options": [0, 1], "default": 1, 
-                              "description": "淋巴血管侵犯 (0=否, 1=是)", "unit": ""},
-}
-
-# 特征顺序定义 - 确保与模型训练时的顺序一致
-if model is not None and hasattr(model, 'feature_names_in_'):
-    feature_input_order = list(model.feature_names_in_)
-    feature_ranges_ordered = {}
-    for feature in feature_input_order:
-        if feature in feature_ranges:
-            feature_ranges_ordered[feature] = feature_ranges[feature]
-        else:
-            # 模型需要但UI中没有定义的特征
-            with st.sidebar:
-                st.warning(f"模型要求特征 '{feature}' 但在UI中未定义")
-    
-    # 检查UI中定义但模型不需要的特征
-    for feature in feature_ranges:
-        if feature not in feature_input_order:
-            with st.sidebar:
-                st.warning(f"UI中定义的特征 '{feature}' 不在模型要求的特征中")
-    
-    # 使用排序后的特征字典
-    feature_ranges = feature_ranges_ordered
+# 特征顺序定义 - 确保与模型训练时的顺序一致；对照结果随预测核心缓存，每个模型版本只计算一次
+if predictor is not None:
+    feature_input_order = predictor.feature_order
+    # 按模型顺序排列的特征定义
+    feature_ranges = predictor.input_ranges
+    with st.sidebar:
+        for feature in predictor.missing_features:
+            st.warning(f"模型要求特征 '{feature}' 但在UI中未定义")
+        for feature in predictor.unused_features:
+            st.warning(f"UI中定义的特征 '{feature}' 不在模型要求的特征中")
 else:
-    # 如果模型没有feature_names_in_属性，使用原来的顺序
+    # 模型未能加载时使用原来的顺序
     feature_input_order = list(feature_ranges.keys())
 
 # 应用标题和描述
@@ -373,141 +391,148 @@ with col1:
     st.markdown('<div class="section-container">', unsafe_allow_html=True)
     st.markdown('<h2 class="sub-header">患者特征输入</h2>', unsafe_allow_html=True)
     
-    # 动态生成输入项 - 更紧凑布局
-    feature_values = {}
+    # 输入放在表单中：拖动滑块、切换选项不会触发整页重新运行，点击"开始预测"时才提交；
+    # 假设分析和反事实分析使用最近一次提交的取值
+    with st.form("patient_form", border=False):
+        # 动态生成输入项 - 更紧凑布局
+        feature_values = {}
     
-    for feature in feature_input_order:
-        properties = feature_ranges[feature]
+        for feature in feature_input_order:
+            properties = feature_ranges[feature]
         
-        # 显示特征描述 - 根据变量类型生成不同的帮助文本
-        if properties["type"] == "numerical":
-            help_text = f"{properties['description']} ({properties['min']}-{properties['max']} {properties['unit']})"
+            # 显示特征描述 - 根据变量类型生成不同的帮助文本
+            if properties["type"] == "numerical":
+                help_text = f"{properties['description']} ({properties['min']}-{properties['max']} {properties['unit']})"
             
-            # 为数值型变量创建滑块 - 使用更紧凑的布局
-            value = st.slider(
-                label=f"{feature}",
-                min_value=float(properties["min"]),
-                max_value=float(properties["max"]),
-                value=float(properties["default"]),
-                step=0.1,
-                help=help_text,
-                # 使布局更紧凑
-            )
-        elif properties["type"] == "categorical":
-            # 对于分类变量，只使用描述作为帮助文本
-            help_text = f"{properties['description']}"
-            
-            # 为分类变量创建单选按钮
-            if feature == "TNM分期":
-                options_display = {1: "I期", 2: "II期", 3: "III期", 4: "IV期"}
-                value = st.radio(
-                    label=f"{feature}",
-                    options=properties["options"],
-                    format_func=lambda x: options_display[x],
-                    help=help_text,
-                    horizontal=True
-                )
-            elif feature == "淋巴血管侵犯":
-                options_display = {0: "否", 1: "是"}
-                value = st.radio(
-                    label=f"{feature}",
-                    options=properties["options"],
-                    format_func=lambda x: options_display[x],
-                    help=help_text,
-                    horizontal=True
-                )
-            else:
-                value = st.radio(
+                # 为数值型变量创建滑块 - 使用更紧凑的布局
+                value = st.slider(
                     label=f"{feature}",
-                    options=properties["options"],
+                    min_value=float(properties["min"]),
+                    max_value=float(properties["max"]),
+                    value=float(properties["default"]),
+                    step=0.1,
                     help=help_text,
-                    horizontal=True
+                    # 使布局更紧凑
                 )
+            elif properties["type"] == "categorical":
+                # 对于分类变量，只使用描述作为帮助文本
+                help_text = f"{properties['description']}"
+            
+                # 为分类变量创建单选按钮
+                if feature == "TNM分期":
+                    options_display = {1: "I期", 2: "II期", 3: "III期", 4: "IV期"}
+                    value = st.radio(
+                        label=f"{feature}",
+                        options=properties["options"],
+                        format_func=lambda x: options_display[x],
+                        help=help_text,
+                        horizontal=True
+                    )
+                elif feature == "淋巴血管侵犯":
+                    options_display = {0: "否", 1: "是"}
+                    value = st.radio(
+                        label=f"{feature}",
+                        options=properties["options"],
+                        format_func=lambda x: options_display[x],
+                        help=help_text,
+                        horizontal=True
+                    )
+                else:
+                    value = st.radio(
+                        label=f"{feature}",
+                        options=properties["options"],
+                        help=help_text,
+                        horizontal=True
+                    )
                 
-        feature_values[feature] = value
+            feature_values[feature] = value
     
-    # 预测按钮
-    predict_button = st.button("开始预测", help="点击生成预测结果")
+        # 预测按钮：表单内的输入只在点击时一并提交
+        predict_button = st.form_submit_button("开始预测", help="点击生成预测结果")
     st.markdown('</div>', unsafe_allow_html=True)
 
+# 本次运行提交的后台解释任务
+explanation_job = None
+
 with col2:
     if predict_button and model is not None:
         st.markdown('<div class="results-container">', unsafe_allow_html=True)
         st.markdown('<h2 class="sub-header">预测结果</h2>', unsafe_allow_html=True)
         
-        # 准备模型输入
-        features_df = pd.DataFrame([feature_values])
+        # 记录本次请求各阶段耗时：输入整理、森林遍历、SHAP、图表构建和图表编码
+        metrics = get_metrics()
+        timer = RequestTimer()
+        cache_hit = False
         
-        # 确保特征顺序与模型训练时一致
-        if hasattr(model, 'feature_names_in_'):
-            # 检查是否所有需要的特征都有值
-            missing_features = [f for f in model.feature_names_in_ if f not in features_df.columns]
-            if missing_features:
-                st.error(f"缺少模型所需的特征: {missing_features}")
-                st.stop()
-            
-            # 按模型训练时的特征顺序重排列特征
-            features_df = features_df[model.feature_names_in_]
-        
-        # 转换为numpy数组
-        features_array = features_df.values
+        # 准备模型输入 - 由预测核心检查缺失特征并按模型训练时的特征顺序排列
+        try:
+            with timer.stage("input"):
+                features_df = predictor.frame([feature_values])
+        except ValueError as e:
+            metrics.increment("prediction_errors_total", stage="input")
+            st.error(str(e))
+            st.stop()
         
         with st.spinner("计算预测结果..."):
             try:
-                # 模型预测
-                predicted_class = model.predict(features_array)[0]
-                predicted_proba = model.predict_proba(features_array)[0]
+                # 相同（量化后）的输入直接复用缓存，跳过森林遍历和SHAP计算
+                prediction_cache = get_prediction_cache()
+                with timer.stage("input"):
+                    cache_key = make_cache_key(feature_values, feature_input_order)
+                    cached_entry = prediction_cache.get(cache_key, model_version, field='prediction') or {}
+                
+                # 模型预测 - 一次森林遍历同时得到类别、概率和树间波动
+                prediction = cached_entry.get('prediction')
+                cache_hit = prediction is not None
+                if prediction is None and fast_mode:
+                    # 快速模式的结果只是估计值，不写入结果缓存
+                    with timer.stage("forest"):
+                        fast_prediction = predictor.predict_fast(features_df)
+                    predicted_proba = fast_prediction.proba[0]
+                    trees_used = int(fast_prediction.trees_used[0])
+                else:
+                    if prediction is None:
+                        with timer.stage("forest"):
+                            prediction = predictor.predict(features_df)
+                        prediction_cache.put(cache_key, model_version, prediction=prediction)
+                    predicted_proba = prediction.proba[0]
+                    trees_used = None
                 
                 # 提取预测的类别概率
                 death_probability = predicted_proba[1] * 100  # 假设1表示死亡类
                 survival_probability = 100 - death_probability
                 
-                # 创建概率显示 - 进一步减小尺寸
-                fig = go.Figure(go.Indicator(
-                    mode = "gauge+number",
-                    value = death_probability,
-                    domain = {'x': [0, 1], 'y': [0, 1]},
-                    title = {'text': "", 'font': {'size': 14, 'family': 'Microsoft YaHei', 'color': 'black', 'weight': 'bold'}},
-                    gauge = {
-                        'axis': {'range': [0, 100], 'tickwidth': 1, 'tickcolor': "darkblue", 'tickfont': {'color': 'black', 'size': 9, 'family': 'Microsoft YaHei'}},
-                        'bar': {'color': "darkblue"},
-                        'bgcolor': "white",
-                        'borderwidth': 1,
-                        'bordercolor': "gray",
-                        'steps': [
-                            {'range': [0, 30], 'color': 'green'},
-                            {'range': [30, 70], 'color': 'orange'},
-                            {'range': [70, 100], 'color': 'red'}],
-                        'threshold': {
-                            'line': {'color': "red", 'width': 2},
-                            'thickness': 0.6,
-                            'value': death_probability}}))
+                if trees_used is None:
+                    # 树间波动区间（各树死亡概率的P10-P90），作为不确定性参考
+                    spread_low = prediction.tree_low[0] * 100
+                    spread_high = prediction.tree_high[0] * 100
+                    death_votes = prediction.death_votes[0] * 100
+                    spread_text = (f"树间波动区间 (P10-P90): {spread_low:.1f}% - {spread_high:.1f}% ｜ "
+                                   f"{death_votes:.0f}% 的决策树判为死亡")
+                elif trees_used < predictor.engine.n_estimators:
+                    spread_text = (f"快速预测: 使用 {trees_used}/{predictor.engine.n_estimators} 棵决策树，"
+                                   f"风险类别已确定，概率为估计值")
+                else:
+                    spread_text = f"快速预测: 接近分层阈值，已使用全部 {trees_used} 棵决策树"
                 
-                fig.update_layout(
-                    height=160,  # 进一步减小高度
-                    margin=dict(l=5, r=5, t=5, b=5),  # 减小顶部边距
-                    paper_bgcolor="white",
-                    plot_bgcolor="white",
-                    font={'family': "Microsoft YaHei", 'color': 'black', 'size': 11},
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                # 创建概率显示 - 进一步减小尺寸
+                with timer.stage("figure"):
+                    fig = build_risk_gauge(death_probability)
+                with timer.stage("encode"):
+                    st.plotly_chart(fig, use_container_width=True)
                 
                 # 创建风险类别显示
-                risk_category = "低风险"
-                risk_color = "green"
-                if death_probability > 30 and death_probability <= 70:
-                    risk_category = "中等风险"
-                    risk_color = "orange"
-                elif death_probability > 70:
-                    risk_category = "高风险"
-                    risk_color = "red"
+                risk_label, risk_color = risk_category(death_probability)
                 
                 # 显示风险类别和概率 - 使用浅色背景代替白色
                 st.markdown(f"""
                 <div style="text-align: center; margin: -0.2rem 0 0.3rem 0;">
                     <span style="font-size: 1.1rem; font-family: 'Microsoft YaHei'; color: {risk_color}; font-weight: bold;">
-                        {risk_category}
+                        {risk_label}
                     </span>
+                    <div style="font-size: 0.8rem; font-family: 'Microsoft YaHei'; color: #4B5563;">
+                        {spread_text}
+                    </div>
                 </div>
                 """, unsafe_allow_html=True)
                 
@@ -527,143 +552,30 @@ with col2:
                 </div>
                 """, unsafe_allow_html=True)
                 
+                # 风险数值已经显示，之后的解释耗时不计入
+                timer.mark("risk_shown")
+                
+                # 记录审计日志：请求路径上只放入队列，由后台线程批量写库
+                audit_log = get_audit_log()
+                if audit_log is not None:
+                    audit_log.record("app", predictor.version, feature_values, death_probability, risk_label,
+                                     elapsed_ms=timer.marks["risk_shown"], stages=dict(timer.stages),
+                                     cache_hit=cache_hit, fast_mode=fast_mode, trees_used=trees_used)
+                
                 # 添加SHAP可视化部分 - 减小间距
                 st.markdown('<hr style="margin:0.3rem 0;">', unsafe_allow_html=True)
                 st.markdown('<h2 class="sub-header">预测结果解释</h2>', unsafe_allow_html=True)
                 
-                try:
-                    with st.spinner("正在生成SHAP解释图..."):
-                        # 使用最新版本的SHAP API，采用最简洁、最兼容的方式
-                        explainer = shap.Explainer(model)
-                        
-                        # 计算SHAP值
-                        shap_values = explainer(features_df)
-                        
-                        # 使用matplotlib中文字体解决中文显示问题
-                        plt.rcParams.update({'font.family': 'Microsoft YaHei'})
-                        plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-                        plt.rcParams['axes.unicode_minus'] = False
-                        
-                        # 使用waterfall图，进一步减小尺寸
-                        plt.figure(figsize=(6.5, 3), dpi=200, facecolor='#f8f9fa')  # 使用浅灰背景
-                        
-                        # 加载微软雅黑字体
-                        chinese_font = setup_chinese_fonts(font_path)
-                        
-                        # 在绘制SHAP瀑布图之前确保字体设置正确
-                        import shap.plots as shap_plots
-                        # 尝试修改SHAP内部使用的字体
-                        from matplotlib import rcParams
-                        rcParams['font.family'] = 'Microsoft YaHei'
-                        rcParams['font.sans-serif'] = ['Microsoft YaHei']
-                        
-                        # 自定义SHAP瀑布图显示
-                        # 检查是否有字体文件
-                        if chinese_font:
-                            # 尝试修改SHAP内部绘图函数中的默认字体设置
-                            import types
-                            
-                            # 备份原始的waterfall函数用于后续还原
-                            original_waterfall = shap.plots.waterfall
-                            
-                            # 获取特征名称列表，确保显示中文
-                            feature_names = features_df.columns.tolist()
-                            
-                            # 创建一个定制版本的waterfall函数
-                            def custom_waterfall(shap_values, max_display=10, show=True):
-                                # 调用原始函数
-                                plot = original_waterfall(shap_values, max_display=max_display, show=False)
-                                
-                                # 获取当前图形的所有文本元素并设置字体
-                                for ax in plt.gcf().get_axes():
-                                    # 设置标题和坐标轴标签
-                                    if ax.get_title():
-                                        ax.set_title(ax.get_title(), fontproperties=chinese_font)
-                                    ax.set_xlabel(ax.get_xlabel(), fontproperties=chinese_font)
-                                    ax.set_ylabel(ax.get_ylabel(), fontproperties=chinese_font)
-                                    
-                                    # 设置刻度标签
-                                    for label in ax.get_xticklabels() + ax.get_yticklabels():
-                                        label.set_fontproperties(chinese_font)
-                                    
-                                    # 设置所有文本元素的字体
-                                    for text in ax.texts:
-                                        text.set_fontproperties(chinese_font)
-                                
-                                if show:
-                                    plt.show()
-                                return plot
-                            
-                            # 暂时替换SHAP的waterfall函数
-                            shap.plots.waterfall = custom_waterfall
-                        
-                        # 对于多分类模型，选择死亡类(索引1)
-                        if hasattr(shap_values, 'values') and len(shap_values.values.shape) > 2:
-                            # 多分类情况 - 选择第二个类别(通常是正类/死亡类)
-                            shap.plots.waterfall(shap_values[0, :, 1], max_display=7, show=False)
-                        else:
-                            # 二分类或回归情况
-                            shap.plots.waterfall(shap_values[0], max_display=7, show=False)
-                        
-                        # 还原原始的waterfall函数
-                        if chinese_font:
-                            shap.plots.waterfall = original_waterfall
-                        
-                        # 手动修改标题 - 使用中文字体
-                        plt.title("特征对预测的影响", fontsize=12, fontproperties=chinese_font if chinese_font else 'Microsoft YaHei', fontweight='bold', color='black')
-                        
-                        # 修改图中所有文本元素的字体
-                        for ax in plt.gcf().get_axes():
-                            for item in ([ax.title, ax.xaxis.label, ax.yaxis.label] +
-                                        ax.get_xticklabels() + ax.get_yticklabels()):
-                                if item is not None:
-                                    if chinese_font:
-                                        item.set_fontproperties(chinese_font)
-                                    else:
-                                        item.set_fontproperties('Microsoft YaHei')
-                            
-                            # 尝试获取所有文本元素并设置字体
-                            for text in ax.texts:
-                                if chinese_font:
-                                    text.set_fontproperties(chinese_font)
-                                else:
-                                    text.set_fontproperties('Microsoft YaHei')
-                            
-                            # 获取特征名称列表
-                            feature_names = features_df.columns.tolist()
-                            
-                            # 尝试直接修改文本元素中的特征名称
-                            for text in ax.texts:
-                                text_content = text.get_text()
-                                for feature in feature_names:
-                                    if feature in text_content:
-                                        # 确保使用正确的中文名称并设置字体
-                                        text.set_text(text_content)
-                                        if chinese_font:
-                                            text.set_fontproperties(chinese_font)
-                                        else:
-                                            text.set_fontproperties('Microsoft YaHei')
-                        
-                        plt.tight_layout()
-                        
-                        # 保存并显示图
-                        plt.savefig("shap_waterfall_plot.png", bbox_inches='tight', dpi=200, facecolor='#f8f9fa', 
-                                    pad_inches=0.1)
-                        plt.close()
-                        st.image("shap_waterfall_plot.png")
-                        
-                        # 添加简要解释 - 更紧凑，使用浅色背景
-                        st.markdown("""
-                        <div style="background-color: #f0f7ff; padding: 5px; border-radius: 3px; margin-top: 3px; font-size: 0.8rem; border: 1px solid #dce8fa; font-family: 'Microsoft YaHei', sans-serif;">
-                          <p style="margin:0; font-family: 'Microsoft YaHei', sans-serif;"><strong>图表解释:</strong> 红色条表示该特征增加死亡风险，蓝色条表示该特征降低死亡风险。数值表示对预测结果的贡献大小。</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                except Exception as shap_error:
-                    st.error(f"生成SHAP图时出错: {str(shap_error)}")
-                    st.warning("无法生成SHAP解释图，请联系技术支持。")
+                # SHAP值和瀑布图在后台线程中计算，页面其余部分先显示，脚本末尾再把结果填入占位区域
+                explanation_placeholder = st.empty()
+                explanation_placeholder.caption("正在生成SHAP解释图...")
+                cached_shap_values = cached_entry.get('shap_values')
+                explanation_job = get_explanation_service().submit(
+                    explanation_owner, (model_version, cache_key),
+                    partial(compute_explanation, predictor, features_df, cached_shap_values))
                 
             except Exception as e:
+                metrics.increment("prediction_errors_total", stage="forest")
                 st.error(f"预测过程中发生错误: {str(e)}")
                 st.warning("请检查输入数据是否与模型期望的特征匹配，或联系开发人员获取支持。")
         st.markdown('</div>', unsafe_allow_html=True)
@@ -671,10 +583,290 @@ with col2:
         # 当没有点击预测按钮时，不显示任何内容
         pass
 
+# 假设分析 - 其他输入保持不变，沿特征取值范围生成网格，一次批量预测得到整条风险曲线或热图
+with st.expander("假设分析（What-if）"):
+    show_what_if = st.checkbox("显示假设分析", value=False, disabled=model is None,
+                               help="其他特征保持当前输入不变，查看某个特征变化时死亡风险如何变化")
+    if show_what_if and model is not None:
+        what_if_mode = st.radio("分析方式", ["单特征风险曲线", "双特征风险热图"], horizontal=True)
+        if what_if_mode == "单特征风险曲线":
+            sweep_name = st.selectbox("变化的特征", feature_input_order)
+            grid, risk = sweep_feature(predictor, feature_values, sweep_name)
+            current_value = feature_values[sweep_name]
+            st.plotly_chart(build_risk_curve(grid, risk, sweep_name, current_value,
+                                             risk_at(grid, risk, current_value),
+                                             unit=feature_ranges[sweep_name]["unit"],
+                                             categorical=feature_ranges[sweep_name]["type"] == "categorical"),
+                            use_container_width=True)
+        else:
+            pair_col1, pair_col2 = st.columns(2)
+            with pair_col1:
+                feature_x = st.selectbox("横轴特征", feature_input_order, index=0)
+            with pair_col2:
+                feature_y = st.selectbox("纵轴特征", feature_input_order, index=1)
+            if feature_x == feature_y:
+                st.warning("请选择两个不同的特征")
+            else:
+                grid_x, grid_y, risk = sweep_pair(predictor, feature_values, feature_x, feature_y)
+                st.plotly_chart(build_risk_heatmap(grid_x, grid_y, risk, feature_x, feature_y,
+                                                   feature_values[feature_x], feature_values[feature_y]),
+                                use_container_width=True)
+
+# 反事实分析 - 在可调整的特征上搜索使风险类别降低的最小调整，其余特征保持不变
+with st.expander("降低风险的调整方案（反事实分析）"):
+    counterfactual_features = st.multiselect(
+        "可调整的特征", feature_input_order,
+        default=[f for f in DEFAULT_MODIFIABLE_FEATURES if f in feature_input_order],
+        help="只在这些特征上搜索调整方案，年龄、TNM分期等其余特征保持当前输入不变")
+    counterfactual_button = st.button("搜索调整方案", disabled=model is None or not counterfactual_features)
+    if counterfactual_button and model is not None:
+        with st.spinner("正在搜索..."):
+            search = search_counterfactuals(predictor, feature_values, counterfactual_features)
+        # 搜索未完成的原因：时间预算用尽，或组合过多时每个特征只保留了离当前值最近的候选
+        incomplete = "、".join(reason for reason, flag in (
+            ("已达到时间预算", search.timed_out),
+            ("组合过多，只搜索了离当前值最近的取值", search.truncated)) if flag)
+        if search.current_category == "低风险":
+            st.info(f"当前预测死亡风险 {search.current_risk_percent:.1f}%，已属于低风险")
+        elif not search.solutions:
+            st.warning(f"在所选特征的取值范围内未找到能降低风险类别的调整"
+                       f"{'' if search.complete else f'（{incomplete}，搜索未完成）'}")
+        else:
+            st.caption(f"当前 {search.current_category}（{search.current_risk_percent:.1f}%）｜ "
+                       f"评估 {search.evaluated} 个候选，耗时 {search.elapsed_ms:.0f} ms"
+                       f"{'' if search.complete else f'｜{incomplete}，结果可能不是最小调整'}")
+            st.table({
+                "调整方案": ["；".join(f"{f}: {old:g} → {new:g}" for f, (old, new) in s.changes.items())
+                             for s in search.solutions],
+                "预测死亡风险": [f"{s.death_risk_percent:.1f}%" for s in search.solutions],
+                "风险类别": [s.risk_category for s in search.solutions],
+            })
+            st.caption("仅表示模型预测随输入变化的规律，不代表临床干预的效果。")
+
+# 多模型对比 - 用最近一次提交的输入在多个模型上评分：各模型的森林拼接后一次遍历，并列出各模型的SHAP贡献
+if len(model_entries) > 1:
+    with st.expander("多模型对比"):
+        compare_models = st.multiselect(
+            "参与对比的模型", list(model_entries), default=list(model_entries)[:model_registry.max_resident + 1],
+            format_func=lambda name: model_entries[name].label,
+            help=f"同时驻留内存的模型最多 {model_registry.max_resident} 个（不含默认模型），超过时分组依次加载评分")
+        # 其他模型需要、当前模型未使用的特征在此补充输入，默认值取自首个需要该特征的模型的schema
+        compare_record = dict(feature_values)
+        extra_features = {}
+        for name in compare_models:
+            for feature, properties in model_entries[name].ranges.items():
+                if feature not in compare_record:
+                    extra_features.setdefault(feature, properties)
+        if extra_features:
+            st.caption("以下特征当前模型未使用，仅用于对比：")
+            extra_columns = st.columns(min(3, len(extra_features)))
+            for i, (feature, properties) in enumerate(extra_features.items()):
+                with extra_columns[i % len(extra_columns)]:
+                    if properties["type"] == "numerical":
+                        compare_record[feature] = st.number_input(
+                            feature, min_value=float(properties["min"]), max_value=float(properties["max"]),
+                            value=float(properties["default"]), step=0.1, key=f"compare_{feature}",
+                            help=f"{properties['description']} ({properties['min']}-{properties['max']} {properties['unit']})")
+                    else:
+                        compare_record[feature] = st.selectbox(
+                            feature, properties["options"], index=properties["options"].index(properties["default"]),
+                            key=f"compare_{feature}", help=properties["description"])
+        compare_button = st.button("开始对比", disabled=model is None or len(compare_models) < 2)
+        if compare_button and model is not None:
+            with st.spinner("正在加载模型并评分..."):
+                comparison = model_registry.compare(compare_record, compare_models, explain=True)
+            scored = [score for score in comparison if score.error is None]
+            if scored:
+                st.plotly_chart(build_model_comparison(
+                    [score.label for score in scored],
+                    [score.result['death_risk_percent'] for score in scored],
+                    [score.result['tree_spread']['p10_percent'] for score in scored],
+                    [score.result['tree_spread']['p90_percent'] for score in scored]), use_container_width=True)
+                st.table({
+                    "模型": [score.label for score in scored],
+                    "版本": [score.version for score in scored],
+                    "死亡风险": [f"{score.result['death_risk_percent']:.1f}%" for score in scored],
+                    "风险类别": [score.result['risk_category'] for score in scored],
+                    "树间波动 (P10-P90)": [f"{score.result['tree_spread']['p10_percent']:.1f}% - "
+                                          f"{score.result['tree_spread']['p90_percent']:.1f}%" for score in scored],
+                    "提示": ["；".join(score.result['warnings']) or "—" for score in scored],
+                })
+                # 各模型的SHAP贡献按特征并列，模型未使用的特征显示为“—”
+                contributions = {score.label: score.result['explanation']['contributions'] for score in scored}
+                compared_features = list(dict.fromkeys(f for values in contributions.values() for f in values))
+                st.table({"特征": compared_features,
+                          **{label: [f"{values[f]:+.3f}" if f in values else "—" for f in compared_features]
+                             for label, values in contributions.items()}})
+            for score in comparison:
+                if score.error is not None:
+                    st.warning(f"{score.label}: {score.error}")
+
+# 队列整体解释 - 多进程计算整个队列的SHAP值，结果按模型和队列内容存盘，再次打开同一队列直接读取
+with st.expander("队列整体解释（全局SHAP）"):
+    cohort_file = st.file_uploader("上传患者特征文件 (CSV 或 Parquet)", type=["csv", "parquet"],
+                                   key="cohort_explain_file")
+    cohort_button = st.button("计算全局解释", disabled=cohort_file is None or model is None)
+    if cohort_button and cohort_file is not None and model is not None:
+        try:
+            cohort_frame = pd.concat(iter_input_chunks(cohort_file), ignore_index=True)
+            cohort_features, cohort_dropped = prepare_cohort(cohort_frame, feature_input_order, feature_ranges)
+            cohort_progress = st.progress(0.0, text="正在计算SHAP值...")
+            cohort_explanation = explain_cohort(
+                cohort_features, predictor.model_path, model_hash=predictor.version,
+                progress=lambda done, total: cohort_progress.progress(done / total, text=f"已解释 {done}/{total} 行"))
+            cohort_progress.empty()
+            st.session_state['cohort_explanation'] = (predictor.version, cohort_dropped, cohort_explanation)
+        except ValueError as e:
+            st.error(str(e))
+    # 结果保存在会话中，切换依赖图特征时不必重新计算
+    stored_cohort = st.session_state.get('cohort_explanation')
+    if stored_cohort is not None and model is not None and stored_cohort[0] == predictor.version:
+        _, cohort_dropped, cohort_explanation = stored_cohort
+        st.caption(f"{len(cohort_explanation.features)} 名患者"
+                   f"{f'（去掉 {cohort_dropped} 行缺失或超出范围）' if cohort_dropped else ''} ｜ "
+                   f"{'读取已保存的结果' if cohort_explanation.from_store else '新计算'}，"
+                   f"耗时 {cohort_explanation.elapsed_ms / 1000:.2f} s")
+        cohort_importance = global_importance(cohort_explanation)
+        st.plotly_chart(build_shap_importance(cohort_importance), use_container_width=True)
+        st.plotly_chart(build_shap_beeswarm(cohort_explanation.shap_values, cohort_explanation.features,
+                                            order=list(cohort_importance.index)),
+                        use_container_width=True)
+        dependence_col1, dependence_col2 = st.columns(2)
+        with dependence_col1:
+            dependence_feature = st.selectbox("依赖图特征", list(cohort_importance.index))
+        with dependence_col2:
+            dependence_color = st.selectbox("着色特征", ["无"] + [f for f in cohort_importance.index
+                                                                if f != dependence_feature])
+        st.plotly_chart(build_shap_dependence(cohort_explanation.shap_values, cohort_explanation.features,
+                                              dependence_feature,
+                                              None if dependence_color == "无" else dependence_color),
+                        use_container_width=True)
+
+# 批量队列评分 - 上传整个随访队列，按分块一次性送入模型
+with st.expander("批量队列评分"):
+    uploaded_file = st.file_uploader("上传患者特征文件 (CSV 或 Parquet)", type=["csv", "parquet"])
+    chunk_size = st.number_input("每批处理行数", min_value=100, max_value=100000,
+                                 value=DEFAULT_CHUNK_SIZE, step=100)
+    batch_button = st.button("开始批量评分", disabled=uploaded_file is None or model is None)
+    if batch_button and uploaded_file is not None and model is not None:
+        output_buffer = io.BytesIO()
+        progress_text = st.empty()
+        try:
+            with st.spinner("正在批量评分..."):
+                summary = score_file(predictor.model, uploaded_file, output_buffer, chunk_size=int(chunk_size),
+                                     output_format="csv",
+                                     progress=lambda rows: progress_text.text(f"已评分 {rows} 行"),
+                                     ranges=predictor.ranges)
+            st.success(f"评分完成，共 {summary['rows']} 行："
+                       f"低风险 {summary['低风险']}，中等风险 {summary['中等风险']}，"
+                       f"高风险 {summary['高风险']}，数据缺失 {summary['数据缺失']}，数据无效 {summary['数据无效']}")
+            st.download_button("下载评分结果 (CSV)", data=output_buffer.getvalue(),
+                               file_name="cohort_scores.csv", mime="text/csv")
+        except ValueError as e:
+            st.error(str(e))
+
 # 添加页脚说明
 st.markdown("""
 <div class="disclaimer">
     <p style="font-family: 'Microsoft YaHei', sans-serif;">📋 免责声明：本预测工具仅供临床医生参考，不能替代专业医疗判断。预测结果应结合患者的完整临床情况进行综合评估。</p>
     <p style="font-family: 'Microsoft YaHei', sans-serif;">© 2025 | 开发版本 v1.1.0</p>
 </div>
-""", unsafe_allow_html=True) 
\ No newline at end of file
+""", unsafe_allow_html=True) 
+
+# 填入后台计算的预测解释。等待期间定时刷新状态文字：每次刷新都是Streamlit处理重新运行请求的时机，
+# 输入发生变化时等待在此被打断，finally中取消尚未完成的任务
+if explanation_job is not None:
+    try:
+        waited = 0.0
+        while True:
+            try:
+                shap_values, waterfall_fig, worker_stages = explanation_job.result(timeout=EXPLANATION_POLL_SECONDS)
+                break
+            except FuturesTimeoutError:
+                waited += EXPLANATION_POLL_SECONDS
+                explanation_placeholder.caption(f"正在生成SHAP解释图... {waited:.1f} s")
+        timer.merge(worker_stages)
+        if cached_shap_values is None:
+            get_prediction_cache().put(cache_key, model_version, shap_values=shap_values)
+        with explanation_placeholder.container():
+            with timer.stage("encode"):
+                st.plotly_chart(waterfall_fig, use_container_width=True)
+            
+            # 添加简要解释 - 更紧凑，使用浅色背景
+            st.markdown("""
+            <div style="background-color: #f0f7ff; padding: 5px; border-radius: 3px; margin-top: 3px; font-size: 0.8rem; border: 1px solid #dce8fa; font-family: 'Microsoft YaHei', sans-serif;">
+              <p style="margin:0; font-family: 'Microsoft YaHei', sans-serif;"><strong>图表解释:</strong> 红色条表示该特征增加死亡风险，蓝色条表示该特征降低死亡风险。数值表示对预测结果的贡献大小。</p>
+            </div>
+            """, unsafe_allow_html=True)
+    except Exception as shap_error:
+        metrics.increment("prediction_errors_total", stage="shap")
+        with explanation_placeholder.container():
+            st.error(f"生成SHAP图时出错: {str(shap_error)}")
+            st.warning("无法生成SHAP解释图，请联系技术支持。")
+    finally:
+        if not explanation_job.done():
+            explanation_job.cancel()
+
+# 写入结构化耗时日志和指标
+if predict_button and model is not None:
+    metrics.increment("prediction_requests_total")
+    if cache_hit:
+        metrics.increment("prediction_cache_hits_total")
+    metrics.observe_request(timer)
+    st.session_state['last_timings'] = timer.log(model_version=predictor.version, cache_hit=cache_hit,
+                                               fast_mode=fast_mode)
+
+# 侧边栏显示结果缓存命中统计
+cache_stats = get_prediction_cache().stats()
+with cache_stats_placeholder.container():
+    st.markdown("### 结果缓存")
+    st.caption(f"命中 {cache_stats['hits']} ｜ 未命中 {cache_stats['misses']} ｜ "
+               f"命中率 {cache_stats['hit_rate']:.0%} ｜ 条目 {cache_stats['size']}/{cache_stats['max_entries']}")
+
+# 记录本会话状态的大小，超过上限时丢弃可重新计算的结果
+memory_guard = get_memory_guard()
+session_state_bytes, dropped_state = memory_guard.trim_session(explanation_owner, st.session_state,
+                                                               SESSION_DROPPABLE_KEYS)
+if dropped_state:
+    st.sidebar.warning("本会话保存的结果过大，已释放队列整体解释等结果，需要时请重新计算")
+
+# 侧边栏调试面板
+if show_debug:
+    with debug_placeholder.container():
+        last_timings = st.session_state.get('last_timings')
+        if last_timings:
+            risk_shown_ms = last_timings.get('marks_ms', {}).get('risk_shown')
+            st.caption(f"最近一次预测耗时 {last_timings['total_ms']:.1f} ms"
+                       f"{'（命中缓存）' if last_timings.get('cache_hit') else ''}"
+                       f"{f'，风险数值在 {risk_shown_ms:.1f} ms 时显示' if risk_shown_ms is not None else ''}")
+            st.table({"阶段": list(last_timings['stages_ms']),
+                      "耗时 (ms)": [f"{v:.2f}" for v in last_timings['stages_ms'].values()]})
+        else:
+            st.caption("尚无预测记录")
+        audit_log = get_audit_log()
+        if audit_log is not None:
+            audit_stats = audit_log.stats()
+            st.caption(f"审计日志: 已写入 {audit_stats['written']} 条 ｜ 排队 {audit_stats['queued']} ｜ "
+                       f"丢弃 {audit_stats['dropped']}（无法序列化 {audit_stats['invalid']}）｜ 重试 {audit_stats['retries']}")
+            if audit_stats['last_error']:
+                st.warning(f"审计日志写入失败: {audit_stats['last_error']}")
+        if len(model_entries) > 1:
+            registry_stats = model_registry.stats()
+            st.caption(f"模型注册表: 驻留 {'、'.join(registry_stats['resident']) or '无'}"
+                       f"（上限 {registry_stats['max_resident']}）｜ 加载 {registry_stats['loads']} 次 ｜ "
+                       f"淘汰 {registry_stats['evictions']} 次")
+        for file_name, error in model_registry.errors.items():
+            st.warning(f"模型目录中的 {file_name} 未注册: {error}")
+        # 进程内存取自后台最近一次检查
+        memory_status = memory_guard.status()
+        figure_counts = "、".join(f"{library} {count}" for library, count in memory_status['figures'].items())
+        st.caption(f"内存: 进程 {(memory_status['rss_bytes'] or 0) / 2**20:.0f} MB"
+                   f"（峰值 {(memory_status['peak_rss_bytes'] or 0) / 2**20:.0f} MB）｜ "
+                   f"本会话状态 {session_state_bytes / 1024:.0f} KB ｜ 活动会话 {memory_status['sessions']} ｜ "
+                   f"存活图表 {figure_counts or '无'}")
+        if memory_status['level'] != 'ok':
+            st.warning(f"进程内存超过{'清理' if memory_status['level'] == 'cleanup' else '告警'}阈值")
+        memory_growth = memory_guard.top_growth(5)
+        if memory_growth:
+            st.table({"代码位置": [where for where, _, _ in memory_growth],
+                      "增长 (KB)": [f"{size / 1024:.0f}" for _, size, _ in memory_growth]})
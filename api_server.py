@@ -0,0 +1,338 @@
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from audit_log import AUDIT_DB_PATH, AuditLog
+from forest_engine import take_rows
+from model_core import MODEL_PATH
+from model_registry import MODEL_REGISTRY_DIR, MODEL_REGISTRY_MAX_RESIDENT, ModelRegistry
+from model_reload import DEFAULT_POLL_INTERVAL, ModelReloader
+
+# 微批次的等待窗口和最大行数：窗口内到达的并发请求合并为一次森林遍历和一次SHAP计算
+DEFAULT_BATCH_WAIT_MS = 5
+DEFAULT_MAX_BATCH = 256
+
+# 请求体大小上限，防止异常请求占用内存
+MAX_BODY_BYTES = 1 << 20
+
+# 请求线程等待批次结果的最长时间（秒），超时返回504
+DEFAULT_RESULT_TIMEOUT = 30
+
+logger = logging.getLogger("prediction.api")
+
+
+# 批次处理本身出错（不是某条记录的格式问题）时，该批次中尚未完成的请求得到此异常，接口返回503
+class BatchFailed(RuntimeError):
+    pass
+
+
+# 把并发的单患者请求在很短的时间窗口内合并为一个批次
+class MicroBatcher:
+    def __init__(self, predictor, batch_wait_ms=DEFAULT_BATCH_WAIT_MS, max_batch=DEFAULT_MAX_BATCH, audit=None):
+        self.predictor = predictor
+        # 可选的审计日志，每条结果放入其队列，由后台线程写库
+        self.audit = audit
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_batch = max_batch
+        self.batches = 0
+        self.rows = 0
+        self.failed_batches = 0
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    # 提交一条患者记录，返回在批次完成后得到结果的Future；predictor为None时使用当前的默认模型
+    def submit(self, record, explain=False, predictor=None):
+        future = Future()
+        self._queue.put((record, explain, predictor, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    # 阻塞等待第一条请求，然后在等待窗口内尽量多收集请求
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    # 批次处理中的任何异常都只影响本批次：记录日志并让其中尚未完成的请求失败，处理线程继续运行
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                self._process(batch)
+            except Exception as e:
+                self.failed_batches += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.exception("处理微批次时出错")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(BatchFailed(f"批次处理失败: {self.last_error}"))
+
+    def alive(self):
+        return self._thread.is_alive()
+
+    # 同一窗口内的请求按模型分组，每个模型各做一次森林遍历和一次SHAP计算
+    def _process(self, batch):
+        groups = {}
+        for record, explain, predictor, future in batch:
+            groups.setdefault(predictor, []).append((record, explain, future))
+        for predictor, items in groups.items():
+            # 默认模型的整组请求使用同一个预测核心；热更新替换self.predictor时，本组仍在旧版本上完成
+            self._process_model(predictor or self.predictor, items)
+
+    def _process_model(self, predictor, batch):
+        # 逐条校验，格式错误的请求单独返回错误，不影响同批次的其他请求
+        valid = []
+        for record, explain, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                predictor.frame([record])
+                valid.append((record, explain, future))
+            except (ValueError, TypeError) as e:
+                future.set_exception(e)
+        if not valid:
+            return
+
+        start = time.perf_counter()
+        try:
+            features_df = predictor.frame([record for record, _, _ in valid])
+            # 整个批次只做一次森林遍历
+            prediction = predictor.predict(features_df)
+            # 需要解释的行合并为一次SHAP计算
+            explain_rows = [i for i, (_, explain, _) in enumerate(valid) if explain]
+            plain_rows = [i for i, (_, explain, _) in enumerate(valid) if not explain]
+            results = [None] * len(valid)
+            if explain_rows:
+                subset = features_df.iloc[explain_rows]
+                explained = predictor.results(subset, take_rows(prediction, explain_rows),
+                                              predictor.explain(subset))
+                for i, result in zip(explain_rows, explained):
+                    results[i] = result
+            if plain_rows:
+                plain = predictor.results(features_df.iloc[plain_rows], take_rows(prediction, plain_rows))
+                for i, result in zip(plain_rows, plain):
+                    results[i] = result
+        except Exception as e:
+            for _, _, future in valid:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.rows += len(valid)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for (_, _, future), result in zip(valid, results):
+            future.set_result(result)
+        # 结果返回之后再放入审计队列；审计出错只记录日志，不影响已返回的结果
+        if self.audit is not None:
+            try:
+                values = features_df.to_numpy()
+                for row, ((_, explain, _), result) in enumerate(zip(valid, results)):
+                    self.audit.record("api", predictor.version, dict(zip(predictor.feature_order, values[row])),
+                                      result["death_risk_percent"], result["risk_category"],
+                                      elapsed_ms=elapsed_ms, batch_size=len(valid), explain=explain)
+            except Exception:
+                logger.exception("放入审计队列时出错")
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+            "failed_batches": self.failed_batches,
+            "last_error": self.last_error,
+        }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # 由make_server注入
+    batcher = None
+    registry = None
+    result_timeout = DEFAULT_RESULT_TIMEOUT
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # 按名称取注册表中的模型，未指定时返回None（使用当前的默认模型）；首次使用的模型在请求线程中加载
+    def _predictor(self, name):
+        if not name:
+            return None
+        if self.registry is None:
+            raise ValueError("未配置模型目录，不能指定模型")
+        return self.registry.get(name)
+
+    # GET /schema?model=名称 返回指定模型的特征定义
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            if url.path == "/health":
+                # 批处理线程已退出时所有预测都无法完成，健康检查返回503
+                alive = self.batcher.alive()
+                self._send_json(200 if alive else 503, {
+                    "status": "ok" if alive else "error",
+                    "model_version": self.batcher.predictor.version,
+                    "batching": self.batcher.stats(),
+                    "registry": self.registry.stats() if self.registry is not None else None,
+                })
+            elif url.path == "/schema":
+                predictor = self._predictor(parse_qs(url.query).get("model", [None])[0]) or self.batcher.predictor
+                self._send_json(200, {"model_version": predictor.version, "feature_order": predictor.feature_order,
+                                      "features": predictor.input_ranges})
+            elif url.path == "/models" and self.registry is not None:
+                self._send_json(200, {"models": self.registry.describe(), "registry": self.registry.stats()})
+            else:
+                self._send_json(404, {"error": f"未知路径: {self.path}"})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": f"加载模型时发生错误: {e}"})
+
+    # POST /predict
+    #   {"patient": {...}, "explain": true, "model": "名称"}  -> 单个结果，不指定model时使用默认模型
+    #   {"patients": [{...}, ...], "explain": false}         -> 结果列表
+    # POST /compare
+    #   {"patient": {...}, "models": ["名称", ...], "explain": true} -> 各模型的结果，不指定models时使用全部模型
+    def do_POST(self):
+        if self.path not in ("/predict", "/compare") or (self.path == "/compare" and self.registry is None):
+            self._send_json(404, {"error": f"未知路径: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_BODY_BYTES:
+                self._send_json(413, {"error": "请求体过大"})
+                return
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            explain = bool(payload.get("explain", False))
+            if self.path == "/compare":
+                if "patient" not in payload:
+                    self._send_json(400, {"error": "请求体需要包含 patient"})
+                    return
+                names = payload.get("models") or list(self.registry.entries())
+                scores = self.registry.compare(payload["patient"], names, explain)
+                self._send_json(200, {"results": [score._asdict() for score in scores]})
+                return
+            predictor = self._predictor(payload.get("model"))
+            deadline = time.monotonic() + self.result_timeout
+            if "patients" in payload:
+                futures = [self.batcher.submit(record, explain, predictor) for record in payload["patients"]]
+                self._send_json(200, {"results": [self._record_result(future, deadline) for future in futures]})
+            elif "patient" in payload:
+                future = self.batcher.submit(payload["patient"], explain, predictor)
+                self._send_json(200, future.result(timeout=max(deadline - time.monotonic(), 0)))
+            else:
+                self._send_json(400, {"error": "请求体需要包含 patient 或 patients"})
+        except FutureTimeoutError:
+            self._send_json(504, {"error": f"等待预测结果超过 {self.result_timeout} 秒"})
+        except BatchFailed as e:
+            self._send_json(503, {"error": str(e)})
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": f"预测过程中发生错误: {e}"})
+
+    # 批量请求中格式错误的记录只在对应位置返回错误，其余记录照常给出结果
+    @staticmethod
+    def _record_result(future, deadline):
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except (ValueError, TypeError, AttributeError) as e:
+            return {"error": str(e)}
+
+    def log_message(self, format, *args):
+        pass
+
+
+# 默认的监听队列只有5，并发客户端较多时会被拒绝连接
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def make_server(predictor, host="127.0.0.1", port=8600,
+                batch_wait_ms=DEFAULT_BATCH_WAIT_MS, max_batch=DEFAULT_MAX_BATCH, audit=None, registry=None,
+                result_timeout=DEFAULT_RESULT_TIMEOUT):
+    batcher = MicroBatcher(predictor, batch_wait_ms, max_batch, audit)
+    handler = type("BoundPredictionHandler", (PredictionHandler,),
+                   {"batcher": batcher, "registry": registry, "result_timeout": result_timeout})
+    server = PredictionServer((host, port), handler)
+    return server, batcher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="胃癌术后生存预测 - 本地HTTP JSON接口（请求微批处理）")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--batch-wait-ms", type=float, default=DEFAULT_BATCH_WAIT_MS, help="微批次等待窗口 (毫秒)")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="单个微批次的最大行数")
+    parser.add_argument("--reload-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="检查模型文件更新的间隔 (秒)，0 表示不做热更新")
+    parser.add_argument("--audit-db", default=AUDIT_DB_PATH, help="预测审计库路径，空字符串表示不记录")
+    parser.add_argument("--models-dir", default=MODEL_REGISTRY_DIR, help="多模型目录，请求中可用model字段指定其中的模型")
+    parser.add_argument("--max-resident", type=int, default=MODEL_REGISTRY_MAX_RESIDENT,
+                        help="同时驻留内存的模型数上限（不含默认模型）")
+    parser.add_argument("--result-timeout", type=float, default=DEFAULT_RESULT_TIMEOUT,
+                        help="等待预测结果的最长时间 (秒)，超时返回504")
+    args = parser.parse_args(argv)
+
+    reloader = ModelReloader(args.model, poll_interval=args.reload_interval)
+    predictor = reloader.current
+    audit = AuditLog(args.audit_db) if args.audit_db else None
+    registry = ModelRegistry(args.models_dir, args.max_resident, default=lambda: reloader.current,
+                             default_path=args.model)
+    server, batcher = make_server(predictor, args.host, args.port, args.batch_wait_ms, args.max_batch, audit,
+                                  registry, args.result_timeout)
+    if args.reload_interval > 0:
+        reloader.on_swap = lambda new, old: setattr(batcher, "predictor", new)
+        reloader.start()
+    print(f"模型版本 {predictor.version}，监听 http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        reloader.stop()
+        batcher.close()
+        if audit is not None:
+            audit.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
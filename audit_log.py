@@ -0,0 +1,270 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import pandas as pd
+
+# 审计库路径，可通过环境变量覆盖；设为空字符串则不记录
+AUDIT_DB_PATH = os.environ.get("PREDICTION_AUDIT_DB", "prediction_audit.db")
+
+# 后台写入：攒够一批或距上次写入超过间隔（秒）时写入一次
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# 队列上限；写入跟不上时丢弃新记录并计数，绝不阻塞预测请求
+DEFAULT_MAX_QUEUE = 100000
+
+# 数据库被锁等暂时性错误时保留待写记录并重试，间隔从RETRY_DELAY起逐次加倍，不超过MAX_RETRY_DELAY（秒）
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+
+# 停止时仍写不进去的记录最多再重试的次数，之后计入丢弃
+CLOSE_RETRIES = 5
+
+logger = logging.getLogger("prediction.audit")
+
+# 只追加的审计表：触发器拒绝修改和删除已有记录
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    death_risk_percent REAL NOT NULL,
+    risk_category TEXT NOT NULL,
+    elapsed_ms REAL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at);
+CREATE TRIGGER IF NOT EXISTS predictions_no_update BEFORE UPDATE ON predictions
+BEGIN SELECT RAISE(ABORT, 'predictions is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS predictions_no_delete BEFORE DELETE ON predictions
+BEGIN SELECT RAISE(ABORT, 'predictions is append-only'); END;
+"""
+
+_INSERT = """
+INSERT INTO predictions (created_at, source, model_version, inputs, death_risk_percent, risk_category,
+                         elapsed_ms, details)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def connect(path=AUDIT_DB_PATH):
+    connection = sqlite3.connect(path)
+    # WAL模式下查询和导出不阻塞后台写入
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+# 预测审计日志：请求路径上只把记录放入队列，序列化和写库都在后台线程中批量完成
+class AuditLog:
+    def __init__(self, path=AUDIT_DB_PATH, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_queue=DEFAULT_MAX_QUEUE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.written = 0
+        # 丢弃的记录总数（队列满、无法序列化、写入出现不可重试的错误），其中无法序列化的单独计入invalid
+        self.dropped = 0
+        self.invalid = 0
+        self.retries = 0
+        self.last_error = None
+        self._queue = queue.Queue(max_queue)
+        # 已从队列取出并序列化、等待写入的行
+        self._pending = []
+        # 先建表，路径不可写等问题在启动时就暴露出来
+        connect(path).close()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # 记录一次预测。inputs为 特征名 -> 取值，details中的其他信息（耗时分阶段、是否命中缓存等）原样存为JSON
+    def record(self, source, model_version, inputs, death_risk_percent, risk_category, elapsed_ms=None,
+               **details):
+        try:
+            self._queue.put_nowait((time.time(), source, model_version, inputs, death_risk_percent, risk_category,
+                                    elapsed_ms, details))
+        except queue.Full:
+            self.dropped += 1
+
+    # 阻塞等待第一条记录，然后在不超过批大小的前提下取走队列中已有的记录
+    def _collect(self):
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        while first is not None and len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    @staticmethod
+    def _row(item):
+        created_at, source, model_version, inputs, risk, category, elapsed_ms, details = item
+        return (created_at, source, model_version,
+                json.dumps({k: float(v) for k, v in inputs.items()}, ensure_ascii=False),
+                float(risk), str(category), None if elapsed_ms is None else float(elapsed_ms),
+                json.dumps(details, ensure_ascii=False, default=float) if details else None)
+
+    # 逐条序列化，无法序列化的记录单独丢弃并计数，不影响同批次的其他记录
+    def _add_pending(self, item):
+        try:
+            self._pending.append(self._row(item))
+        except Exception as e:
+            self.invalid += 1
+            self.dropped += 1
+            logger.warning("审计记录无法序列化，已丢弃: %s: %s", type(e).__name__, e)
+            return
+        # 长时间写不进去时待写行也不能无限增长，超过队列上限的部分从最早的开始丢弃
+        overflow = len(self._pending) - self.max_queue
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+
+    # 写入待写的行，成功返回True；数据库被锁等暂时性错误返回False，行保留在待写列表中稍后重试
+    def _write(self, connection):
+        try:
+            with connection:
+                connection.executemany(_INSERT, self._pending)
+        except sqlite3.OperationalError as e:
+            self.retries += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning("写入审计日志失败，%d 条记录稍后重试: %s", len(self._pending), self.last_error)
+            return False
+        except Exception as e:
+            # 其他错误重试也无法恢复，丢弃并计数，不影响预测服务
+            self.dropped += len(self._pending)
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.error("写入审计日志失败，丢弃 %d 条记录: %s", len(self._pending), self.last_error)
+        else:
+            self.written += len(self._pending)
+            self.last_error = None
+        self._pending = []
+        return True
+
+    def _run(self):
+        connection = connect(self.path)
+        last_flush = time.monotonic()
+        retry_delay = 0.0
+        stopping = False
+        while not stopping:
+            for item in self._collect():
+                if item is None:
+                    stopping = True
+                else:
+                    self._add_pending(item)
+            now = time.monotonic()
+            due = len(self._pending) >= self.batch_size or now - last_flush >= self.flush_interval
+            if self._pending and (stopping or due) and now - last_flush >= retry_delay:
+                if self._write(connection):
+                    retry_delay = 0.0
+                else:
+                    retry_delay = min(max(retry_delay * 2, RETRY_DELAY), MAX_RETRY_DELAY)
+                last_flush = time.monotonic()
+        for attempt in range(CLOSE_RETRIES):
+            if not self._pending or self._write(connection):
+                break
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+        if self._pending:
+            self.dropped += len(self._pending)
+            logger.error("停止时仍无法写入审计日志，丢弃 %d 条记录: %s", len(self._pending), self.last_error)
+            self._pending = []
+        connection.close()
+
+    # 写出队列中剩余的记录并停止后台线程
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "invalid": self.invalid, "retries": self.retries,
+                "queued": self._queue.qsize() + len(self._pending), "last_error": self.last_error}
+
+
+# 本地时间字符串（如 2026-10-01 或 2026-10-01 08:00）转为Unix时间戳
+def _timestamp(text):
+    return time.mktime(pd.Timestamp(text).timetuple()) if text else None
+
+
+# 按条件读取审计记录，输入特征展开为列
+def query(path=AUDIT_DB_PATH, since=None, until=None, model_version=None, source=None, risk_category=None,
+          limit=None):
+    conditions, params = [], []
+    for clause, value in (("created_at >= ?", _timestamp(since)), ("created_at < ?", _timestamp(until)),
+                          ("model_version = ?", model_version), ("source = ?", source),
+                          ("risk_category = ?", risk_category)):
+        if value is not None:
+            conditions.append(clause)
+            params.append(value)
+    sql = "SELECT * FROM predictions"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    connection = connect(path)
+    try:
+        records = pd.read_sql_query(sql, connection, params=params)
+    finally:
+        connection.close()
+    inputs = pd.DataFrame([json.loads(v) for v in records.pop("inputs")], index=records.index)
+    records.insert(1, "time", [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) for t in records["created_at"]])
+    return pd.concat([records, inputs], axis=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="预测审计日志 - 查询、汇总和导出")
+    parser.add_argument("--db", default=AUDIT_DB_PATH, help="审计库路径")
+    parser.add_argument("--since", help="起始时间（含），如 2026-10-01")
+    parser.add_argument("--until", help="结束时间（不含）")
+    parser.add_argument("--model-version", help="只看某个模型版本")
+    parser.add_argument("--source", choices=["app", "api"], help="只看某个来源")
+    parser.add_argument("--risk-category", choices=["低风险", "中等风险", "高风险"])
+    parser.add_argument("--limit", type=int, default=None, help="最多读取的记录数")
+    parser.add_argument("--export", default=None, help="导出到文件 (.csv / .parquet / .jsonl)")
+    parser.add_argument("--summary", action="store_true", help="按模型版本和风险类别汇总")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"审计库 {args.db} 不存在", file=sys.stderr)
+        return 1
+    records = query(args.db, args.since, args.until, args.model_version, args.source, args.risk_category,
+                    args.limit)
+    if args.export:
+        if args.export.endswith(".parquet"):
+            records.to_parquet(args.export, index=False)
+        elif args.export.endswith(".jsonl"):
+            records.to_json(args.export, orient="records", lines=True, force_ascii=False)
+        else:
+            records.to_csv(args.export, index=False, encoding="utf-8-sig")
+        print(f"已导出 {len(records)} 条记录到 {args.export}")
+    elif args.summary:
+        summary = records.groupby(["model_version", "risk_category"]).agg(
+            predictions=("id", "size"), mean_risk=("death_risk_percent", "mean"),
+            p95_elapsed_ms=("elapsed_ms", lambda s: s.quantile(0.95)))
+        print(summary.to_string())
+    else:
+        print(records.drop(columns=["created_at", "details"]).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
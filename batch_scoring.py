@@ -0,0 +1,246 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from forest_engine import FlatForest
+from model_core import (MODEL_PATH, feature_ranges, load_model_file, model_feature_order,
+                        numeric_values, risk_categories, synthetic_patients, validate_features)
+
+# 默认每个分块的行数，决定批量评分时的内存上限
+DEFAULT_CHUNK_SIZE = 5000
+
+# 不送入模型的行的类别：特征缺失，或取值不是有限数值（inf、1e400等）
+MISSING_CATEGORY = "数据缺失"
+INVALID_CATEGORY = "数据无效"
+SUMMARY_CATEGORIES = ("低风险", "中等风险", "高风险", MISSING_CATEGORY, INVALID_CATEGORY)
+
+# 检查输入文件的列是否覆盖模型所需的全部特征
+def check_columns(columns, feature_order):
+    missing = [f for f in feature_order if f not in columns]
+    if missing:
+        raise ValueError(f"输入文件缺少模型所需的特征: {missing}")
+
+
+# 对一个分块做一次向量化的森林评估；model可以是sklearn模型或FlatForest
+def score_chunk(model, chunk, feature_order, ranges=feature_ranges):
+    problems = validate_features(chunk, feature_order, ranges)
+    features = np.column_stack([numeric_values(chunk[feature]) for feature in feature_order])
+    # 含缺失值或非有限数值的行不送入模型：sklearn遇到inf会整块报错，展平引擎则会静默地按极端值评分
+    missing = np.isnan(features).any(axis=1)
+    complete = np.isfinite(features).all(axis=1)
+
+    death_probability = np.full(len(chunk), np.nan)
+    if complete.any():
+        model_input = pd.DataFrame(features[complete], columns=feature_order)
+        death_probability[complete] = model.predict_proba(model_input)[:, 1] * 100
+
+    result = chunk.copy()
+    result["三年生存概率"] = 100 - death_probability
+    result["三年死亡风险"] = death_probability
+    result["风险类别"] = np.where(complete, risk_categories(death_probability),
+                              np.where(missing, MISSING_CATEGORY, INVALID_CATEGORY))
+    result["校验信息"] = problems
+    return result
+
+
+# 按分块读取CSV或Parquet文件，内存占用只与分块大小有关；完全空白的CSV文件不产生任何分块
+def iter_input_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, file_format=None):
+    file_format = file_format or _guess_format(source)
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source)
+        if parquet_file.metadata.num_rows == 0:
+            # 没有数据的Parquet文件仍按其schema给出一个空分块，结果文件保留全部列
+            yield parquet_file.schema_arrow.empty_table().to_pandas()
+            return
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        try:
+            reader = pd.read_csv(source, chunksize=chunk_size)
+        except pd.errors.EmptyDataError:
+            return
+        yield from reader
+
+
+def _guess_format(source):
+    name = source if isinstance(source, str) else getattr(source, 'name', '')
+    return "parquet" if str(name).lower().endswith((".parquet", ".pq")) else "csv"
+
+
+# 评分结果中由模型写出的列及其Parquet类型
+OUTPUT_COLUMN_TYPES = {"三年生存概率": "float64", "三年死亡风险": "float64",
+                       "风险类别": "string", "校验信息": "string"}
+
+
+# 逐块写出结果：CSV追加写入，Parquet使用流式写入器
+# Parquet的列类型由第一个分块固定：特征列统一为float64，附加的整数列为可空int64，
+# 文本列为string，否则后续分块出现空值（整数列变成浮点）时写入器会因schema不一致而失败
+class ResultWriter:
+    def __init__(self, target, file_format="csv", numeric_columns=()):
+        self.target = target
+        self.file_format = file_format
+        self.numeric_columns = set(numeric_columns)
+        self._parquet_writer = None
+        self._schema = None
+        self._wrote_header = False
+
+    def write(self, frame):
+        if self.file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._schema is None:
+                self._schema = self._parquet_schema(frame)
+            table = pa.Table.from_pandas(self._conform(frame), schema=self._schema,
+                                         preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.target, self._schema)
+            self._parquet_writer.write_table(table)
+        else:
+            frame.to_csv(self.target, mode='a' if self._wrote_header else 'w',
+                         header=not self._wrote_header, index=False,
+                         encoding='utf-8' if self._wrote_header else 'utf-8-sig')
+            self._wrote_header = True
+
+    def _parquet_schema(self, frame):
+        import pyarrow as pa
+        types = {"float64": pa.float64(), "int64": pa.int64(), "string": pa.string()}
+        fields = []
+        for column in frame.columns:
+            values = frame[column]
+            kind = OUTPUT_COLUMN_TYPES.get(column)
+            if kind is None and column in self.numeric_columns:
+                kind = "float64"
+            elif kind is None:
+                # 整列为空的附加列无法判断类型，按文本处理
+                if pd.api.types.is_bool_dtype(values) or not pd.api.types.is_numeric_dtype(values) \
+                        or values.isna().all():
+                    kind = "string"
+                else:
+                    kind = "int64" if pd.api.types.is_integer_dtype(values) else "float64"
+            fields.append(pa.field(str(column), types[kind]))
+        return pa.schema(fields)
+
+    # 把分块转换为已固定的列类型；数值列中出现无法转换的文本时报错，而不是静默丢弃
+    def _conform(self, frame):
+        frame = frame.rename(columns=str)
+        if list(frame.columns) != self._schema.names:
+            raise ValueError("后续分块的列与第一个分块不一致")
+        for field in self._schema:
+            values = frame[field.name]
+            if str(field.type) in ("double", "int64"):
+                numbers = pd.Series(numeric_values(values), index=values.index)
+                lost = numbers.isna() & values.notna() & (values.astype(str).str.strip() != "")
+                if str(field.type) == "int64":
+                    lost |= numbers.notna() & (np.isinf(numbers) | (numbers != numbers.round()))
+                if lost.any():
+                    raise ValueError(f"列 {field.name} 在后续分块中出现与第一个分块类型不符的内容: "
+                                     f"{values[lost].iloc[0]!r}")
+                frame[field.name] = numbers.astype("Int64") if str(field.type) == "int64" else numbers
+            else:
+                frame[field.name] = values.astype(object).where(values.notna(), None).map(
+                    lambda value: value if value is None else str(value))
+        return frame
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+
+# 批量评分主流程：逐块读取、校验、评分并写出，返回各风险类别的计数
+def score_file(model, source, target, chunk_size=DEFAULT_CHUNK_SIZE,
+               input_format=None, output_format=None, progress=None, ranges=feature_ranges):
+    feature_order = model_feature_order(model)
+    output_format = output_format or _guess_format(target)
+    writer = ResultWriter(target, output_format, numeric_columns=feature_order)
+    summary = {"rows": 0, **{category: 0 for category in SUMMARY_CATEGORIES}}
+    chunks = 0
+    try:
+        for chunk in iter_input_chunks(source, chunk_size, input_format):
+            if chunks == 0:
+                check_columns(chunk.columns, feature_order)
+            chunks += 1
+            result = score_chunk(model, chunk, feature_order, ranges)
+            writer.write(result)
+            summary["rows"] += len(result)
+            for category, count in result["风险类别"].value_counts().items():
+                summary[category] += int(count)
+            if progress is not None:
+                progress(summary["rows"])
+        if chunks == 0:
+            # 输入文件完全空白时也写出只有表头的结果文件，下游任务不会因找不到文件而失败
+            writer.write(score_chunk(model, pd.DataFrame(columns=feature_order), feature_order, ranges))
+    except BaseException:
+        # 出错时不留下只写了一部分的结果文件
+        writer.close()
+        if isinstance(target, str) and os.path.exists(target):
+            os.remove(target)
+        raise
+    writer.close()
+    return summary
+
+
+# 两种推理引擎对同一分块（含缺失值、inf和超出范围的取值）的评分必须完全一致，返回不一致的行数
+def check_engines(model, n_rows=200, seed=0):
+    feature_order = model_feature_order(model)
+    chunk = synthetic_patients(n_rows, rng=np.random.default_rng(seed), feature_order=feature_order)
+    chunk.iloc[1, 0] = np.inf
+    chunk.iloc[2, 1] = -np.inf
+    chunk.iloc[3, 0] = np.nan
+    chunk.iloc[4, 0] = 1e6
+    sklearn_result = score_chunk(model, chunk, feature_order)
+    flat_result = score_chunk(FlatForest.from_model(model), chunk, feature_order)
+    same_category = (sklearn_result["风险类别"] == flat_result["风险类别"]).to_numpy()
+    same_risk = np.array_equal(sklearn_result["三年死亡风险"].to_numpy(), flat_result["三年死亡风险"].to_numpy(),
+                               equal_nan=True)
+    invalid_marked = (sklearn_result["风险类别"].iloc[[1, 2]] == INVALID_CATEGORY).all()
+    return int((~same_category).sum()) + (not same_risk) + (not invalid_marked)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="胃癌术后生存预测 - 批量队列评分")
+    parser.add_argument("input", nargs="?", help="患者特征文件 (CSV 或 Parquet)")
+    parser.add_argument("output", nargs="?", help="结果输出文件 (CSV 或 Parquet)")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每个分块的行数")
+    parser.add_argument("--engine", choices=["sklearn", "flat"], default="sklearn",
+                        help="推理引擎：sklearn多线程适合大分块，flat(展平数组)适合小分块")
+    parser.add_argument("--check-engines", action="store_true",
+                        help="用含缺失值和inf的合成分块检查两种推理引擎的评分是否一致")
+    args = parser.parse_args(argv)
+
+    if args.check_engines:
+        mismatches = check_engines(load_model_file(args.model))
+        if mismatches:
+            print(f"两种推理引擎的评分不一致: {mismatches} 处", file=sys.stderr)
+            return 1
+        print("两种推理引擎的评分一致（含缺失值和inf的行均未送入模型）")
+        return 0
+    if args.input is None or args.output is None:
+        parser.error("需要指定输入文件和输出文件")
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        parser.error("输出文件不能覆盖输入文件")
+
+    model = load_model_file(args.model)
+    if args.engine == "flat":
+        model = FlatForest.from_model(model)
+    start = time.perf_counter()
+    try:
+        summary = score_file(model, args.input, args.output, chunk_size=args.chunk_size)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f"已评分 {summary['rows']} 行，用时 {elapsed:.2f} 秒 -> {args.output}")
+    for category in SUMMARY_CATEGORIES:
+        print(f"  {category}: {summary[category]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from model_core import MODEL_PATH, death_class_explanation, load_model_file, synthetic_patients
+
+warnings.filterwarnings('ignore')
+
+# 判定为性能回归的默认阈值：中位数比基线慢20%以上
+DEFAULT_REGRESSION_THRESHOLD = 0.20
+
+# 已注册的基准测试：名称 -> (准备函数, 重复次数)
+# 准备函数接收共享上下文，返回一个无参的被测函数；需要释放的资源用ctx.add_cleanup登记，该项测试结束后释放
+BENCHMARKS = {}
+
+
+def benchmark(name, repeat=20):
+    def register(setup):
+        BENCHMARKS[name] = (setup, repeat)
+        return setup
+    return register
+
+
+# 各基准测试共享的模型和合成数据，按需构建
+class BenchContext:
+    def __init__(self, model_path, seed):
+        self.model_path = model_path
+        self.seed = seed
+        self._cache = {}
+        self._cleanups = []
+
+    def _get(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    # 登记当前基准测试结束后要执行的清理函数（关闭后台线程、删除临时目录等）
+    def add_cleanup(self, func):
+        self._cleanups.append(func)
+
+    # 按登记的逆序执行清理，后创建的资源先释放
+    def run_cleanups(self):
+        while self._cleanups:
+            self._cleanups.pop()()
+
+    @property
+    def model(self):
+        return self._get("model", lambda: load_model_file(self.model_path))
+
+    @property
+    def predictor(self):
+        from predictor import Predictor
+        return self._get("predictor", lambda: Predictor(self.model, self.model_path))
+
+    @property
+    def feature_order(self):
+        return self.predictor.feature_order
+
+    # 每种行数使用独立的随机种子，只运行部分基准测试时数据也保持一致
+    def patients(self, n_rows):
+        return self._get(("patients", n_rows),
+                         lambda: synthetic_patients(n_rows, rng=np.random.default_rng([self.seed, n_rows]),
+                                                    feature_order=self.feature_order))
+
+
+@benchmark("model_load", repeat=5)
+def bench_model_load(ctx):
+    return lambda: load_model_file(ctx.model_path)
+
+
+@benchmark("flat_engine_build", repeat=10)
+def bench_engine_build(ctx):
+    from forest_engine import FlatForest
+    return lambda: FlatForest.from_model(ctx.model)
+
+
+# 原始应用的单例路径：predict和predict_proba各遍历一次森林
+@benchmark("single_row_original", repeat=50)
+def bench_single_original(ctx):
+    X = ctx.patients(1).to_numpy()
+    return lambda: (ctx.model.predict(X), ctx.model.predict_proba(X))
+
+
+# 当前应用的单例路径：整理输入 + 一次展平森林遍历
+@benchmark("single_row_app", repeat=200)
+def bench_single_app(ctx):
+    record = ctx.patients(1).iloc[0].to_dict()
+    return lambda: ctx.predictor.predict(ctx.predictor.frame([record]))
+
+
+# 提前停止的单例路径：风险类别确定即停止，逐行在Python标量上遍历
+@benchmark("single_row_anytime", repeat=200)
+def bench_single_anytime(ctx):
+    features_df = ctx.patients(1)
+    return lambda: ctx.predictor.predict_fast(features_df)
+
+
+def _register_batch(n_rows, repeat):
+    @benchmark(f"batch_{n_rows}_sklearn", repeat=repeat)
+    def bench_sklearn(ctx):
+        X = ctx.patients(n_rows)
+        return lambda: ctx.model.predict_proba(X)
+
+    @benchmark(f"batch_{n_rows}_flat", repeat=repeat)
+    def bench_flat(ctx):
+        X = ctx.patients(n_rows)
+        return lambda: ctx.predictor.predict(X)
+
+    @benchmark(f"batch_{n_rows}_anytime", repeat=repeat)
+    def bench_anytime(ctx):
+        X = ctx.patients(n_rows)
+        return lambda: ctx.predictor.predict_fast(X)
+
+
+for _n_rows, _repeat in ((1, 50), (100, 20), (10000, 5)):
+    _register_batch(_n_rows, _repeat)
+
+
+# 应用实际使用的解释器：展平森林上的向量化TreeSHAP
+@benchmark("explainer_build", repeat=5)
+def bench_explainer_build(ctx):
+    from tree_shap import FastTreeExplainer
+    return lambda: FastTreeExplainer(ctx.predictor.engine)
+
+
+# 对照：shap库的解释器
+@benchmark("shap_explainer_build", repeat=5)
+def bench_shap_explainer_build(ctx):
+    from model_core import CachedExplainer
+    return lambda: CachedExplainer(ctx.model)
+
+
+@benchmark("shap_single_row", repeat=20)
+def bench_shap_single(ctx):
+    X = ctx.patients(1)
+    return lambda: ctx.predictor.explain(X)
+
+
+# 多行一次计算，结果按行平均见 per_row_ms
+def _register_shap_batch(n_rows, repeat):
+    @benchmark(f"shap_{n_rows}_rows", repeat=repeat)
+    def bench_shap_batch(ctx):
+        X = ctx.patients(n_rows)
+        return lambda: ctx.predictor.explain(X)
+
+
+for _n_rows, _repeat in ((100, 5), (1000, 5), (100000, 2)):
+    _register_shap_batch(_n_rows, _repeat)
+
+
+@benchmark("gauge_render", repeat=50)
+def bench_gauge(ctx):
+    from charts import build_risk_gauge
+    # Streamlit发送图表前会序列化为JSON，一并计入
+    return lambda: build_risk_gauge(45.6).to_json()
+
+
+@benchmark("waterfall_render", repeat=50)
+def bench_waterfall(ctx):
+    from charts import build_shap_waterfall
+    contributions, base_value, values = death_class_explanation(ctx.predictor.explain(ctx.patients(1)))
+    return lambda: build_shap_waterfall(contributions, base_value, ctx.feature_order, values).to_json()
+
+
+# 请求路径上写审计日志的开销：只是放入队列，写库在后台线程中进行
+@benchmark("audit_enqueue", repeat=1000)
+def bench_audit_enqueue(ctx):
+    import os
+    import shutil
+    import tempfile
+    from audit_log import AuditLog
+    directory = tempfile.mkdtemp()
+    ctx.add_cleanup(lambda: shutil.rmtree(directory, ignore_errors=True))
+    audit = AuditLog(os.path.join(directory, "audit.db"))
+    ctx.add_cleanup(audit.close)
+    record = ctx.patients(1).iloc[0].to_dict()
+    return lambda: audit.record("bench", ctx.predictor.version, record, 45.6, "中等风险", elapsed_ms=1.0,
+                                stages={"forest": 0.3}, cache_hit=False)
+
+
+# 行数，用于计算每行耗时
+def _rows_of(name):
+    if name.startswith("batch_"):
+        return int(name.split("_")[1])
+    if name.startswith("shap_") and name.split("_")[1].isdigit():
+        return int(name.split("_")[1])
+    return 1
+
+
+def run_benchmarks(ctx, names, repeat_scale=1.0):
+    results = {}
+    for name in names:
+        setup, repeat = BENCHMARKS[name]
+        try:
+            func = setup(ctx)
+            # 预热一次，排除首次调用的初始化开销
+            func()
+            timings = []
+            for _ in range(max(1, int(repeat * repeat_scale))):
+                start = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            ctx.run_cleanups()
+        timings = np.asarray(timings)
+        results[name] = {
+            "median_ms": float(np.median(timings)),
+            "p95_ms": float(np.percentile(timings, 95)),
+            "min_ms": float(timings.min()),
+            "per_row_ms": float(np.median(timings) / _rows_of(name)),
+            "repeat": len(timings),
+        }
+        print(f"{name:<22}{results[name]['median_ms']:>12.3f} ms  (p95 {results[name]['p95_ms']:.3f} ms)")
+    return results
+
+
+# 与基线比较，返回中位数变慢超过阈值的阶段
+def compare_with_baseline(results, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        ratio = result["median_ms"] / reference["median_ms"] if reference["median_ms"] > 0 else 1.0
+        marker = "回归" if ratio > 1 + threshold else ""
+        print(f"{name:<22}{reference['median_ms']:>12.3f} -> {result['median_ms']:.3f} ms  ({ratio:.2f}x) {marker}")
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="预测路径各阶段的基准测试")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--output", default="bench_results.json", help="结果JSON文件")
+    parser.add_argument("--baseline", help="用于比较的基线结果JSON文件")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="中位数相对基线变慢超过该比例即判为回归")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="只运行指定的基准测试")
+    parser.add_argument("--quick", action="store_true", help="减少重复次数，快速检查")
+    parser.add_argument("--seed", type=int, default=0, help="合成患者的随机种子")
+    args = parser.parse_args(argv)
+
+    ctx = BenchContext(args.model, args.seed)
+    names = args.only or list(BENCHMARKS)
+    results = run_benchmarks(ctx, names, repeat_scale=0.2 if args.quick else 1.0)
+
+    report = {
+        "meta": {
+            "model": args.model,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"性能回归: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from fonts import CSS_FONT_STACK
+from model_core import HIGH_RISK_THRESHOLD, LOW_RISK_THRESHOLD
+
+# SHAP瀑布图配色，与shap库默认配色一致：红色增加死亡风险，蓝色降低死亡风险
+INCREASING_COLOR = "#ff0051"
+DECREASING_COLOR = "#008bfb"
+
+# 确保plotly也能显示中文
+pio.templates.default = "simple_white"
+# 设置plotly的默认字体为Microsoft YaHei，缺少时依次回退到其他中文字体
+pio.templates["simple_white"].layout.font.family = CSS_FONT_STACK
+
+# 带标题图表的背景色
+CHART_BACKGROUND = "#f8f9fa"
+
+
+# 各图表共用的布局：字体、标题样式、边距和背景统一在这里设置，避免各图表之间逐渐不一致；
+# margin只需给出与默认值不同的边，其余参数原样传给update_layout
+def _base_layout(title=None, background=CHART_BACKGROUND, margin=None, **layout):
+    base = {
+        'margin': {**dict(l=5, r=5, t=35 if title else 5, b=5), **(margin or {})},
+        'paper_bgcolor': background,
+        'plot_bgcolor': background,
+        'font': {'family': CSS_FONT_STACK, 'color': 'black', 'size': 11},
+        'showlegend': False,
+    }
+    if title:
+        base['title'] = {'text': title, 'font': {'size': 14, 'family': CSS_FONT_STACK, 'color': 'black'}}
+    base.update(layout)
+    return base
+
+
+# 死亡风险仪表盘
+def build_risk_gauge(death_probability):
+    fig = go.Figure(go.Indicator(
+        mode = "gauge+number",
+        value = death_probability,
+        domain = {'x': [0, 1], 'y': [0, 1]},
+        title = {'text': "", 'font': {'size': 14, 'family': CSS_FONT_STACK, 'color': 'black', 'weight': 'bold'}},
+        gauge = {
+            'axis': {'range': [0, 100], 'tickwidth': 1, 'tickcolor': "darkblue", 'tickfont': {'color': 'black', 'size': 9, 'family': CSS_FONT_STACK}},
+            'bar': {'color': "darkblue"},
+            'bgcolor': "white",
+            'borderwidth': 1,
+            'bordercolor': "gray",
+            'steps': [
+                {'range': [0, LOW_RISK_THRESHOLD], 'color': 'green'},
+                {'range': [LOW_RISK_THRESHOLD, HIGH_RISK_THRESHOLD], 'color': 'orange'},
+                {'range': [HIGH_RISK_THRESHOLD, 100], 'color': 'red'}],
+            'threshold': {
+                'line': {'color': "red", 'width': 2},
+                'thickness': 0.6,
+                'value': death_probability}}))
+
+    # 无标题，顶部边距最小
+    fig.update_layout(**_base_layout(background="white", height=160))
+    return fig
+
+
+# 特征取值的显示格式：整数显示为整数，其余保留两位小数
+def _format_value(value):
+    value = float(value)
+    return f"{value:.0f}" if value.is_integer() else f"{value:.2f}"
+
+
+# 瀑布图的各行：与shap.plots.waterfall一致，按贡献绝对值排序，超出max_display的特征合并为一项；
+# 返回自下而上的 (标签, 贡献值)，贡献最大的特征在最上方
+def waterfall_rows(shap_values, feature_names, feature_values, max_display=7):
+    shap_values = np.asarray(shap_values, dtype=float)
+    order = np.argsort(-np.abs(shap_values))
+    if len(order) > max_display:
+        shown = order[:max_display - 1]
+        rest = order[max_display - 1:]
+    else:
+        shown, rest = order, []
+
+    labels = [f"{feature_names[i]} = {_format_value(feature_values[i])}" for i in shown]
+    contributions = [shap_values[i] for i in shown]
+    if len(rest):
+        labels.append(f"其他 {len(rest)} 个特征")
+        contributions.append(shap_values[rest].sum())
+    return labels[::-1], contributions[::-1]
+
+
+# 直接由SHAP值绘制Plotly瀑布图，不经过matplotlib和文件系统
+def build_shap_waterfall(shap_values, base_value, feature_names, feature_values, max_display=7):
+    # 瀑布从底部的基准值开始累加
+    labels, contributions = waterfall_rows(shap_values, feature_names, feature_values, max_display)
+    prediction = base_value + float(np.sum(shap_values))
+
+    fig = go.Figure(go.Waterfall(
+        orientation="h",
+        base=base_value,
+        measure=["relative"] * len(contributions),
+        y=labels,
+        x=contributions,
+        text=[f"{c:+.3f}" for c in contributions],
+        textposition="outside",
+        increasing={'marker': {'color': INCREASING_COLOR}},
+        decreasing={'marker': {'color': DECREASING_COLOR}},
+        connector={'line': {'color': '#9CA3AF', 'width': 1, 'dash': 'dot'}},
+        hovertemplate="%{y}<br>贡献: %{x:+.4f}<extra></extra>",
+    ))
+    fig.add_vline(x=base_value, line={'color': '#6B7280', 'width': 1, 'dash': 'dash'})
+    fig.add_vline(x=prediction, line={'color': '#111827', 'width': 1})
+
+    fig.update_layout(**_base_layout(
+        "特征对预测的影响",
+        margin={'r': 30},
+        height=300,
+        xaxis={'title': f"E[f(X)] = {base_value:.3f}  →  f(x) = {prediction:.3f}",
+               'gridcolor': '#E5E7EB', 'zeroline': False},
+        yaxis={'automargin': True},
+    ))
+    return fig
+
+
+# 单特征风险曲线：背景按风险分层着色，标出当前取值
+def build_risk_curve(grid, risk, feature, current_value, current_risk, unit="", categorical=False):
+    fig = go.Figure()
+    for low, high, color in ((0, LOW_RISK_THRESHOLD, 'green'), (LOW_RISK_THRESHOLD, HIGH_RISK_THRESHOLD, 'orange'),
+                             (HIGH_RISK_THRESHOLD, 100, 'red')):
+        fig.add_hrect(y0=low, y1=high, fillcolor=color, opacity=0.08, line_width=0)
+    # 决策森林的输出在分裂点之间不变，按阶梯线绘制
+    fig.add_trace(go.Scatter(
+        x=grid, y=risk, mode="lines+markers" if categorical else "lines",
+        line={'color': '#1E3A8A', 'width': 2, 'shape': 'hv'},
+        hovertemplate=f"{feature} = %{{x}}<br>死亡风险: %{{y:.1f}}%<extra></extra>",
+    ))
+    fig.add_trace(go.Scatter(
+        x=[current_value], y=[current_risk], mode="markers",
+        marker={'color': INCREASING_COLOR, 'size': 10, 'line': {'color': 'white', 'width': 1}},
+        hovertemplate=f"当前取值 {_format_value(current_value)}<br>死亡风险: %{{y:.1f}}%<extra></extra>",
+    ))
+    fig.update_layout(**_base_layout(
+        f"{feature}对死亡风险的影响（其他特征保持不变）",
+        margin={'r': 10},
+        height=300,
+        xaxis={'title': f"{feature} ({unit})" if unit else feature, 'gridcolor': '#E5E7EB'},
+        yaxis={'title': "三年死亡风险 (%)", 'range': [0, 100], 'gridcolor': '#E5E7EB'},
+    ))
+    return fig
+
+
+# 双特征风险热图：颜色表示死亡风险，标出当前取值
+def build_risk_heatmap(grid_x, grid_y, risk, feature_x, feature_y, current_x, current_y):
+    fig = go.Figure(go.Heatmap(
+        x=grid_x, y=grid_y, z=risk, zmin=0, zmax=100,
+        colorscale=[[0, 'green'], [LOW_RISK_THRESHOLD / 100, 'yellow'], [HIGH_RISK_THRESHOLD / 100, 'orange'],
+                    [1, 'red']],
+        colorbar={'title': "死亡风险 (%)", 'thickness': 12},
+        hovertemplate=f"{feature_x} = %{{x}}<br>{feature_y} = %{{y}}<br>死亡风险: %{{z:.1f}}%<extra></extra>",
+    ))
+    fig.add_trace(go.Scatter(
+        x=[current_x], y=[current_y], mode="markers",
+        marker={'color': 'white', 'size': 11, 'symbol': 'x', 'line': {'color': 'black', 'width': 1}},
+        hovertemplate="当前患者<extra></extra>",
+    ))
+    fig.update_layout(**_base_layout(
+        f"{feature_x} × {feature_y} 的死亡风险",
+        height=380,
+        xaxis={'title': feature_x},
+        yaxis={'title': feature_y},
+    ))
+    return fig
+
+
+# 多模型对比：同一患者在各模型上的死亡风险，误差线为树间波动区间（P10-P90），背景按风险分层着色
+def build_model_comparison(labels, risks, lows, highs):
+    risks = np.asarray(risks, dtype=float)
+    fig = go.Figure()
+    for low, high, color in ((0, LOW_RISK_THRESHOLD, 'green'), (LOW_RISK_THRESHOLD, HIGH_RISK_THRESHOLD, 'orange'),
+                             (HIGH_RISK_THRESHOLD, 100, 'red')):
+        fig.add_vrect(x0=low, x1=high, fillcolor=color, opacity=0.08, line_width=0)
+    fig.add_trace(go.Bar(
+        x=risks, y=list(labels), orientation="h",
+        marker={'color': ['green' if r <= LOW_RISK_THRESHOLD else 'orange' if r <= HIGH_RISK_THRESHOLD else 'red'
+                          for r in risks]},
+        error_x={'type': 'data', 'symmetric': False, 'color': '#4B5563', 'thickness': 1.2,
+                 'array': np.asarray(highs, dtype=float) - risks, 'arrayminus': risks - np.asarray(lows, dtype=float)},
+        text=[f"{r:.1f}%" for r in risks], textposition="inside",
+        hovertemplate="%{y}<br>死亡风险: %{x:.1f}%<extra></extra>",
+    ))
+    fig.update_layout(**_base_layout(
+        "各模型预测的三年死亡风险",
+        margin={'r': 10},
+        height=max(160, 60 + 45 * len(risks)),
+        xaxis={'title': "三年死亡风险 (%)", 'range': [0, 100], 'gridcolor': '#E5E7EB'},
+        yaxis={'automargin': True, 'autorange': 'reversed'},
+    ))
+    return fig
+
+
+# 特征取值归一化到0-1，用于按取值高低着色
+def _normalized(values):
+    values = np.asarray(values, dtype=float)
+    low, high = np.nanpercentile(values, [5, 95]) if len(values) else (0.0, 1.0)
+    if high <= low:
+        return np.full(len(values), 0.5)
+    return np.clip((values - low) / (high - low), 0, 1)
+
+
+# 与shap库一致的取值配色：蓝色为低取值，红色为高取值
+_VALUE_COLORSCALE = [[0, DECREASING_COLOR], [1, INCREASING_COLOR]]
+
+
+# 全局特征重要性：各特征平均|SHAP|
+def build_shap_importance(importance):
+    importance = importance.sort_values()
+    fig = go.Figure(go.Bar(
+        x=importance.values, y=importance.index, orientation="h",
+        marker={'color': DECREASING_COLOR},
+        text=[f"{v:.3f}" for v in importance.values], textposition="outside",
+        hovertemplate="%{y}<br>平均|SHAP|: %{x:.4f}<extra></extra>",
+    ))
+    fig.update_layout(**_base_layout(
+        "特征重要性（平均|SHAP|）",
+        margin={'r': 30},
+        height=300,
+        xaxis={'title': "平均|SHAP|（对死亡风险的影响）", 'gridcolor': '#E5E7EB'},
+        yaxis={'automargin': True},
+    ))
+    return fig
+
+
+# 蜂群图：每个点是一个患者的一个特征，横轴为SHAP值，颜色为特征取值高低；行数过多时随机抽样显示
+def build_shap_beeswarm(shap_values, features, order=None, max_points=5000, seed=0):
+    shap_values = np.asarray(shap_values, dtype=float)
+    rows = np.arange(len(shap_values))
+    if len(rows) > max_points:
+        rows = np.sort(np.random.default_rng(seed).choice(rows, max_points, replace=False))
+    names = list(order if order is not None else features.columns)
+    rng = np.random.default_rng(seed)
+    xs, ys, colors, texts = [], [], [], []
+    # 最重要的特征画在最上方
+    for position, feature in enumerate(reversed(names)):
+        column = list(features.columns).index(feature)
+        values = features[feature].to_numpy(dtype=float)[rows]
+        xs.append(shap_values[rows, column])
+        ys.append(position + rng.uniform(-0.3, 0.3, len(rows)))
+        colors.append(_normalized(values))
+        texts.append([f"{feature} = {_format_value(v)}" for v in values])
+    fig = go.Figure(go.Scattergl(
+        x=np.concatenate(xs), y=np.concatenate(ys), mode="markers",
+        marker={'color': np.concatenate(colors), 'colorscale': _VALUE_COLORSCALE, 'size': 4, 'opacity': 0.6,
+                'colorbar': {'title': "特征取值", 'tickvals': [0, 1], 'ticktext': ["低", "高"], 'thickness': 10}},
+        text=np.concatenate(texts),
+        hovertemplate="%{text}<br>SHAP: %{x:+.4f}<extra></extra>",
+    ))
+    fig.add_vline(x=0, line={'color': '#6B7280', 'width': 1})
+    fig.update_layout(**_base_layout(
+        f"SHAP蜂群图（{len(rows)} 名患者）",
+        height=360,
+        xaxis={'title': "SHAP值（对死亡风险的影响）", 'gridcolor': '#E5E7EB', 'zeroline': False},
+        yaxis={'tickvals': list(range(len(names))), 'ticktext': list(reversed(names)), 'automargin': True},
+    ))
+    return fig
+
+
+# 依赖图：横轴为特征取值，纵轴为该特征的SHAP值，可按另一个特征的取值着色
+def build_shap_dependence(shap_values, features, feature, color_feature=None, max_points=5000, seed=0):
+    rows = np.arange(len(features))
+    if len(rows) > max_points:
+        rows = np.sort(np.random.default_rng(seed).choice(rows, max_points, replace=False))
+    column = list(features.columns).index(feature)
+    marker = {'size': 5, 'opacity': 0.6, 'color': DECREASING_COLOR}
+    if color_feature is not None:
+        marker.update(color=_normalized(features[color_feature].to_numpy(dtype=float)[rows]),
+                      colorscale=_VALUE_COLORSCALE,
+                      colorbar={'title': color_feature, 'tickvals': [0, 1], 'ticktext': ["低", "高"],
+                                'thickness': 10})
+    fig = go.Figure(go.Scattergl(
+        x=features[feature].to_numpy(dtype=float)[rows], y=np.asarray(shap_values)[rows, column],
+        mode="markers", marker=marker,
+        hovertemplate=f"{feature} = %{{x}}<br>SHAP: %{{y:+.4f}}<extra></extra>",
+    ))
+    fig.add_hline(y=0, line={'color': '#6B7280', 'width': 1, 'dash': 'dash'})
+    fig.update_layout(**_base_layout(
+        f"{feature}的SHAP依赖图",
+        height=320,
+        xaxis={'title': feature, 'gridcolor': '#E5E7EB'},
+        yaxis={'title': "SHAP值", 'gridcolor': '#E5E7EB'},
+    ))
+    return fig
@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from batch_scoring import check_columns, iter_input_chunks
+from forest_engine import FlatForest
+from model_core import MODEL_PATH, feature_ranges, load_model_file, model_file_hash, validate_features
+from tree_shap import FastTreeExplainer
+
+# SHAP结果的磁盘存储目录，按 模型哈希/输入哈希.parquet 组织
+SHAP_STORE_DIR = os.environ.get("SHAP_STORE_DIR", "shap_store")
+
+# 每个工作进程一次处理的最大行数
+DEFAULT_CHUNK_ROWS = 2000
+
+# 每个工作进程至少分到的行数；启动进程并构建解释器约需一两秒，行数较少时在当前进程中计算更快
+MIN_ROWS_PER_WORKER = 50000
+
+# 存储文件中SHAP值列名的前缀
+SHAP_COLUMN_PREFIX = "shap:"
+
+# 一个队列的全局解释：shap_values为死亡类的贡献值 (n_rows, n_features)
+CohortExplanation = namedtuple('CohortExplanation', [
+    'features', 'shap_values', 'base_value', 'from_store', 'elapsed_ms',
+])
+
+# 工作进程中的解释器，由_init_worker在进程启动时构建一次
+_worker_explainer = None
+
+
+# 整理上传的队列：按模型特征顺序取列，去掉有缺失或超出范围取值的行，返回 (可解释的行, 去掉的行数)
+def prepare_cohort(frame, feature_order, ranges=feature_ranges):
+    check_columns(frame.columns, feature_order)
+    features = frame[feature_order].apply(pd.to_numeric, errors='coerce')
+    valid = validate_features(features, feature_order, ranges) == ""
+    return features[valid].astype(float).reset_index(drop=True), int((~valid).sum())
+
+
+# 队列内容的哈希：特征名和float64取值相同的队列得到相同的哈希
+def cohort_hash(features, length=16):
+    digest = hashlib.sha256()
+    digest.update("\x1f".join(map(str, features.columns)).encode("utf-8"))
+    digest.update(np.ascontiguousarray(features.to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()[:length]
+
+
+def store_path(model_hash, input_hash, store_dir=SHAP_STORE_DIR):
+    return os.path.join(store_dir, model_hash, f"{input_hash}.parquet")
+
+
+# 列式存储：特征取值和对应的SHAP值各占一列，基准值写在文件元数据中
+def write_store(path, features, shap_values, base_value):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pd.concat([features, pd.DataFrame(shap_values, columns=[SHAP_COLUMN_PREFIX + f for f in features.columns])],
+                      axis=1)
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    arrow_table = arrow_table.replace_schema_metadata({**(arrow_table.schema.metadata or {}),
+                                                       b"base_value": repr(float(base_value)).encode()})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再替换，其他进程不会读到写了一半的文件
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(arrow_table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_store(path):
+    import pyarrow.parquet as pq
+    arrow_table = pq.read_table(path)
+    table = arrow_table.to_pandas()
+    shap_columns = [c for c in table.columns if c.startswith(SHAP_COLUMN_PREFIX)]
+    features = table[[c[len(SHAP_COLUMN_PREFIX):] for c in shap_columns]]
+    base_value = float(arrow_table.schema.metadata[b"base_value"])
+    return features, table[shap_columns].to_numpy(dtype=np.float64), base_value
+
+
+# 优先使用展平森林上的向量化TreeSHAP，模型不适用时退回shap.TreeExplainer
+def _init_worker(model_path):
+    global _worker_explainer
+    model = load_model_file(model_path)
+    try:
+        _worker_explainer = FastTreeExplainer(FlatForest.from_model(model))
+    except (ValueError, MemoryError):
+        import shap
+        _worker_explainer = shap.TreeExplainer(model)
+
+
+# 在工作进程中解释一个分块，返回 (起始行, 死亡类SHAP值, 死亡类基准值)
+def _explain_chunk(start, values, columns):
+    if isinstance(_worker_explainer, FastTreeExplainer):
+        return start, _worker_explainer.shap_values(values), _worker_explainer.expected_value
+    shap_values = _worker_explainer.shap_values(pd.DataFrame(values, columns=columns), check_additivity=False)
+    expected_value = np.atleast_1d(_worker_explainer.expected_value)
+    # 旧版shap对多分类返回按类别组织的列表
+    if isinstance(shap_values, list):
+        return start, np.asarray(shap_values[1]), float(expected_value[1])
+    if shap_values.ndim == 3:
+        return start, shap_values[:, :, 1], float(expected_value[1])
+    return start, shap_values, float(expected_value[0])
+
+
+# 把队列按行切分到进程池中并行计算TreeSHAP；只有一个工作进程时直接在当前进程中计算
+def compute_cohort_shap(features, model_path=MODEL_PATH, workers=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                        progress=None):
+    workers = workers or min(os.cpu_count() or 1, max(1, len(features) // MIN_ROWS_PER_WORKER))
+    values = features.to_numpy(dtype=np.float64)
+    columns = list(features.columns)
+    # 分块数至少是工作进程数的几倍，各进程的负载更均衡
+    chunk_rows = max(1, min(chunk_rows, -(-len(values) // (workers * 4))))
+    starts = range(0, len(values), chunk_rows)
+    shap_values = np.empty(values.shape, dtype=np.float64)
+    base_value = None
+    done = 0
+
+    def collect(start, chunk_values, chunk_base):
+        nonlocal base_value, done
+        shap_values[start:start + len(chunk_values)] = chunk_values
+        base_value = chunk_base
+        done += len(chunk_values)
+        if progress is not None:
+            progress(done, len(values))
+
+    if workers == 1:
+        _init_worker(model_path)
+        for start in starts:
+            collect(*_explain_chunk(start, values[start:start + chunk_rows], columns))
+        return shap_values, base_value
+
+    # 使用spawn启动工作进程，避免在Streamlit等多线程进程中fork
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(model_path,)) as executor:
+        futures = [executor.submit(_explain_chunk, start, values[start:start + chunk_rows], columns)
+                   for start in starts]
+        for future in as_completed(futures):
+            collect(*future.result())
+    return shap_values, base_value
+
+
+# 队列的全局解释：同一模型、同一队列的结果直接从磁盘存储读取；队列为空时抛出ValueError
+def explain_cohort(features, model_path=MODEL_PATH, store_dir=SHAP_STORE_DIR, workers=None, progress=None,
+                   model_hash=None):
+    if len(features) == 0:
+        raise ValueError("队列中没有可解释的患者（所有行都缺失或超出范围）")
+    start = time.perf_counter()
+    path = store_path(model_hash or model_file_hash(model_path), cohort_hash(features), store_dir)
+    if os.path.exists(path):
+        stored_features, shap_values, base_value = read_store(path)
+        return CohortExplanation(stored_features, shap_values, base_value, True,
+                                 (time.perf_counter() - start) * 1000)
+    shap_values, base_value = compute_cohort_shap(features, model_path, workers, progress=progress)
+    write_store(path, features, shap_values, base_value)
+    return CohortExplanation(features, shap_values, base_value, False, (time.perf_counter() - start) * 1000)
+
+
+# 各特征平均|SHAP|，从大到小排列
+def global_importance(explanation):
+    return pd.Series(np.abs(explanation.shap_values).mean(axis=0),
+                     index=explanation.features.columns).sort_values(ascending=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="队列整体解释 - 多进程计算TreeSHAP并写入磁盘存储")
+    parser.add_argument("input", help="患者特征文件 (CSV 或 Parquet)")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="工作进程数，默认按行数决定，最多等于CPU核数")
+    parser.add_argument("--store", default=SHAP_STORE_DIR, help="SHAP结果存储目录")
+    args = parser.parse_args(argv)
+
+    from predictor import Predictor
+    predictor = Predictor.load(args.model)
+    try:
+        frame = pd.concat(iter_input_chunks(args.input), ignore_index=True)
+        features, dropped = prepare_cohort(frame, predictor.feature_order, predictor.ranges)
+        explanation = explain_cohort(features, args.model, args.store, args.workers, model_hash=predictor.version,
+                                     progress=lambda done, total: print(f"\r已解释 {done}/{total} 行", end="",
+                                                                        file=sys.stderr))
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+    source = "读取已有结果" if explanation.from_store else "计算完成"
+    print(f"{len(features)} 行（去掉 {dropped} 行缺失或超出范围），{source}，耗时 {explanation.elapsed_ms / 1000:.2f} s")
+    print(f"基准值 {explanation.base_value:.4f}；各特征平均|SHAP|:")
+    for feature, value in global_importance(explanation).items():
+        print(f"  {feature:<12}{value:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from forest_engine import FlatForest, check_parity, threshold_edge_cases
+from model_core import MODEL_PATH, load_model_file, model_file_hash, synthetic_patients
+
+# 紧凑格式版本号，格式变化时递增；版本2增加了TreeSHAP所需的节点样本权重(cover)
+FORMAT_VERSION = 2
+
+# 仍可读取的旧版本
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+
+# 紧凑格式中的数组文件
+ARRAY_NAMES = ("feature", "threshold", "left", "right", "value", "roots")
+
+# 只在较新版本中存在的数组文件
+OPTIONAL_ARRAY_NAMES = ("cover",)
+
+
+# 模型文件对应的紧凑格式目录，例如 rf1.pkl -> rf1.forest
+def compact_path_for(model_path=MODEL_PATH):
+    return os.path.splitext(model_path)[0] + ".forest"
+
+
+# 能容纳所有取值的最窄有符号整数类型
+def _narrow_int(values):
+    for dtype in (np.int8, np.int16, np.int32):
+        if values.max(initial=0) <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+# float32阈值取不大于原阈值的最大float32：
+# 输入在比较前已转为float32，因此 x <= t32 与 x <= t64 对所有float32输入等价，结果仍逐位一致
+def _float32_floor(thresholds):
+    narrowed = thresholds.astype(np.float32)
+    too_large = narrowed.astype(np.float64) > thresholds
+    narrowed[too_large] = np.nextafter(narrowed[too_large], np.float32(-np.inf))
+    return narrowed
+
+
+# 把展平后的森林写成紧凑格式：每个数组一个.npy文件，另有meta.json记录元数据。
+# 先写到同级的临时目录再改名替换，不覆盖原有文件：已内存映射旧文件的进程继续读取旧内容，直到释放映射
+def save_compact(engine, path, source_hash=None):
+    path = os.path.normpath(path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    node_dtype = _narrow_int(np.concatenate([engine.left, engine.right]))
+    arrays = {
+        "feature": engine.feature.astype(_narrow_int(engine.feature)),
+        "threshold": _float32_floor(np.asarray(engine.threshold, dtype=np.float64)),
+        "left": engine.left.astype(node_dtype),
+        "right": engine.right.astype(node_dtype),
+        # 叶子概率保持float64，保证与predict_proba逐位一致
+        "value": np.asarray(engine.value, dtype=np.float64),
+        "roots": engine.roots.astype(node_dtype),
+    }
+    if engine.cover is not None:
+        arrays["cover"] = np.asarray(engine.cover, dtype=np.float64)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "n_trees": int(engine.n_estimators),
+        "n_nodes": int(len(engine.feature)),
+        "max_depth": int(engine.max_depth),
+        "classes": engine.classes_.tolist(),
+        "feature_names": [str(f) for f in getattr(engine, 'feature_names_in_', [])] or None,
+        "source_hash": source_hash,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    # 目录不能原子地覆盖非空目录：先把旧目录改名移开再换入新目录，两次改名之间读取方找不到紧凑格式，会回退到模型文件
+    old_path = f"{path}.{os.getpid()}.old"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return meta
+
+
+def read_meta(path):
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+# 以只读内存映射方式加载紧凑格式，多个进程共享同一份页缓存
+def load_compact(path):
+    meta = read_meta(path)
+    if meta.get("format_version") not in SUPPORTED_FORMAT_VERSIONS:
+        raise ValueError(f"不支持的紧凑模型格式版本: {meta.get('format_version')}")
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in ARRAY_NAMES}
+    for name in OPTIONAL_ARRAY_NAMES:
+        if os.path.exists(os.path.join(path, f"{name}.npy")):
+            arrays[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+    return FlatForest(max_depth=meta["max_depth"], classes=np.asarray(meta["classes"]),
+                      feature_names=meta["feature_names"], **arrays)
+
+
+# 紧凑格式存在且由当前模型文件转换而来时返回其路径，否则返回None
+def find_compact(model_path=MODEL_PATH, source_hash=None):
+    path = compact_path_for(model_path)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    if source_hash is not None and read_meta(path).get("source_hash") != source_hash:
+        return None
+    return path
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def convert(args):
+    model = load_model_file(args.model)
+    output = args.output or compact_path_for(args.model)
+    meta = save_compact(FlatForest.from_model(model), output, model_file_hash(args.model))
+    print(f"已转换 {meta['n_trees']} 棵树、{meta['n_nodes']} 个节点 -> {output}")
+    print(f"  磁盘占用: {os.path.getsize(args.model) / 1024:.1f} KB -> {_directory_size(output) / 1024:.1f} KB")
+    return check(args, output)
+
+
+# 一致性检查：紧凑格式的预测必须与原模型的predict_proba逐位相同
+def check(args, path=None):
+    path = path or args.output or compact_path_for(args.model)
+    model = load_model_file(args.model)
+    start = time.perf_counter()
+    engine = load_compact(path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    feature_order = list(engine.feature_names_in_)
+    samples = synthetic_patients(args.rows, rng=np.random.default_rng(args.seed), feature_order=feature_order)
+    edges = threshold_edge_cases(FlatForest.from_model(model), seed=args.seed)
+    X = np.vstack([samples.to_numpy(dtype=np.float64), edges])
+    identical, expected, actual = check_parity(model, engine, X)
+    meta = read_meta(path)
+    if meta.get("source_hash") != model_file_hash(args.model):
+        print("警告: 紧凑模型不是由当前模型文件转换而来", file=sys.stderr)
+    if not identical:
+        print(f"不一致: 最大差异 {np.abs(expected - actual).max():.3e}", file=sys.stderr)
+        return 1
+    print(f"一致: {len(X)} 行结果与 predict_proba 逐位相同；内存映射加载耗时 {load_ms:.2f} ms")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="随机森林紧凑格式（内存映射）转换与一致性检查")
+    parser.add_argument("command", choices=["convert", "check"])
+    parser.add_argument("--model", default=MODEL_PATH, help="原始模型文件路径")
+    parser.add_argument("--output", help="紧凑格式目录，默认与模型文件同名、扩展名为.forest")
+    parser.add_argument("--rows", type=int, default=10000, help="一致性检查的随机样本数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    return convert(args) if args.command == "convert" else check(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import argparse
+import sys
+import time
+from collections import namedtuple
+from itertools import combinations, product
+
+import numpy as np
+import pandas as pd
+
+from model_core import MODEL_PATH, feature_ranges, risk_categories, synthetic_patients
+
+# 默认可调整的特征；年龄、TNM分期等不可改变的特征保持不变
+DEFAULT_MODIFIABLE_FEATURES = ("白蛋白", "术中出血量")
+
+# 数值特征的调整粒度，与输入滑块的步长一致
+VALUE_STEP = 0.1
+
+# 默认时间预算（秒），超时后返回已找到的最优结果
+DEFAULT_TIME_BUDGET = 2.0
+
+# 每次送入森林的候选行数
+DEFAULT_BATCH_ROWS = 4096
+
+# 同时调整k个特征时最多评估的候选组合数，超出时每个特征只保留离当前值最近的取值
+MAX_CANDIDATES_PER_SUBSET = 20000
+
+# 一个调整方案：changes为 特征 -> (原值, 新值)
+Counterfactual = namedtuple('Counterfactual', ['changes', 'death_risk_percent', 'risk_category', 'cost'])
+
+# 搜索结果：complete为False表示搜索不完整，结果可能不是最小调整，原因见另外两项：
+# timed_out为因时间预算提前结束；truncated为至少一组特征的组合超过MAX_CANDIDATES_PER_SUBSET，只搜索了离当前值最近的取值
+CounterfactualSearch = namedtuple('CounterfactualSearch', [
+    'current_risk_percent', 'current_category', 'solutions', 'evaluated', 'elapsed_ms', 'complete',
+    'timed_out', 'truncated',
+])
+
+_RISK_ORDER = {"低风险": 0, "中等风险": 1, "高风险": 2}
+
+
+# 某个特征可取的候选值。随机森林的输出只在该特征的分裂阈值处变化，阈值把取值范围分成若干区间，
+# 每个区间只保留离当前值最近的可输入值：当前值左侧的阈值取不超过阈值的最大值，右侧的阈值取超过阈值的最小值
+def candidate_values(engine, feature, current, ranges=feature_ranges):
+    properties = ranges[feature]
+    if properties["type"] == "categorical":
+        values = np.asarray(properties["options"], dtype=float)
+        return values[values != float(current)]
+    index = list(engine.feature_names_in_).index(feature)
+    internal = engine.left != np.arange(len(engine.left))
+    # 紧凑格式的阈值为float32，先转为float64再计算候选值
+    is_feature = internal & (np.asarray(engine.feature) == index)
+    thresholds = np.unique(np.asarray(engine.threshold, dtype=np.float64)[is_feature])
+    # 与推理引擎一致，在float32上比较
+    current32 = np.float32(current)
+    right = thresholds[thresholds >= current32]
+    left = thresholds[thresholds < current32]
+    above = np.round(np.floor(right / VALUE_STEP) * VALUE_STEP + VALUE_STEP, 6)
+    above[above.astype(np.float32) <= right] += VALUE_STEP
+    below = np.round(np.floor(left / VALUE_STEP) * VALUE_STEP, 6)
+    below[below.astype(np.float32) > left] -= VALUE_STEP
+    values = np.unique(np.round(np.concatenate([below, above]), 6))
+    return values[(values >= properties["min"]) & (values <= properties["max"])]
+
+
+# 调整幅度：各特征变化量按取值范围归一化后求和
+def _change_cost(feature, values, current, ranges=feature_ranges):
+    properties = ranges[feature]
+    if properties["type"] == "categorical":
+        span = max(properties["options"]) - min(properties["options"])
+    else:
+        span = properties["max"] - properties["min"]
+    return np.abs(values - float(current)) / span
+
+
+# 寻找使风险类别降低的最小调整：先只调整一个特征，找不到再同时调整两个、三个……
+# 同一组特征的候选按调整幅度从小到大分批送入森林，第一个降低风险类别的候选即为该组的最小调整；
+# 调整的特征数少的方案优先，找到后不再尝试更多特征的组合
+def search_counterfactuals(predictor, record, modifiable=DEFAULT_MODIFIABLE_FEATURES,
+                           time_budget=DEFAULT_TIME_BUDGET, batch_rows=DEFAULT_BATCH_ROWS, max_results=3):
+    start = time.perf_counter()
+    deadline = start + time_budget
+    base = predictor.frame([record])
+    current_risk = float(predictor.engine.predict_proba(base)[0, 1] * 100)
+    current_category = str(risk_categories([current_risk])[0])
+    target_rank = _RISK_ORDER[current_category]
+
+    def finish(solutions, evaluated, timed_out=False, truncated=False):
+        solutions = sorted(solutions, key=lambda s: (len(s.changes), s.cost, s.death_risk_percent))
+        return CounterfactualSearch(current_risk, current_category, solutions[:max_results], evaluated,
+                                    (time.perf_counter() - start) * 1000, not (timed_out or truncated),
+                                    timed_out, truncated)
+
+    if target_rank == 0:
+        return finish([], 0)
+
+    modifiable = [f for f in modifiable if f in predictor.feature_order]
+    candidates = {f: candidate_values(predictor.engine, f, record[f], predictor.ranges) for f in modifiable}
+    costs = {f: _change_cost(f, candidates[f], record[f], predictor.ranges) for f in modifiable}
+    base_row = base.to_numpy(dtype=np.float64)[0]
+    columns = {f: predictor.feature_order.index(f) for f in modifiable}
+
+    solutions = []
+    evaluated = 0
+    truncated = False
+    for n_changed in range(1, len(modifiable) + 1):
+        per_feature = int(MAX_CANDIDATES_PER_SUBSET ** (1 / n_changed))
+        for subset in combinations(modifiable, n_changed):
+            # 每个特征只保留离当前值最近的per_feature个候选
+            kept = {f: np.argsort(costs[f], kind='stable')[:per_feature] for f in subset}
+            truncated |= any(len(candidates[f]) > per_feature for f in subset)
+            grids = [candidates[f][kept[f]] for f in subset]
+            grid_costs = [costs[f][kept[f]] for f in subset]
+            if any(len(g) == 0 for g in grids):
+                continue
+            combos = np.array(list(product(*grids)), dtype=np.float64).reshape(-1, n_changed)
+            combo_costs = np.array(list(product(*grid_costs)), dtype=np.float64).reshape(-1, n_changed).sum(axis=1)
+            order = np.argsort(combo_costs, kind='stable')
+            for batch_start in range(0, len(order), batch_rows):
+                if time.perf_counter() > deadline:
+                    return finish(solutions, evaluated, timed_out=True, truncated=truncated)
+                rows = order[batch_start:batch_start + batch_rows]
+                X = np.repeat(base_row[None, :], len(rows), axis=0)
+                for j, feature in enumerate(subset):
+                    X[:, columns[feature]] = combos[rows, j]
+                # 只需要风险类别：只用确定性界的提前停止预测，类别与全森林严格一致且更快
+                screened = predictor.engine.predict_anytime(X, z=None).proba[:, 1] * 100
+                evaluated += len(rows)
+                ranks = np.vectorize(_RISK_ORDER.get)(risk_categories(screened))
+                hits = np.flatnonzero(ranks < target_rank)
+                if len(hits):
+                    # 候选已按调整幅度排序，第一个命中的就是这组特征的最小调整；其风险用全森林精确计算
+                    hit = hits[0]
+                    risk = float(predictor.engine.predict_proba(X[hit:hit + 1])[0, 1] * 100)
+                    changes = {f: (float(record[f]), float(combos[rows[hit], j])) for j, f in enumerate(subset)}
+                    solutions.append(Counterfactual(changes, risk, str(risk_categories([risk])[0]),
+                                                    float(combo_costs[rows[hit]])))
+                    break
+        if solutions:
+            break
+    return finish(solutions, evaluated, truncated=truncated)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="反事实搜索 - 对合成的中高风险患者计时并统计成功率")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--patients", type=int, default=50, help="参与测试的中高风险合成患者数")
+    parser.add_argument("--features", nargs="+", default=list(DEFAULT_MODIFIABLE_FEATURES), help="可调整的特征")
+    parser.add_argument("--time-budget", type=float, default=DEFAULT_TIME_BUDGET, help="每个患者的时间预算 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from predictor import Predictor
+    predictor = Predictor.load(args.model)
+    pool = synthetic_patients(args.patients * 20, rng=np.random.default_rng(args.seed),
+                              feature_order=predictor.feature_order).round(1)
+    risk = predictor.engine.predict_proba(pool)[:, 1] * 100
+    patients = pool[risk > 30].head(args.patients)
+
+    elapsed, found, complete, truncated = [], 0, 0, 0
+    for record in patients.to_dict("records"):
+        result = search_counterfactuals(predictor, record, args.features, time_budget=args.time_budget)
+        elapsed.append(result.elapsed_ms)
+        found += bool(result.solutions)
+        complete += result.complete
+        truncated += result.truncated
+    elapsed = np.asarray(elapsed)
+    print(f"{len(patients)} 个中高风险患者，可调整特征 {args.features}")
+    print(f"  找到降低风险类别的方案: {found}/{len(patients)}，完整搜索: {complete}/{len(patients)}，"
+          f"候选被截断: {truncated}/{len(patients)}")
+    print(f"  耗时: 中位数 {np.median(elapsed):.1f} ms，P95 {np.percentile(elapsed, 95):.1f} ms，最大 {elapsed.max():.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
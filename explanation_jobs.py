@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 后台计算解释的工作线程数
+DEFAULT_WORKERS = 2
+
+
+# 任务在开始或中途发现已被取消时抛出
+class ExplanationCancelled(Exception):
+    pass
+
+
+# 一个后台解释任务：key标识对应的输入，输入变化时调用方取消旧任务
+class ExplanationJob:
+    def __init__(self, key, future, cancel_event):
+        self.key = key
+        self.future = future
+        self._cancel_event = cancel_event
+
+    # 尚未开始的任务直接从队列中移除；正在运行的任务在下一个检查点停止
+    def cancel(self):
+        self._cancel_event.set()
+        self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+# 在线程池中计算预测解释，每个所有者（如一个浏览器会话）同时最多保留一个任务
+class ExplanationService:
+    def __init__(self, max_workers=DEFAULT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="explanation")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.cancelled = 0
+
+    # compute接收一个threading.Event，在耗时步骤之间检查它是否已被设置；
+    # 同一所有者的旧任务若对应不同输入则被取消，相同输入且尚未完成时直接复用
+    def submit(self, owner, key, compute):
+        with self._lock:
+            previous = self._jobs.get(owner)
+            if previous is not None and previous.key == key and not previous.done() and not previous.cancelled:
+                return previous
+            if previous is not None and not previous.done():
+                previous.cancel()
+                self.cancelled += 1
+            # 顺便清理已完成的任务
+            self._jobs = {o: job for o, job in self._jobs.items() if not job.done()}
+            cancel_event = threading.Event()
+            future = self._executor.submit(self._run, compute, cancel_event)
+            job = ExplanationJob(key, future, cancel_event)
+            self._jobs[owner] = job
+            self.submitted += 1
+        return job
+
+    @staticmethod
+    def _run(compute, cancel_event):
+        if cancel_event.is_set():
+            raise ExplanationCancelled()
+        return compute(cancel_event)
+
+    # 取消某个所有者尚未完成的任务
+    def cancel(self, owner):
+        with self._lock:
+            job = self._jobs.pop(owner, None)
+            if job is not None and not job.done():
+                job.cancel()
+                self.cancelled += 1
+
+    def stats(self):
+        with self._lock:
+            running = sum(not job.done() for job in self._jobs.values())
+        return {"submitted": self.submitted, "cancelled": self.cancelled, "running": running}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
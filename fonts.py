@@ -0,0 +1,49 @@
+import functools
+import os
+
+# 常见的Microsoft YaHei字体路径
+FONT_CANDIDATES = [
+    'C:/Windows/Fonts/msyh.ttc',  # Windows 标准路径
+    'C:/Windows/Fonts/msyh.ttf',
+    '/usr/share/fonts/windows/msyh.ttf'  # Linux 可能路径
+]
+
+FONT_FAMILY = 'Microsoft YaHei'
+
+# 没有Microsoft YaHei时依次尝试的其他中文字体（Linux服务器上常见的开源字体）
+FALLBACK_FAMILIES = ['Noto Sans CJK SC', 'Source Han Sans SC', 'WenQuanYi Micro Hei', 'WenQuanYi Zen Hei',
+                     'SimHei', 'PingFang SC']
+
+# 浏览器端（Plotly图表）使用的字体列表：与chinese_font相同的候选顺序，由浏览器选用已安装的第一个
+CSS_FONT_STACK = ", ".join([FONT_FAMILY] + FALLBACK_FAMILIES + ["sans-serif"])
+
+
+# 查找可用的中文字体文件
+def find_font_path(candidates=FONT_CANDIDATES):
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# 每个进程只解析一次字体：注册字体文件、配置rcParams，并返回缓存的FontProperties
+# matplotlib在首次需要时才导入，不影响应用的启动时间
+@functools.lru_cache(maxsize=None)
+def chinese_font():
+    import matplotlib
+    from matplotlib import font_manager
+    from matplotlib.font_manager import FontProperties
+
+    font_path = find_font_path()
+    if font_path:
+        # addfont会直接更新已加载的字体列表，无需重建字体缓存
+        font_manager.fontManager.addfont(font_path)
+    # 只使用已安装的字体族；请求不存在的字体族时matplotlib每次查找都会回退并打印警告
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    families = [f for f in [FONT_FAMILY] + FALLBACK_FAMILIES if f in installed]
+    matplotlib.rcParams['font.family'] = 'sans-serif'
+    matplotlib.rcParams['font.sans-serif'] = families + matplotlib.rcParams['font.sans-serif']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+    if font_path:
+        return FontProperties(fname=font_path)
+    return FontProperties(family=families[:1] or ['sans-serif'])
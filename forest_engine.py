@@ -0,0 +1,453 @@
+import argparse
+import math
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from model_core import (HIGH_RISK_THRESHOLD, LOW_RISK_THRESHOLD, MODEL_PATH, load_model_file,
+                        synthetic_patients)
+
+# 单次遍历的最大行数，限制 (行数 x 树数) 中间数组的内存
+DEFAULT_BLOCK_ROWS = 8192
+
+# 树间波动区间默认使用的百分位
+DEFAULT_SPREAD_PERCENTILES = (10, 90)
+
+# 提前停止预测的默认参数：置信区间的z值、最少使用的树数和每次追加的树数
+DEFAULT_ANYTIME_Z = 4.0
+DEFAULT_ANYTIME_MIN_TREES = 16
+DEFAULT_ANYTIME_STEP = 8
+
+# 不超过该行数时提前停止预测逐行计算，避免NumPy的调用开销
+ANYTIME_ROW_BY_ROW_LIMIT = 8
+
+# 一次森林遍历得到的完整预测结果；死亡概率相关字段取正类（classes_[1]）
+ForestPrediction = namedtuple('ForestPrediction', [
+    'predicted_class',  # 预测类别 (n_samples,)
+    'proba',            # 类别概率，与predict_proba相同 (n_samples, n_classes)
+    'death_votes',      # 判为死亡类的树所占比例 (n_samples,)
+    'tree_std',         # 各树死亡概率的标准差 (n_samples,)
+    'tree_low',         # 各树死亡概率的下百分位 (n_samples,)
+    'tree_high',        # 各树死亡概率的上百分位 (n_samples,)
+])
+
+
+# 提前停止的预测结果：用到全部树的行概率与predict_proba逐位一致，其余行为估计值（风险类别不变）
+AnytimePrediction = namedtuple('AnytimePrediction', [
+    'proba',       # 类别概率 (n_samples, n_classes)
+    'trees_used',  # 每行实际使用的树数 (n_samples,)
+])
+
+
+# 死亡概率对应的风险分层编号（0低/1中/2高），与risk_category使用相同的比较
+def _risk_band(death_probability):
+    percent = death_probability * 100
+    return (percent > LOW_RISK_THRESHOLD).astype(np.int8) + (percent > HIGH_RISK_THRESHOLD)
+
+
+def _scalar_risk_band(death_probability):
+    percent = death_probability * 100
+    return (percent > LOW_RISK_THRESHOLD) + (percent > HIGH_RISK_THRESHOLD)
+
+
+# 把随机森林展平为连续NumPy数组的推理引擎，结果与sklearn的predict_proba逐位一致
+class FlatForest:
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth,
+                 classes, feature_names=None, cover=None):
+        # 所有树的节点拼接在一起，子节点下标为全局下标；叶子节点的左右子节点指向自身
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        # 每个节点的类别概率 (n_nodes, n_classes)
+        self.value = value
+        # 每棵树根节点的全局下标
+        self.roots = roots
+        # 每个节点的训练样本权重之和，TreeSHAP需要；旧版紧凑格式中没有时为None
+        self.cover = cover
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        if feature_names is not None:
+            self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.n_features_in_ = int(feature.max()) + 1 if feature_names is None else len(feature_names)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_model(cls, model):
+        features, thresholds, lefts, rights, values, covers, roots = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            node_ids = np.arange(n_nodes)
+            is_leaf = tree.children_left == -1
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+            # sklearn的单棵树predict_proba直接返回叶子节点的value
+            values.append(tree.value[:, 0, :model.n_classes_])
+            covers.append(tree.weighted_n_node_samples)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n_nodes
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.intp),
+            right=np.ascontiguousarray(np.concatenate(rights), dtype=np.intp),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max_depth,
+            classes=model.classes_,
+            feature_names=getattr(model, 'feature_names_in_', None),
+            cover=np.ascontiguousarray(np.concatenate(covers), dtype=np.float64),
+        )
+
+    # 转为float32输入：sklearn的树在float32上比较阈值，保持一致才能逐位对齐
+    def _as_array(self, X):
+        if hasattr(X, 'columns') and hasattr(self, 'feature_names_in_'):
+            # 列已按模型顺序排列时不必重新选取，单行请求上可省去大部分转换开销
+            if not np.array_equal(X.columns, self.feature_names_in_):
+                X = X[list(self.feature_names_in_)]
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return X
+
+    # 返回每行在每棵树中落入的叶子节点全局下标 (n_samples, n_trees)
+    def apply(self, X):
+        return self._descend(self._as_array(X), self.roots)
+
+    # 从给定的根节点同时下降到叶子，X须已由_as_array转换
+    def _descend(self, X, roots):
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(roots, (X.shape[0], len(roots)))
+        # 所有树同时逐层下降；到达叶子后节点不再变化
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    # 每棵树对每行的类别概率 (n_samples, n_trees, n_classes)
+    def tree_predictions(self, X):
+        return self.value[self.apply(X)]
+
+    # 按树的顺序依次累加再求平均，与sklearn的累加顺序一致
+    @staticmethod
+    def _average(per_tree):
+        total = np.zeros((per_tree.shape[0], per_tree.shape[2]), dtype=np.float64)
+        for t in range(per_tree.shape[1]):
+            total += per_tree[:, t]
+        total /= per_tree.shape[1]
+        return total
+
+    def predict_proba(self, X, block_rows=DEFAULT_BLOCK_ROWS):
+        X = self._as_array(X)
+        proba = np.empty((X.shape[0], len(self.classes_)), dtype=np.float64)
+        for start in range(0, X.shape[0], block_rows):
+            proba[start:start + block_rows] = self._average(self.tree_predictions(X[start:start + block_rows]))
+        return proba
+
+    def predict(self, X):
+        return self.predict_detailed(X).predicted_class
+
+    # 一次森林遍历同时得到类别、概率和树间波动，避免predict与predict_proba各遍历一次
+    def predict_detailed(self, X, percentiles=DEFAULT_SPREAD_PERCENTILES, block_rows=DEFAULT_BLOCK_ROWS):
+        X = self._as_array(X)
+        if X.shape[0] == 0:
+            # 空输入直接汇总，返回形状正确的空数组
+            return self.summarize(self.tree_predictions(X), self.classes_, percentiles)
+        parts = [self.summarize(self.tree_predictions(X[start:start + block_rows]), self.classes_, percentiles)
+                 for start in range(0, X.shape[0], block_rows)]
+        return ForestPrediction(*(np.concatenate(field) for field in zip(*parts)))
+
+    # 由各树的类别概率 (n_samples, n_trees, n_classes) 得到类别、概率和树间波动
+    @classmethod
+    def summarize(cls, per_tree, classes, percentiles=DEFAULT_SPREAD_PERCENTILES):
+        proba = cls._average(per_tree)
+        death = per_tree[:, :, 1]
+        low, high = np.percentile(death, percentiles, axis=1)
+        return ForestPrediction(
+            np.asarray(classes).take(np.argmax(proba, axis=1), axis=0),
+            proba,
+            (np.argmax(per_tree, axis=2) == 1).mean(axis=1),
+            death.std(axis=1),
+            low,
+            high,
+        )
+
+    # 提前停止所需的辅助表：rest_low[k]/rest_high[k] 为第k棵树及之后所有树叶子死亡概率最小值/最大值之和，
+    # 用于界定尚未计算的树能把全森林平均推到多远；另备一份Python列表供逐行路径使用
+    def _anytime_tables(self):
+        if getattr(self, '_anytime_cache', None) is None:
+            is_leaf = self.left == np.arange(len(self.left))
+            tree_of_node = np.searchsorted(self.roots, np.arange(len(self.left)), side='right') - 1
+            low = np.full(self.n_estimators, np.inf)
+            high = np.full(self.n_estimators, -np.inf)
+            np.minimum.at(low, tree_of_node[is_leaf], self.value[is_leaf, 1])
+            np.maximum.at(high, tree_of_node[is_leaf], self.value[is_leaf, 1])
+            rest_low = np.append(np.cumsum(low[::-1])[::-1], 0.0)
+            rest_high = np.append(np.cumsum(high[::-1])[::-1], 0.0)
+            lists = tuple(np.asarray(a).tolist() for a in (
+                self.feature, self.threshold, self.left, self.right,
+                self.value[:, 0], self.value[:, 1], self.roots, rest_low, rest_high))
+            self._anytime_cache = rest_low, rest_high, lists
+        return self._anytime_cache
+
+    # 提前停止的预测：按树的顺序每追加step棵树检查一次，死亡概率的区间完全落在同一风险类别内即停止。
+    # 区间取以下两者的交集：
+    #   - 确定性界：剩余的树都取其叶子死亡概率的最小/最大值时全森林平均能达到的范围；
+    #   - 置信区间：已计算树的均值 ± z 倍标准误（按有限总体修正），z为None时只用确定性界，类别与全森林严格一致。
+    # 接近阈值、无法确定类别的行会一直算到全部树，结果与predict_proba逐位一致。
+    # 行数很少时NumPy的调用开销远大于少算几棵树省下的时间，改为逐行在Python列表上遍历，两条路径结果逐位相同。
+    def predict_anytime(self, X, z=DEFAULT_ANYTIME_Z, min_trees=DEFAULT_ANYTIME_MIN_TREES,
+                        step=DEFAULT_ANYTIME_STEP):
+        X = self._as_array(X)
+        if X.shape[0] <= ANYTIME_ROW_BY_ROW_LIMIT:
+            return self._anytime_by_row(X, z, min_trees, step)
+        return self._anytime_vectorized(X, z, min_trees, step)
+
+    def _anytime_vectorized(self, X, z, min_trees, step):
+        n_trees = self.n_estimators
+        rest_low, rest_high, _ = self._anytime_tables()
+        proba = np.empty((X.shape[0], len(self.classes_)), dtype=np.float64)
+        trees_used = np.full(X.shape[0], n_trees, dtype=np.intp)
+        # 仍在计算的行及其累加量
+        active = np.arange(X.shape[0])
+        total = np.zeros((X.shape[0], len(self.classes_)), dtype=np.float64)
+        death_squares = np.zeros(X.shape[0], dtype=np.float64)
+        for start in range(0, n_trees, step):
+            k = min(start + step, n_trees)
+            per_tree = self.value[self._descend(X[active], self.roots[start:k])]
+            # 与_average相同的逐棵累加顺序，算完全部树时结果逐位一致
+            for t in range(per_tree.shape[1]):
+                total += per_tree[:, t]
+                death_squares += per_tree[:, t, 1] * per_tree[:, t, 1]
+            if k == n_trees:
+                proba[active] = total / n_trees
+                break
+
+            death_sum = total[:, 1]
+            mean = death_sum / k
+            bound_low = (death_sum + rest_low[k]) / n_trees
+            bound_high = (death_sum + rest_high[k]) / n_trees
+            decided = _risk_band(bound_low) == _risk_band(bound_high)
+            if z is not None and k >= min_trees:
+                variance = np.maximum(death_squares / k - mean * mean, 0.0) * k / (k - 1)
+                margin = z * np.sqrt(variance / k * (n_trees - k) / (n_trees - 1))
+                interval_low = np.maximum(mean - margin, bound_low)
+                interval_high = np.minimum(mean + margin, bound_high)
+                decided |= _risk_band(interval_low) == _risk_band(interval_high)
+            if not decided.any():
+                continue
+
+            # 已确定类别的行：以已计算树的均值作为估计，并限制在确定性界内
+            rows = active[decided]
+            death = np.minimum(np.maximum(mean[decided], bound_low[decided]), bound_high[decided])
+            proba[rows, 1] = death
+            proba[rows, 0] = 1.0 - death
+            trees_used[rows] = k
+            keep = ~decided
+            active, total, death_squares = active[keep], total[keep], death_squares[keep]
+            if len(active) == 0:
+                break
+        return AnytimePrediction(proba, trees_used)
+
+    # 与_anytime_vectorized相同的规则和运算顺序，逐行逐棵树在Python标量上计算
+    def _anytime_by_row(self, X, z, min_trees, step):
+        feature, threshold, left, right, survival, death, roots, rest_low, rest_high = self._anytime_tables()[2]
+        n_trees = len(roots)
+        proba = np.empty((X.shape[0], len(self.classes_)), dtype=np.float64)
+        trees_used = np.full(X.shape[0], n_trees, dtype=np.intp)
+        for row, x in enumerate(X.tolist()):
+            survival_sum = death_sum = death_squares = 0.0
+            for k, node in enumerate(roots, 1):
+                while left[node] != node:
+                    node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+                survival_sum += survival[node]
+                death_sum += death[node]
+                death_squares += death[node] * death[node]
+                if k % step and k != n_trees:
+                    continue
+                if k == n_trees:
+                    proba[row] = survival_sum / n_trees, death_sum / n_trees
+                    break
+                mean = death_sum / k
+                bound_low = (death_sum + rest_low[k]) / n_trees
+                bound_high = (death_sum + rest_high[k]) / n_trees
+                decided = _scalar_risk_band(bound_low) == _scalar_risk_band(bound_high)
+                if not decided and z is not None and k >= min_trees:
+                    variance = max(death_squares / k - mean * mean, 0.0) * k / (k - 1)
+                    margin = z * math.sqrt(variance / k * (n_trees - k) / (n_trees - 1))
+                    decided = (_scalar_risk_band(max(mean - margin, bound_low))
+                               == _scalar_risk_band(min(mean + margin, bound_high)))
+                if decided:
+                    estimate = min(max(mean, bound_low), bound_high)
+                    proba[row] = 1.0 - estimate, estimate
+                    trees_used[row] = k
+                    break
+        return AnytimePrediction(proba, trees_used)
+
+
+# 取出预测结果中的部分行
+def take_rows(prediction, rows):
+    return ForestPrediction(*(field[rows] for field in prediction))
+
+
+# 把多片森林拼接为一片，特征下标映射到各模型特征的并集（按出现顺序），返回 (拼接后的森林, 各模型的树的下标范围)。
+# 一次遍历得到所有模型每棵树的输出，按范围分别交给summarize，结果与各模型单独预测逐位一致
+def stack_forests(engines, feature_orders):
+    if len({np.asarray(engine.value).shape[1] for engine in engines}) > 1:
+        raise ValueError("各模型的类别数不同，无法拼接")
+    feature_names = list(dict.fromkeys(f for order in feature_orders for f in order))
+    position = {f: i for i, f in enumerate(feature_names)}
+    features, thresholds, lefts, rights, values, roots, tree_ranges = [], [], [], [], [], [], []
+    node_offset = tree_offset = 0
+    for engine, order in zip(engines, feature_orders):
+        mapping = np.array([position[f] for f in order], dtype=np.intp)
+        features.append(mapping[np.asarray(engine.feature, dtype=np.intp)])
+        # 紧凑格式的float32阈值转回float64后比较结果不变
+        thresholds.append(np.asarray(engine.threshold, dtype=np.float64))
+        lefts.append(np.asarray(engine.left, dtype=np.intp) + node_offset)
+        rights.append(np.asarray(engine.right, dtype=np.intp) + node_offset)
+        values.append(np.asarray(engine.value, dtype=np.float64))
+        roots.append(np.asarray(engine.roots, dtype=np.intp) + node_offset)
+        tree_ranges.append((tree_offset, tree_offset + engine.n_estimators))
+        node_offset += len(engine.feature)
+        tree_offset += engine.n_estimators
+    stacked = FlatForest(
+        feature=np.concatenate(features), threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts), right=np.concatenate(rights), value=np.concatenate(values),
+        roots=np.concatenate(roots), max_depth=max(engine.max_depth for engine in engines),
+        classes=engines[0].classes_, feature_names=feature_names,
+    )
+    return stacked, tree_ranges
+
+
+# 从模型文件直接构建推理引擎
+def load_engine(path=MODEL_PATH):
+    return FlatForest.from_model(load_model_file(path))
+
+
+# 对照sklearn检查结果是否逐位一致；sklearn多线程累加顺序不固定，这里固定为单线程
+def check_parity(model, engine, X):
+    n_jobs = model.n_jobs
+    model.n_jobs = 1
+    try:
+        expected = model.predict_proba(X)
+    finally:
+        model.n_jobs = n_jobs
+    actual = engine.predict_proba(X)
+    return np.array_equal(expected, actual), expected, actual
+
+
+# 一次遍历的predict_detailed与predict_proba、sklearn的predict是否一致，返回不一致项的说明列表
+def check_detailed_parity(model, engine, X, expected_proba):
+    problems = []
+    detailed = engine.predict_detailed(X)
+    if not np.array_equal(detailed.proba, expected_proba):
+        problems.append(f"predict_detailed 概率最大差异 {np.abs(detailed.proba - expected_proba).max():.3e}")
+    n_jobs = model.n_jobs
+    model.n_jobs = 1
+    try:
+        mismatched = int((detailed.predicted_class != model.predict(X)).sum())
+    finally:
+        model.n_jobs = n_jobs
+    if mismatched:
+        problems.append(f"predict_detailed 类别与 sklearn predict 不一致 {mismatched} 行")
+    empty = engine.predict_detailed(X.iloc[:0] if hasattr(X, "iloc") else X[:0])
+    if any(len(field) for field in empty):
+        problems.append("空输入未返回空结果")
+    return problems
+
+
+# 恰好落在各分裂阈值上的样本，用于检查 <= 的边界处理
+def threshold_edge_cases(engine, n_rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    feature_order = list(engine.feature_names_in_)
+    X = synthetic_patients(n_rows, rng=rng, feature_order=feature_order).to_numpy(dtype=np.float64)
+    internal = engine.left != np.arange(len(engine.left))
+    picks = rng.choice(np.flatnonzero(internal), size=n_rows)
+    X[np.arange(n_rows), engine.feature[picks]] = engine.threshold[picks]
+    return X
+
+
+# 提前停止预测与全森林predict_proba的对比：风险类别一致率、使用的树数以及逐行调用的延迟
+def anytime_report(engine, X, z=DEFAULT_ANYTIME_Z, min_trees=DEFAULT_ANYTIME_MIN_TREES,
+                   step=DEFAULT_ANYTIME_STEP, latency_rows=500):
+    X = engine._as_array(X)
+    full = engine.predict_proba(X)
+    fast = engine.predict_anytime(X, z=z, min_trees=min_trees, step=step)
+    exhausted = fast.trees_used == engine.n_estimators
+
+    def per_row_ms(predict):
+        start = time.perf_counter()
+        for row in X[:latency_rows]:
+            predict(row)
+        return (time.perf_counter() - start) * 1000 / min(latency_rows, len(X))
+
+    return {
+        "rows": len(X),
+        "category_agreement": float((_risk_band(full[:, 1]) == _risk_band(fast.proba[:, 1])).mean()),
+        "mean_trees_used": float(fast.trees_used.mean()),
+        "full_forest_rows": float(exhausted.mean()),
+        "full_forest_rows_identical": bool(np.array_equal(full[exhausted], fast.proba[exhausted])),
+        "max_abs_error": float(np.abs(full[:, 1] - fast.proba[:, 1]).max()) if len(X) else 0.0,
+        "full_ms_per_row": per_row_ms(engine.predict_proba),
+        "anytime_ms_per_row": per_row_ms(lambda row: engine.predict_anytime(row, z=z, min_trees=min_trees,
+                                                                            step=step)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="展平随机森林推理引擎 - 与sklearn结果一致性检查")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--rows", type=int, default=10000, help="随机生成的检查样本数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--anytime", action="store_true",
+                        help="同时对比提前停止预测与全森林的风险类别一致率和延迟")
+    parser.add_argument("--z", type=float, default=DEFAULT_ANYTIME_Z,
+                        help="提前停止的置信区间z值；0表示只用确定性界，类别严格一致")
+    args = parser.parse_args(argv)
+
+    model = load_model_file(args.model)
+    engine = FlatForest.from_model(model)
+    feature_order = list(engine.feature_names_in_)
+    samples = synthetic_patients(args.rows, rng=np.random.default_rng(args.seed), feature_order=feature_order)
+    edges = pd.DataFrame(threshold_edge_cases(engine, seed=args.seed), columns=feature_order)
+    X = pd.concat([samples, edges], ignore_index=True)
+
+    identical, expected, actual = check_parity(model, engine, X)
+    if not identical:
+        diff = np.abs(expected - actual).max()
+        print(f"不一致: 最大差异 {diff:.3e}", file=sys.stderr)
+        return 1
+    problems = check_detailed_parity(model, engine, X, expected)
+    if problems:
+        print(f"不一致: {'；'.join(problems)}", file=sys.stderr)
+        return 1
+    print(f"一致: {len(X)} 行，{engine.n_estimators} 棵树，predict_proba 逐位相同，predict_detailed 的概率和类别一致")
+
+    if args.anytime:
+        report = anytime_report(engine, X, z=args.z or None)
+        print(f"提前停止 (z={args.z or '仅确定性界'}): 风险类别一致率 {report['category_agreement']:.4%}，"
+              f"平均使用 {report['mean_trees_used']:.1f}/{engine.n_estimators} 棵树，"
+              f"{report['full_forest_rows']:.1%} 的行回退到全森林"
+              f"（{'逐位一致' if report['full_forest_rows_identical'] else '不一致'}），"
+              f"概率最大偏差 {report['max_abs_error'] * 100:.1f} 个百分点")
+        print(f"  单行延迟: 全森林 {report['full_ms_per_row']:.3f} ms -> 提前停止 {report['anytime_ms_per_row']:.3f} ms")
+        if not report['full_forest_rows_identical']:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
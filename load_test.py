@@ -0,0 +1,250 @@
+import argparse
+import json
+import sys
+import threading
+import time
+import warnings
+from contextlib import contextmanager, nullcontext
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from memory_guard import rss_bytes
+from model_core import feature_ranges, synthetic_patients
+
+warnings.filterwarnings('ignore')
+
+APP_PATH = "APP4.py"
+
+# 预测按钮的文字，与APP4.py中的表单提交按钮一致
+PREDICT_BUTTON_LABEL = "开始预测"
+
+# 单次页面运行的超时（秒）
+DEFAULT_RUN_TIMEOUT = 60
+
+# 采样进程内存的间隔（秒）
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+# 并发会话共用Runtime依赖AppTest的内部实现，只在验证过的Streamlit版本（与requirements.txt一致）上启用
+SHARED_RUNTIME_STREAMLIT_VERSIONS = ("1.30.",)
+
+
+# 后台线程定期采样常驻内存，记录压测期间的峰值
+class MemorySampler:
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_rss = rss_bytes()
+        self.peak_rss = self.start_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+
+    def _sample(self):
+        rss = rss_bytes()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+# 其他Streamlit版本上拒绝运行，避免内部实现变化后静默地得到错误的压测结果
+def check_streamlit_version():
+    import streamlit
+    if not streamlit.__version__.startswith(SHARED_RUNTIME_STREAMLIT_VERSIONS):
+        raise RuntimeError(f"并发压测依赖 Streamlit {'/'.join(v + 'x' for v in SHARED_RUNTIME_STREAMLIT_VERSIONS)} "
+                           f"的AppTest内部实现，当前版本为 {streamlit.__version__}；"
+                           f"请安装requirements.txt中的版本，或只用 --sessions 1 运行")
+
+
+# AppTest每次运行都会替换全局的Runtime实例并在结束时清空，多个会话并发运行时会互相干扰。
+# 压测期间改为所有会话共用一个模拟的Runtime（与真实部署中同一进程内的会话共用一个Runtime一致），
+# AppTest自身的替换只作用于一个子类，不影响正在运行的其他会话。
+# 每次运行新建的ScriptCache会让各会话同时编译页面脚本，而并发构造AST在CPython中不安全，
+# 因此同样改为共用一个ScriptCache（真实部署中也由Runtime共用），页面脚本只编译一次
+@contextmanager
+def shared_test_runtime():
+    check_streamlit_version()
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    script_cache = ScriptCache()
+    saved_instance, saved_class = Runtime._instance, app_test.Runtime
+    saved_cache = local_script_runner.ScriptCache
+    Runtime._instance = runtime
+    app_test.Runtime = type("IsolatedRuntime", (Runtime,), {})
+    local_script_runner.ScriptCache = lambda: script_cache
+    try:
+        yield runtime
+    finally:
+        local_script_runner.ScriptCache = saved_cache
+        app_test.Runtime = saved_class
+        Runtime._instance = saved_instance
+
+
+# 把一位患者的取值填入页面控件；带format_func的单选按钮在AppTest中以显示文字作为选项，按下标换算
+def fill_inputs(at, record, ranges=feature_ranges):
+    sliders = {s.label: s for s in at.slider}
+    radios = {r.label: r for r in at.radio}
+    for feature, value in record.items():
+        if ranges[feature]["type"] == "numerical":
+            sliders[feature].set_value(float(value))
+        else:
+            radio = radios[feature]
+            radio.set_value(radio.options[list(ranges[feature]["options"]).index(value)])
+
+
+def predict_button(at):
+    for button in at.button:
+        if button.label == PREDICT_BUTTON_LABEL:
+            return button
+    raise LookupError(f"页面上没有找到“{PREDICT_BUTTON_LABEL}”按钮")
+
+
+# 一个模拟会话：打开页面，之后依次填入随机患者并点击预测，记录每次预测的页面运行耗时
+def run_session(app_path, patients, think_time, timeout, results, errors):
+    from streamlit.testing.v1 import AppTest
+    try:
+        at = AppTest.from_file(app_path, default_timeout=timeout)
+        start = time.perf_counter()
+        at.run()
+        results["page_load"].append((time.perf_counter() - start) * 1000)
+        for record in patients:
+            fill_inputs(at, record)
+            predict_button(at).click()
+            start = time.perf_counter()
+            at.run()
+            elapsed = (time.perf_counter() - start) * 1000
+            if len(at.exception) or len(at.error):
+                problems = [e.value for e in at.exception] + [e.value for e in at.error]
+                errors.append(f"预测出错: {problems[0]}")
+            else:
+                results["predict"].append(elapsed)
+            if think_time:
+                time.sleep(think_time)
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+
+
+def _summarize(timings):
+    timings = np.asarray(timings, dtype=float)
+    if not len(timings):
+        return None
+    return {
+        "count": int(len(timings)),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "max_ms": float(timings.max()),
+    }
+
+
+# 以n_sessions个并发会话各发起requests次预测，返回吞吐量、延迟分位数和内存峰值
+def run_load(n_sessions, requests, app_path=APP_PATH, seed=0, think_time=0.0, timeout=DEFAULT_RUN_TIMEOUT):
+    rng = np.random.default_rng([seed, n_sessions])
+    # 输入步长为0.1，与页面滑块一致
+    patients = synthetic_patients(n_sessions * requests, rng=rng).round(1).to_dict("records")
+    results = {"page_load": [], "predict": []}
+    errors = []
+    threads = [threading.Thread(target=run_session, name=f"session-{i}",
+                                args=(app_path, patients[i * requests:(i + 1) * requests], think_time, timeout,
+                                      results, errors))
+               for i in range(n_sessions)]
+    # 只有一个会话时直接使用公开的AppTest接口，不需要共用Runtime
+    with shared_test_runtime() if n_sessions > 1 else nullcontext(), MemorySampler() as memory:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+    return {
+        "sessions": n_sessions,
+        "requests_per_session": requests,
+        "wall_s": wall,
+        "throughput_rps": len(results["predict"]) / wall if wall > 0 else 0.0,
+        "predict": _summarize(results["predict"]),
+        "page_load": _summarize(results["page_load"]),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "rss_start_mb": memory.start_rss / 2**20 if memory.start_rss is not None else None,
+        "rss_peak_mb": memory.peak_rss / 2**20 if memory.peak_rss is not None else None,
+    }
+
+
+def _print_report(report):
+    predict = report["predict"]
+    line = f"{report['sessions']:>3} 个会话  吞吐量 {report['throughput_rps']:6.2f} 次/秒"
+    if predict is not None:
+        line += (f"  预测 P50 {predict['p50_ms']:7.1f} ms  P95 {predict['p95_ms']:7.1f} ms"
+                 f"  P99 {predict['p99_ms']:7.1f} ms")
+    if report["rss_peak_mb"] is not None:
+        line += f"  内存峰值 {report['rss_peak_mb']:.0f} MB"
+    if report["errors"]:
+        line += f"  错误 {report['errors']}"
+    print(line)
+    for sample in report["error_samples"]:
+        print(f"    {sample}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并发会话压测 - 用AppTest在本地无浏览器地模拟多个会话同时预测")
+    parser.add_argument("--app", default=APP_PATH, help="Streamlit应用脚本")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="并发会话数，可给出多个依次测试")
+    parser.add_argument("--requests", type=int, default=20, help="每个会话发起的预测次数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="同一会话两次预测之间的间隔 (秒)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_RUN_TIMEOUT, help="单次页面运行的超时 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="把结果写入JSON文件")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="任一并发级别的预测P95超过该值时以非零状态退出")
+    args = parser.parse_args(argv)
+
+    if max(args.sessions) > 1:
+        try:
+            check_streamlit_version()
+        except RuntimeError as e:
+            print(f"错误: {e}", file=sys.stderr)
+            return 2
+
+    # 先单独运行一次页面，模型加载和预热不计入压测
+    from streamlit.testing.v1 import AppTest
+    AppTest.from_file(args.app, default_timeout=args.timeout).run()
+
+    reports = []
+    for n_sessions in args.sessions:
+        report = run_load(n_sessions, args.requests, args.app, args.seed, args.think_time, args.timeout)
+        _print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"app": args.app, "reports": reports}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+    failed = any(report["errors"] for report in reports)
+    if args.max_p95_ms is not None:
+        slow = [r["sessions"] for r in reports if r["predict"] is not None and r["predict"]["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"预测P95超过 {args.max_p95_ms} ms 的并发级别: {slow}", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# 定期检查内存的间隔（秒）
+MEMORY_CHECK_INTERVAL = float(os.environ.get("MEMORY_CHECK_INTERVAL", "30"))
+
+# 进程常驻内存超过该值（MB）时告警；设为0表示不检查
+MEMORY_WARN_MB = float(os.environ.get("MEMORY_WARN_MB", "1024"))
+
+# 超过该值（MB）时执行清理：清空共享的结果缓存、关闭残留的matplotlib图、回收垃圾并把空闲堆内存归还系统
+MEMORY_CLEANUP_MB = float(os.environ.get("MEMORY_CLEANUP_MB", "1536"))
+
+# 两次清理之间的最短间隔（秒），清理后内存仍高于阈值时不会反复清理
+MEMORY_CLEANUP_COOLDOWN = float(os.environ.get("MEMORY_CLEANUP_COOLDOWN", "300"))
+
+# 单个会话的session_state超过该值（MB）时丢弃其中可重新计算的大对象
+SESSION_STATE_LIMIT_MB = float(os.environ.get("SESSION_STATE_LIMIT_MB", "64"))
+
+# 设为1时启动tracemalloc，调试面板列出相对启动时增长最多的代码位置；会明显拖慢内存分配，默认关闭
+MEMORY_TRACEMALLOC = os.environ.get("MEMORY_TRACEMALLOC", "0") == "1"
+
+# 会话超过该时间（秒）没有运行后不再计入会话统计
+SESSION_TTL = 3600
+
+# tracemalloc对比时列出的代码位置数
+TOP_ALLOCATIONS = 10
+
+logger = logging.getLogger("prediction.memory")
+
+
+# 当前进程的常驻内存（字节）；不支持/proc的系统返回None
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# 进程启动以来常驻内存的峰值（字节）
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# 存活的图表对象数。pyplot未关闭的图会一直留在pyplot的全局列表中；其余图表对象需要遍历垃圾回收器
+# 跟踪的全部对象（约20万个对象时约70 ms），只在后台定期检查时进行。未导入的库不会被导入
+def live_figures(scan=True):
+    counts = {}
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is not None:
+        counts["pyplot"] = len(pyplot.get_fignums())
+    if scan:
+        types = {}
+        if "matplotlib.figure" in sys.modules:
+            types["matplotlib"] = sys.modules["matplotlib.figure"].Figure
+        if "plotly.basedatatypes" in sys.modules:
+            types["plotly"] = sys.modules["plotly.basedatatypes"].BaseFigure
+        counts.update({name: 0 for name in types})
+        for obj in gc.get_objects():
+            for name, figure_type in types.items():
+                if isinstance(obj, figure_type):
+                    counts[name] += 1
+    return counts
+
+
+# 对象占用内存的估计（字节）：递归计入容器内容，numpy数组和pandas对象按数据大小计算，同一对象只计一次
+def deep_sizeof(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True, index=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+# glibc的malloc_trim：把空闲的堆内存归还操作系统，否则释放后的内存仍计入常驻内存
+def _malloc_trim():
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        return bool(libc.malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+
+# 释放可回收的内存：关闭pyplot中残留的图、完整回收一次垃圾并归还空闲堆内存，返回常驻内存的减少量（字节）
+def release_memory():
+    before = rss_bytes()
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is not None:
+        pyplot.close("all")
+    gc.collect()
+    _malloc_trim()
+    after = rss_bytes()
+    return before - after if before is not None and after is not None else None
+
+
+# 长时间运行的服务进程的内存监控：后台定期检查进程常驻内存、存活的图表对象和各会话状态的大小，
+# 写入指标；超过告警阈值时记录日志，超过清理阈值时执行注册的清理操作（如清空结果缓存）并释放内存
+class MemoryGuard:
+    def __init__(self, metrics=None, warn_mb=MEMORY_WARN_MB, cleanup_mb=MEMORY_CLEANUP_MB,
+                 session_limit_mb=SESSION_STATE_LIMIT_MB, interval=MEMORY_CHECK_INTERVAL,
+                 cleanup_cooldown=MEMORY_CLEANUP_COOLDOWN, trace=MEMORY_TRACEMALLOC, cleanups=()):
+        self.metrics = metrics
+        self.warn_bytes = warn_mb * 2**20
+        self.cleanup_bytes = cleanup_mb * 2**20
+        self.session_limit_bytes = session_limit_mb * 2**20
+        self.interval = interval
+        self.cleanup_cooldown = cleanup_cooldown
+        self.cleanups = list(cleanups)
+        self.alerts = 0
+        self.cleanups_run = 0
+        self.session_trims = 0
+        self.last_cleanup = None
+        self._last_cleanup_time = None
+        self._last_status = None
+        # 会话标识 -> (session_state大小, 最近一次运行的时间)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._baseline = None
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if tracemalloc.is_tracing():
+            self._baseline = tracemalloc.take_snapshot()
+
+    # 注册一个清理操作（无参数的可调用对象），超过清理阈值时按注册顺序执行
+    def add_cleanup(self, cleanup):
+        self.cleanups.append(cleanup)
+
+    # 记录一个会话当前session_state的大小并返回（字节）；每次运行结束时调用
+    def record_session(self, session_id, state):
+        size = deep_sizeof(dict(state))
+        with self._lock:
+            self._sessions[session_id] = (size, time.monotonic())
+        return size
+
+    # 记录会话状态的大小，超过上限时从state中丢弃keys中的条目（应为可重新计算的结果），
+    # 返回 (丢弃后的大小, 丢弃的条目)
+    def trim_session(self, session_id, state, keys):
+        size = self.record_session(session_id, state)
+        if size <= self.session_limit_bytes:
+            return size, []
+        dropped = [key for key in keys if key in state]
+        for key in dropped:
+            del state[key]
+        if dropped:
+            self.session_trims += 1
+            self._increment("session_state_trims_total")
+            logger.warning("会话状态 %.1f MB 超过上限，已丢弃: %s", size / 2**20, dropped)
+            size = self.record_session(session_id, state)
+        return size, dropped
+
+    def _session_sizes(self):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions = {k: v for k, v in self._sessions.items() if now - v[1] <= SESSION_TTL}
+            return [size for size, _ in self._sessions.values()]
+
+    def _increment(self, name, **labels):
+        if self.metrics is not None:
+            self.metrics.increment(name, **labels)
+
+    def _set_gauge(self, name, value, **labels):
+        if self.metrics is not None and value is not None:
+            self.metrics.set_gauge(name, value, **labels)
+
+    # 检查一次并写入指标，返回当前状态；scan_figures为False时不遍历全部对象统计图表数
+    def check(self, scan_figures=True):
+        rss = rss_bytes()
+        figures = live_figures(scan_figures)
+        sessions = self._session_sizes()
+        status = {
+            "checked_at": time.time(),
+            "rss_bytes": rss,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "figures": figures,
+            "sessions": len(sessions),
+            "session_state_max_bytes": max(sessions, default=0),
+            "session_state_total_bytes": sum(sessions),
+            "traced_bytes": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+            "level": "ok",
+        }
+        if rss is not None and self.cleanup_bytes and rss > self.cleanup_bytes:
+            status["level"] = "cleanup"
+            self._maybe_cleanup(rss)
+        elif rss is not None and self.warn_bytes and rss > self.warn_bytes:
+            status["level"] = "warn"
+        if status["level"] != "ok":
+            self.alerts += 1
+            self._increment("memory_alerts_total", level=status["level"])
+            logger.warning("进程常驻内存 %.0f MB 超过%s阈值", rss / 2**20,
+                           "清理" if status["level"] == "cleanup" else "告警")
+        status["last_cleanup"] = self.last_cleanup
+
+        self._set_gauge("process_resident_memory_bytes", rss)
+        self._set_gauge("process_peak_resident_memory_bytes", status["peak_rss_bytes"])
+        for library, count in figures.items():
+            self._set_gauge("live_figures", count, library=library)
+        self._set_gauge("streamlit_sessions_tracked", status["sessions"])
+        self._set_gauge("session_state_bytes", status["session_state_max_bytes"], stat="max")
+        self._set_gauge("session_state_bytes", status["session_state_total_bytes"], stat="total")
+        self._set_gauge("tracemalloc_traced_bytes", status["traced_bytes"])
+        if self.metrics is not None:
+            self.metrics.maybe_flush()
+        self._last_status = status
+        return status
+
+    def _maybe_cleanup(self, rss):
+        now = time.monotonic()
+        if self._last_cleanup_time is not None and now - self._last_cleanup_time < self.cleanup_cooldown:
+            return
+        self._last_cleanup_time = now
+        for cleanup in self.cleanups:
+            try:
+                cleanup()
+            except Exception:
+                logger.exception("内存清理操作失败")
+        released = release_memory()
+        self.cleanups_run += 1
+        self._increment("memory_cleanups_total")
+        self.last_cleanup = {"at": time.time(), "rss_before_bytes": rss, "released_bytes": released}
+        logger.warning("已执行内存清理，释放 %.0f MB", (released or 0) / 2**20)
+
+    # 最近一次检查的结果；尚未检查过时立即检查一次
+    def status(self):
+        return self._last_status or self.check()
+
+    # 相对启动时增长最多的代码位置 [(文件:行号, 增长字节数, 增长的分配次数)]；未启用tracemalloc时返回空列表
+    def top_growth(self, limit=TOP_ALLOCATIONS):
+        if self._baseline is None or not tracemalloc.is_tracing():
+            return []
+        stats = tracemalloc.take_snapshot().compare_to(self._baseline, "lineno")
+        return [(f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size_diff, stat.count_diff)
+                for stat in stats[:limit]]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("检查内存时出错")
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="memory-guard", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# 指标文件路径，可通过环境变量覆盖；设为空字符串则不写文件
+METRICS_PATH = os.environ.get("METRICS_PATH", "metrics.prom")
+
+# 指标文件的最短写入间隔（秒），避免每次请求都写磁盘
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+# 各阶段耗时直方图的桶上限（毫秒）
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# 逐请求耗时日志的输出文件；未设置时输出到标准错误
+TIMING_LOG_PATH = os.environ.get("PREDICTION_TIMING_LOG")
+
+# 结构化的逐请求耗时日志
+timing_logger = logging.getLogger("prediction.timing")
+
+logger = logging.getLogger("prediction.metrics")
+
+
+# 为耗时日志配置独立的输出，每行一条JSON记录
+def configure_timing_log(path=TIMING_LOG_PATH):
+    if timing_logger.handlers:
+        return timing_logger
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    timing_logger.addHandler(handler)
+    timing_logger.setLevel(logging.INFO)
+    timing_logger.propagate = False
+    return timing_logger
+
+
+# 记录单次请求各阶段耗时的计时器
+class RequestTimer:
+    def __init__(self):
+        self.stages = {}
+        # 从请求开始到某个时刻的耗时，例如风险数值显示出来的时刻
+        self.marks = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def mark(self, name):
+        self.marks[name] = (time.perf_counter() - self._start) * 1000
+
+    # 并入在其他线程中记录的阶段耗时
+    def merge(self, stages):
+        for name, ms in stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    @property
+    def total_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    # 以一行JSON记录本次请求的各阶段耗时
+    def log(self, **fields):
+        record = {"event": "prediction", "total_ms": round(self.total_ms, 3),
+                  "stages_ms": {k: round(v, 3) for k, v in self.stages.items()}}
+        if self.marks:
+            record["marks_ms"] = {k: round(v, 3) for k, v in self.marks.items()}
+        record.update(fields)
+        timing_logger.info(json.dumps(record, ensure_ascii=False))
+        return record
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+
+
+# 进程内的指标汇总：各阶段耗时直方图和计数器，可导出为Prometheus文本格式
+class MetricsRegistry:
+    def __init__(self, path=METRICS_PATH, flush_interval=METRICS_FLUSH_INTERVAL,
+                 buckets=LATENCY_BUCKETS_MS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def observe_request(self, timer):
+        with self._lock:
+            for stage, ms in timer.stages.items():
+                self._histograms.setdefault(stage, _Histogram(self.buckets)).observe(ms)
+            for name, ms in timer.marks.items():
+                self._histograms.setdefault(f"until_{name}", _Histogram(self.buckets)).observe(ms)
+            self._histograms.setdefault("total", _Histogram(self.buckets)).observe(timer.total_ms)
+        self.maybe_flush()
+
+    # 计数器，labels为可选的标签字典
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            if self._histograms:
+                lines.append("# HELP prediction_stage_latency_ms 预测各阶段耗时（毫秒）")
+                lines.append("# TYPE prediction_stage_latency_ms histogram")
+                for stage, hist in sorted(self._histograms.items()):
+                    for upper, count in zip(hist.buckets, hist.counts):
+                        lines.append(f'prediction_stage_latency_ms_bucket{{stage="{stage}",le="{upper}"}} {count}')
+                    lines.append(f'prediction_stage_latency_ms_bucket{{stage="{stage}",le="+Inf"}} {hist.total}')
+                    lines.append(f'prediction_stage_latency_ms_sum{{stage="{stage}"}} {hist.sum:.6f}')
+                    lines.append(f'prediction_stage_latency_ms_count{{stage="{stage}"}} {hist.total}')
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self._gauges}):
+                lines.append(f"# TYPE {name} gauge")
+                for (gauge, labels), value in sorted(self._gauges.items()):
+                    if gauge == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # 先写临时文件再替换，采集方不会读到写了一半的文件。临时文件名每次唯一，多个会话线程同时写出时互不覆盖；
+    # 写文件失败只记录日志，指标导出不能影响预测页面
+    def flush(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._last_flush = time.monotonic()
+        text = self.render_prometheus()
+        directory, name = os.path.split(os.path.abspath(self.path))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("写入指标文件 %s 失败: %s", self.path, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # 在锁内占用本次写出的时机：同一间隔内只有一个线程写文件
+    def maybe_flush(self):
+        if not self.path:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_flush < self.flush_interval:
+                return
+            self._last_flush = now
+        self.flush()
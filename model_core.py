@@ -0,0 +1,180 @@
+import hashlib
+import os
+import threading
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# 模型文件路径，可通过环境变量改为其他模型（如精简后的rf1_reduced.pkl）
+MODEL_PATH = os.environ.get("PREDICTION_MODEL_PATH", 'rf1.pkl')
+
+# 风险分层阈值（死亡概率，百分比）
+LOW_RISK_THRESHOLD = 30
+HIGH_RISK_THRESHOLD = 70
+
+# 特征范围定义
+feature_ranges = {
+    "术中出血量": {"type": "numerical", "min": 0.000, "max": 800.000, "default": 50,
+                                 "description": "手术期间的出血量 (ml)", "unit": "ml"},
+    "CEA": {"type": "numerical", "min": 0, "max": 150.000, "default": 8.68,
+           "description": "癌胚抗原水平", "unit": "ng/ml"},
+    "白蛋白": {"type": "numerical", "min": 1.0, "max": 80.0, "default": 38.60,
+               "description": "血清白蛋白水平", "unit": "g/L"},
+    "TNM分期": {"type": "categorical", "options": [1, 2, 3, 4], "default": 2,
+                 "description": "肿瘤分期", "unit": ""},
+    "年龄": {"type": "numerical", "min": 25, "max": 90, "default": 76,
+           "description": "患者年龄", "unit": "岁"},
+    "术中肿瘤最大直径": {"type": "numerical", "min": 0.2, "max": 20, "default": 4,
+                          "description": "肿瘤最大直径", "unit": "cm"},
+    "淋巴血管侵犯": {"type": "categorical", "options": [0, 1], "default": 1,
+                              "description": "淋巴血管侵犯 (0=否, 1=是)", "unit": ""},
+}
+
+
+# 以模型文件的修改时间和大小作为版本标识，文件变化后相关缓存会自动重建
+def model_file_signature(path=MODEL_PATH):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+# 模型文件内容的哈希前缀，作为对外显示和记录的模型版本号
+def model_file_hash(path=MODEL_PATH, length=12):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:length]
+
+
+# 不依赖Streamlit的模型加载，供命令行工具使用
+def load_model_file(path=MODEL_PATH):
+    return joblib.load(path)
+
+
+# 模型期望的特征顺序；模型没有feature_names_in_属性时使用UI中定义的顺序
+def model_feature_order(model, ranges=feature_ranges):
+    if model is not None and hasattr(model, 'feature_names_in_'):
+        return list(model.feature_names_in_)
+    return list(ranges.keys())
+
+
+# 对比模型要求的特征与UI定义的特征，返回 (模型需要但UI未定义的特征, UI定义但模型不需要的特征)
+def schema_mismatch(feature_order, ranges=feature_ranges):
+    missing = [f for f in feature_order if f not in ranges]
+    unused = [f for f in ranges if f not in feature_order]
+    return missing, unused
+
+
+# 把一列取值转为float数组，无法解析的为NaN。pd.to_numeric把"1e400"等溢出的文本也当作无法解析，
+# 这里改用float()得到inf，以便与真正的缺失值区分
+def numeric_values(series):
+    values = pd.to_numeric(series, errors='coerce').astype(float)
+    unparsed = values.isna() & series.notna()
+    if unparsed.any():
+        values[unparsed] = series[unparsed].map(_parse_float)
+    return values.to_numpy(dtype=float)
+
+
+def _parse_float(value):
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return np.nan
+
+
+# 按feature_ranges逐行检查取值，返回每行的问题描述（空字符串表示通过）
+def validate_features(chunk, feature_order, ranges=feature_ranges):
+    problems = np.full(len(chunk), "", dtype=object)
+    for feature in feature_order:
+        values = numeric_values(chunk[feature])
+        missing = np.isnan(values)
+        # inf（包括1e400等溢出的取值）不能送入模型，与缺失值分开提示
+        infinite = np.isinf(values)
+        properties = ranges.get(feature)
+        if properties is None:
+            invalid = np.zeros(len(chunk), dtype=bool)
+        elif properties["type"] == "numerical":
+            invalid = np.isfinite(values) & ((values < properties["min"]) | (values > properties["max"]))
+        else:
+            invalid = np.isfinite(values) & ~np.isin(values, properties["options"])
+        problems[missing] += f"{feature}缺失;"
+        problems[infinite] += f"{feature}不是有限数值;"
+        problems[invalid] += f"{feature}超出范围;"
+    return problems
+
+
+# 单个死亡概率（百分比）对应的风险类别和显示颜色
+def risk_category(death_probability):
+    if death_probability > HIGH_RISK_THRESHOLD:
+        return "高风险", "red"
+    if death_probability > LOW_RISK_THRESHOLD:
+        return "中等风险", "orange"
+    return "低风险", "green"
+
+
+# 向量化的风险分层，与risk_category使用相同的阈值
+def risk_categories(death_probabilities):
+    death_probabilities = np.asarray(death_probabilities, dtype=float)
+    return np.select(
+        [death_probabilities > HIGH_RISK_THRESHOLD, death_probabilities > LOW_RISK_THRESHOLD],
+        ["高风险", "中等风险"],
+        default="低风险",
+    )
+
+
+# 在feature_ranges范围内生成合成患者：数值特征在min/max间均匀抽取，分类特征在全部选项中均匀抽取
+def synthetic_patients(n_rows, rng=None, ranges=feature_ranges, feature_order=None):
+    rng = np.random.default_rng() if rng is None else rng
+    columns = {}
+    for feature in (feature_order or list(ranges.keys())):
+        properties = ranges[feature]
+        if properties["type"] == "numerical":
+            columns[feature] = rng.uniform(properties["min"], properties["max"], n_rows)
+        else:
+            columns[feature] = rng.choice(properties["options"], n_rows)
+    return pd.DataFrame(columns)
+
+
+# 从shap的Explanation中取出一行死亡类(索引1)的贡献值、基准值和特征取值
+def death_class_explanation(shap_values, row=0):
+    values = np.asarray(shap_values.values[row])
+    base_value = np.asarray(shap_values.base_values[row])
+    if values.ndim > 1:
+        # 多分类输出 - 选择第二个类别(死亡类)
+        values = values[:, 1]
+        base_value = base_value[1]
+    return values, float(base_value), np.asarray(shap_values.data[row])
+
+
+# 由feature_ranges的默认值组成的单个患者，用于预热
+def default_patient(feature_order, ranges=feature_ranges):
+    return pd.DataFrame([{feature: ranges[feature]["default"] for feature in feature_order}])
+
+
+# 可在多个会话之间共享的SHAP解释器
+class CachedExplainer:
+    def __init__(self, model):
+        # shap导入较慢，推迟到第一次构建解释器时
+        import shap
+        # 构建解释器需要遍历整片森林，每个模型只做一次
+        self.explainer = shap.Explainer(model)
+        # 预先计算基准值（期望值），避免每次请求重复计算
+        self.expected_value = np.asarray(self.explainer.expected_value)
+        # shap解释器内部状态不保证线程安全，并发会话通过锁串行调用
+        self._lock = threading.Lock()
+
+    def __call__(self, features_df):
+        with self._lock:
+            return self.explainer(features_df)
+
+
+# 用默认患者走一遍完整的预测和解释流程，让首次真实请求不再承担初始化开销
+def warm_up(engine, explainer, feature_order):
+    features_df = default_patient(feature_order)
+    prediction = engine.predict_detailed(features_df)
+    shap_values = explainer(features_df) if explainer is not None else None
+    return prediction, shap_values
@@ -0,0 +1,288 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from compact_model import compact_path_for, save_compact
+from forest_engine import FlatForest
+from model_core import (HIGH_RISK_THRESHOLD, LOW_RISK_THRESHOLD, MODEL_PATH, feature_ranges, load_model_file,
+                        model_file_hash, synthetic_patients)
+
+# 精度约束的默认值：风险类别一致率、死亡概率平均绝对差（百分点），有真实结局时另加AUC下降和校准误差增加的上限
+DEFAULT_MIN_AGREEMENT = 0.98
+DEFAULT_MAX_MEAN_DIFF = 2.0
+DEFAULT_MAX_AUC_DROP = 0.01
+DEFAULT_MAX_ECE_INCREASE = 0.02
+
+# 没有验证集时使用的合成患者数
+DEFAULT_SYNTHETIC_ROWS = 20000
+
+# 校准误差的分箱数
+CALIBRATION_BINS = 10
+
+# 一个候选精简方案：保留的树（按原模型中的下标）和截断深度
+Reduction = namedtuple('Reduction', ['trees', 'max_depth', 'n_nodes'])
+
+
+# 精简后的模型文件路径，例如 rf1.pkl -> rf1_reduced.pkl
+def reduced_path_for(model_path=MODEL_PATH):
+    root, ext = os.path.splitext(model_path)
+    return f"{root}_reduced{ext}"
+
+
+# 把一棵sklearn决策树截断到max_depth层：该层的内部节点变为叶子，其value本来就是落入该节点样本的类别比例；
+# 节点按广度优先重新编号，截掉的子树不再保留
+def prune_tree(estimator, max_depth):
+    state = estimator.tree_.__getstate__()
+    nodes, values = state["nodes"], state["values"]
+    kept, depths = [0], [0]
+    position = 0
+    while position < len(kept):
+        node, depth = kept[position], depths[position]
+        if nodes["left_child"][node] != -1 and depth < max_depth:
+            kept.extend([nodes["left_child"][node], nodes["right_child"][node]])
+            depths.extend([depth + 1, depth + 1])
+        position += 1
+    new_ids = {node: i for i, node in enumerate(kept)}
+    new_nodes = nodes[kept].copy()
+    for i, (node, depth) in enumerate(zip(kept, depths)):
+        if nodes["left_child"][node] == -1 or depth >= max_depth:
+            new_nodes["left_child"][i] = new_nodes["right_child"][i] = -1
+            new_nodes["feature"][i] = -2
+            new_nodes["threshold"][i] = -2.0
+        else:
+            new_nodes["left_child"][i] = new_ids[nodes["left_child"][node]]
+            new_nodes["right_child"][i] = new_ids[nodes["right_child"][node]]
+    pruned = copy.deepcopy(estimator)
+    pruned.tree_.__setstate__({"max_depth": min(max_depth, state["max_depth"]), "node_count": len(kept),
+                               "nodes": new_nodes, "values": values[kept].copy()})
+    if max_depth < state["max_depth"]:
+        pruned.max_depth = max_depth
+    return pruned
+
+
+# 由原模型构建精简模型：只保留指定的树，并截断到max_depth层（None表示不截断）
+def reduce_forest(model, trees, max_depth=None):
+    reduced = copy.copy(model)
+    estimators = [model.estimators_[t] for t in trees]
+    reduced.estimators_ = [prune_tree(e, max_depth) if max_depth is not None else copy.deepcopy(e)
+                           for e in estimators]
+    reduced.n_estimators = len(reduced.estimators_)
+    if max_depth is not None:
+        reduced.max_depth = max_depth
+    # 多线程预测对几十棵浅树没有收益
+    reduced.n_jobs = None
+    return reduced
+
+
+# 前向贪心选树：每一步加入使子集平均死亡概率与目标（原模型概率）均方误差最小的树，返回树的加入顺序
+def greedy_tree_order(per_tree, target):
+    n_rows, n_trees = per_tree.shape
+    order = []
+    remaining = list(range(n_trees))
+    total = np.zeros(n_rows)
+    for k in range(1, n_trees + 1):
+        candidates = per_tree[:, remaining]
+        errors = (((total[:, None] + candidates) / k - target[:, None]) ** 2).mean(axis=0)
+        best = remaining.pop(int(np.argmin(errors)))
+        order.append(best)
+        total += per_tree[:, best]
+    return order
+
+
+def _categories(death_probability):
+    percent = np.asarray(death_probability) * 100
+    return (percent > LOW_RISK_THRESHOLD).astype(int) + (percent > HIGH_RISK_THRESHOLD)
+
+
+# 期望校准误差：按预测概率分箱，各箱预测均值与实际发生率之差按样本数加权
+def expected_calibration_error(death_probability, labels, bins=CALIBRATION_BINS):
+    bin_ids = np.minimum((np.asarray(death_probability) * bins).astype(int), bins - 1)
+    counts = np.bincount(bin_ids, minlength=bins)
+    predicted = np.bincount(bin_ids, weights=death_probability, minlength=bins)
+    observed = np.bincount(bin_ids, weights=labels, minlength=bins)
+    occupied = counts > 0
+    return float(np.abs(predicted[occupied] - observed[occupied]).sum() / len(labels))
+
+
+# 精简模型相对原模型的一致性；给出真实结局时另计算两者的AUC和校准误差
+def fidelity(reference, candidate, labels=None):
+    from sklearn.metrics import roc_auc_score
+    diff = np.abs(candidate - reference) * 100
+    report = {
+        "category_agreement": float((_categories(reference) == _categories(candidate)).mean()),
+        "mean_abs_diff_pct": float(diff.mean()),
+        "max_abs_diff_pct": float(diff.max()),
+    }
+    reference_class = reference >= 0.5
+    if 0 < reference_class.sum() < len(reference_class):
+        # 以原模型的判定作为标签时精简模型的AUC，衡量排序是否一致
+        report["auc_vs_original"] = float(roc_auc_score(reference_class, candidate))
+    if labels is not None:
+        report.update({
+            "auc_original": float(roc_auc_score(labels, reference)),
+            "auc_reduced": float(roc_auc_score(labels, candidate)),
+            "ece_original": expected_calibration_error(reference, labels),
+            "ece_reduced": expected_calibration_error(candidate, labels),
+        })
+    return report
+
+
+def passes_guard(report, min_agreement=DEFAULT_MIN_AGREEMENT, max_mean_diff=DEFAULT_MAX_MEAN_DIFF,
+                 max_auc_drop=DEFAULT_MAX_AUC_DROP, max_ece_increase=DEFAULT_MAX_ECE_INCREASE):
+    if report["category_agreement"] < min_agreement or report["mean_abs_diff_pct"] > max_mean_diff:
+        return False
+    if "auc_original" in report:
+        if report["auc_original"] - report["auc_reduced"] > max_auc_drop:
+            return False
+        if report["ece_reduced"] - report["ece_original"] > max_ece_increase:
+            return False
+    return True
+
+
+# 在各截断深度上贪心选树，每个深度取满足精度约束的最少树数，最后选总节点数最少的方案。
+# 选树用验证集的一半，约束同时在另一半上检查，避免只对选树用的样本成立
+def search_reduction(model, X, labels=None, seed=0, **guard):
+    rng = np.random.default_rng(seed)
+    rows = rng.permutation(len(X))
+    select_rows, check_rows = rows[:len(rows) // 2], rows[len(rows) // 2:]
+    engine = FlatForest.from_model(model)
+    reference = engine.predict_proba(X)[:, 1]
+    original_depth = max(e.tree_.max_depth for e in model.estimators_)
+    best = None
+    for depth in range(original_depth, 1, -1):
+        pruned = reduce_forest(model, range(len(model.estimators_)), depth if depth < original_depth else None)
+        per_tree = FlatForest.from_model(pruned).tree_predictions(X)[:, :, 1]
+        order = greedy_tree_order(per_tree[select_rows], reference[select_rows])
+        running = np.cumsum(per_tree[:, order], axis=1) / np.arange(1, len(order) + 1)
+        node_counts = np.cumsum([pruned.estimators_[t].tree_.node_count for t in order])
+        for k in range(1, len(order) + 1):
+            if best is not None and node_counts[k - 1] >= best.n_nodes:
+                break
+            ok = all(passes_guard(fidelity(reference[part], running[part, k - 1],
+                                           None if labels is None else labels[part]), **guard)
+                     for part in (select_rows, check_rows))
+            if ok:
+                best = Reduction(sorted(order[:k]), depth if depth < original_depth else None,
+                                 int(node_counts[k - 1]))
+                break
+    return best, reference
+
+
+def _median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+# 原模型与精简模型的预测和SHAP耗时
+def measure_speed(model, reduced, X, shap_rows=200):
+    import shap
+    report = {}
+    for name, forest in (("original", model), ("reduced", reduced)):
+        engine = FlatForest.from_model(forest)
+        explainer = shap.TreeExplainer(forest)
+        report[name] = {
+            "single_row_ms": _median_ms(lambda: engine.predict_proba(X[:1]), 200),
+            "batch_ms": _median_ms(lambda: engine.predict_proba(X), 5),
+            "shap_ms": _median_ms(lambda: explainer.shap_values(X[:shap_rows], check_additivity=False), 3),
+        }
+    return report
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _load_validation(path, label_column, feature_order):
+    from batch_scoring import iter_input_chunks
+    frame = pd.concat(iter_input_chunks(path), ignore_index=True)
+    features = frame[feature_order].apply(pd.to_numeric, errors='coerce')
+    valid = features.notna().all(axis=1)
+    labels = None
+    if label_column:
+        labels = pd.to_numeric(frame[label_column], errors='coerce')
+        valid &= labels.isin([0, 1])
+        labels = labels[valid].to_numpy(dtype=int)
+    return features[valid].to_numpy(dtype=np.float64), labels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="随机森林精简 - 选树并截断深度，在精度约束下减少预测和SHAP耗时")
+    parser.add_argument("--model", default=MODEL_PATH, help="原始模型文件路径")
+    parser.add_argument("--output", help="精简模型文件路径，默认在模型文件名后加_reduced")
+    parser.add_argument("--validation", help="验证集 (CSV 或 Parquet)，默认使用合成患者")
+    parser.add_argument("--label", help="验证集中的结局列 (0/1)，给出时检查AUC和校准")
+    parser.add_argument("--rows", type=int, default=DEFAULT_SYNTHETIC_ROWS, help="没有验证集时的合成患者数")
+    parser.add_argument("--min-agreement", type=float, default=DEFAULT_MIN_AGREEMENT, help="风险类别一致率下限")
+    parser.add_argument("--max-mean-diff", type=float, default=DEFAULT_MAX_MEAN_DIFF,
+                        help="死亡概率平均绝对差上限 (百分点)")
+    parser.add_argument("--max-auc-drop", type=float, default=DEFAULT_MAX_AUC_DROP, help="AUC下降上限")
+    parser.add_argument("--max-ece-increase", type=float, default=DEFAULT_MAX_ECE_INCREASE, help="校准误差增加上限")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    model = load_model_file(args.model)
+    feature_order = list(model.feature_names_in_)
+    if args.validation:
+        X, labels = _load_validation(args.validation, args.label, feature_order)
+        source = f"验证集 {args.validation}（{len(X)} 行）"
+    else:
+        X = synthetic_patients(args.rows, rng=np.random.default_rng(args.seed), ranges=feature_ranges,
+                               feature_order=feature_order).to_numpy(dtype=np.float64)
+        labels = None
+        source = f"{len(X)} 个合成患者（只检查与原模型的一致性）"
+    X = pd.DataFrame(X, columns=feature_order)
+
+    guard = dict(min_agreement=args.min_agreement, max_mean_diff=args.max_mean_diff,
+                 max_auc_drop=args.max_auc_drop, max_ece_increase=args.max_ece_increase)
+    best, reference = search_reduction(model, X.to_numpy(), labels, args.seed, **guard)
+    reduced = reduce_forest(model, best.trees, best.max_depth)
+    candidate = FlatForest.from_model(reduced).predict_proba(X)[:, 1]
+    report = fidelity(reference, candidate, labels)
+    if not passes_guard(report, **guard):
+        print("精简模型未通过精度约束", file=sys.stderr)
+        return 1
+
+    output = args.output or reduced_path_for(args.model)
+    joblib.dump(reduced, output)
+    compact_dir = compact_path_for(output)
+    save_compact(FlatForest.from_model(reduced), compact_dir, model_file_hash(output))
+    original_nodes = sum(e.tree_.node_count for e in model.estimators_)
+    speed = measure_speed(model, reduced, X)
+
+    original_depth = max(e.tree_.max_depth for e in model.estimators_)
+    print(f"数据: {source}")
+    print(f"精简方案: {len(model.estimators_)} -> {len(best.trees)} 棵树，深度 {original_depth} -> "
+          f"{best.max_depth or original_depth}，节点 {original_nodes} -> {best.n_nodes}")
+    print(f"  模型文件: {os.path.getsize(args.model) / 1024:.1f} KB -> {os.path.getsize(output) / 1024:.1f} KB"
+          f"（紧凑格式 {_directory_size(compact_dir) / 1024:.1f} KB）")
+    for key, label in (("single_row_ms", "单行预测"), ("batch_ms", f"{len(X)} 行预测"), ("shap_ms", "200 行SHAP")):
+        before, after = speed["original"][key], speed["reduced"][key]
+        print(f"  {label}: {before:.2f} ms -> {after:.2f} ms ({before / after:.1f}x)")
+    print(f"  风险类别一致率 {report['category_agreement']:.2%}，死亡概率平均差 {report['mean_abs_diff_pct']:.2f} 个百分点"
+          f"（最大 {report['max_abs_diff_pct']:.1f}）")
+    if "auc_original" in report:
+        print(f"  AUC {report['auc_original']:.4f} -> {report['auc_reduced']:.4f}，"
+              f"校准误差 {report['ece_original']:.4f} -> {report['ece_reduced']:.4f}")
+    with open(os.path.splitext(output)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump({"source_model": args.model, "source_hash": model_file_hash(args.model),
+                   "trees": [int(t) for t in best.trees], "max_depth": best.max_depth, "n_nodes": best.n_nodes,
+                   "data": source, "guard": guard, "fidelity": report, "speed": speed},
+                  f, ensure_ascii=False, indent=2)
+    print(f"已写入 {output} 和 {compact_dir}；设置 PREDICTION_MODEL_PATH={output} 即可使用精简模型")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
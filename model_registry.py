@@ -0,0 +1,316 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+import pandas as pd
+
+from forest_engine import FlatForest, stack_forests
+from model_core import MODEL_PATH, feature_ranges, model_file_signature, schema_mismatch
+from predictor import Predictor, check_options, records_frame
+
+# 模型目录：每个模型一个.pkl文件（可附带compact_model.py转换的同名.forest目录），
+# 以及可选的同名schema文件，如 models/hospital_a_2025.pkl 与 models/hospital_a_2025.schema.json
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", "models")
+
+# 同时驻留内存的模型数上限（不含默认模型），超过时淘汰最久未使用的模型
+MODEL_REGISTRY_MAX_RESIDENT = int(os.environ.get("MODEL_REGISTRY_MAX_RESIDENT", "3"))
+
+# 默认模型（MODEL_PATH）在注册表中的名称
+DEFAULT_MODEL_NAME = "default"
+
+# schema文件的后缀
+SCHEMA_SUFFIX = ".schema.json"
+
+logger = logging.getLogger("prediction.registry")
+
+# 注册表中的一个模型；signature为模型文件和schema文件的签名，任一文件变化后已加载的版本失效
+ModelEntry = namedtuple('ModelEntry', ['name', 'label', 'description', 'model_path', 'ranges', 'signature'])
+
+# 多模型对比中一个模型的结果：result与Predictor.results的单个结果相同；error不为None时该模型未参与评分
+ModelScore = namedtuple('ModelScore', ['name', 'label', 'version', 'result', 'error'])
+
+
+# 校验schema文件中的特征定义（与feature_ranges结构相同），补齐可省略的说明和单位
+def check_ranges(ranges):
+    if not isinstance(ranges, dict) or not ranges:
+        raise ValueError("feature_ranges 须为非空的对象")
+    checked = {}
+    for feature, properties in ranges.items():
+        if not isinstance(properties, dict):
+            raise ValueError(f"特征 '{feature}' 的定义须为对象")
+        kind = properties.get("type")
+        if kind not in ("numerical", "categorical"):
+            raise ValueError(f"特征 '{feature}' 的类型须为 numerical 或 categorical")
+        required = ("min", "max", "default") if kind == "numerical" else ("options", "default")
+        missing = [key for key in required if key not in properties]
+        if missing:
+            raise ValueError(f"特征 '{feature}' 缺少 {missing}")
+        if kind == "numerical" and not properties["min"] <= properties["default"] <= properties["max"]:
+            raise ValueError(f"特征 '{feature}' 的默认值不在取值范围内")
+        if kind == "categorical" and properties["default"] not in properties["options"]:
+            raise ValueError(f"特征 '{feature}' 的默认值不在可选值中")
+        checked[feature] = {"description": feature, "unit": "", **properties}
+    return checked
+
+
+# 读取模型的schema文件，返回 (显示名称, 说明, 特征定义)；没有schema文件或其中没有feature_ranges时使用默认定义
+def load_schema(model_path, name):
+    schema_path = os.path.splitext(model_path)[0] + SCHEMA_SUFFIX
+    if not os.path.exists(schema_path):
+        return name, "", feature_ranges
+    with open(schema_path, encoding="utf-8") as f:
+        schema = json.load(f)
+    ranges = check_ranges(schema["feature_ranges"]) if "feature_ranges" in schema else feature_ranges
+    return schema.get("label", name), schema.get("description", ""), ranges
+
+
+# 多模型注册表：扫描模型目录，模型和解释器在第一次使用时加载并预热，驻留内存的模型数有上限，
+# 超过时按LRU淘汰。模型文件或schema文件变化后，下一次使用时重新加载。默认模型可由调用方持有
+# （default为返回当前预测核心的可调用对象，如热更新器的current），此时始终驻留，不计入上限
+class ModelRegistry:
+    def __init__(self, directory=MODEL_REGISTRY_DIR, max_resident=MODEL_REGISTRY_MAX_RESIDENT,
+                 default=None, default_path=MODEL_PATH, warm_up=None):
+        self.directory = directory
+        self.max_resident = max(1, max_resident)
+        self.default_path = default_path
+        self._default = default
+        # 预热函数接收新加载的预测核心；默认构建解释器并跑一次完整预测
+        self._warm_up = warm_up or (lambda predictor: predictor.warm_up())
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        # 目录中无法注册的文件 -> 原因
+        self.errors = {}
+        self._entries = {}
+        self._files_signature = None
+        # 名称 -> (加载时的条目签名, 预测核心)，按最近使用的顺序排列
+        self._resident = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    # 目录中模型文件和schema文件的名称、修改时间和大小；任一文件增删或变化时重新扫描
+    def _files(self):
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith((".pkl", SCHEMA_SUFFIX)))
+        except OSError:
+            return ()
+        return tuple((n, model_file_signature(os.path.join(self.directory, n))) for n in names)
+
+    def _scan(self, files):
+        signatures = dict(files)
+        entries = {DEFAULT_MODEL_NAME: ModelEntry(
+            DEFAULT_MODEL_NAME, f"默认模型（{os.path.basename(self.default_path)}）", "", self.default_path,
+            feature_ranges, None)}
+        errors = {}
+        for file_name, _ in files:
+            if not file_name.endswith(".pkl"):
+                continue
+            name = file_name[:-len(".pkl")]
+            if name == DEFAULT_MODEL_NAME:
+                errors[file_name] = f"名称 {DEFAULT_MODEL_NAME} 为默认模型保留"
+                continue
+            model_path = os.path.join(self.directory, file_name)
+            try:
+                label, description, ranges = load_schema(model_path, name)
+            except (OSError, ValueError, KeyError) as e:
+                errors[file_name] = f"schema文件无效: {e}"
+                continue
+            entries[name] = ModelEntry(name, label, description, model_path, ranges,
+                                       (signatures[file_name], signatures.get(name + SCHEMA_SUFFIX)))
+        for file_name, error in errors.items():
+            if file_name not in self.errors:
+                logger.warning("模型目录中的 %s 未注册: %s", file_name, error)
+        return entries, errors
+
+    # 当前注册的全部模型，名称 -> ModelEntry；默认模型总在最前
+    def entries(self):
+        files = self._files()
+        with self._lock:
+            if files != self._files_signature:
+                self._entries, self.errors = self._scan(files)
+                self._files_signature = files
+            return dict(self._entries)
+
+    # 加载、校验并预热一个模型，失败时直接抛出
+    def _load(self, entry):
+        predictor = Predictor.load(entry.model_path, entry.ranges)
+        missing, _ = schema_mismatch(predictor.feature_order, entry.ranges)
+        if missing:
+            raise ValueError(f"模型 {entry.name} 要求的特征未在其schema中定义: {missing}")
+        self._warm_up(predictor)
+        return predictor
+
+    def _resident_predictor(self, name, signature):
+        item = self._resident.get(name)
+        if item is None or item[0] != signature:
+            return None
+        self._resident.move_to_end(name)
+        self.hits += 1
+        return item[1]
+
+    # 取一个模型的预测核心，未加载时加载并预热；同一模型的并发首次请求只加载一次
+    def get(self, name=DEFAULT_MODEL_NAME):
+        if name == DEFAULT_MODEL_NAME and self._default is not None:
+            return self._default()
+        entry = self.entries().get(name)
+        if entry is None:
+            raise ValueError(f"未知模型: {name}")
+        # 默认模型由注册表加载时以模型文件签名判断是否变化
+        signature = entry.signature or model_file_signature(entry.model_path)
+        with self._lock:
+            predictor = self._resident_predictor(name, signature)
+            if predictor is not None:
+                return predictor
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            with self._lock:
+                predictor = self._resident_predictor(name, signature)
+                if predictor is not None:
+                    return predictor
+            predictor = self._load(entry)
+            with self._lock:
+                self._resident[name] = (signature, predictor)
+                self._resident.move_to_end(name)
+                self.loads += 1
+                while len(self._resident) > self.max_resident:
+                    evicted, _ = self._resident.popitem(last=False)
+                    self.evictions += 1
+                    logger.info("模型 %s 已从内存中淘汰", evicted)
+        logger.info("已加载模型 %s（版本 %s）", name, predictor.version)
+        return predictor
+
+    # 释放全部驻留的模型（默认模型由调用方持有时不受影响），供内存清理使用
+    def clear(self):
+        with self._lock:
+            self._resident.clear()
+
+    # 同一患者在多个模型上的预测。所选模型按驻留上限分组，每组把患者整理为一行（各模型特征的并集）、把各模型的
+    # 森林拼接为一片，一次遍历得到各模型的概率和树间波动；SHAP值仍由各模型的解释器分别计算。
+    # 缺少特征或加载失败的模型单独返回错误，不影响其他模型
+    def compare(self, record, names, explain=False):
+        names = list(dict.fromkeys(names))
+        entries = self.entries()
+        scores = {}
+
+        def failed(name, label, e):
+            error = str(e) if isinstance(e, ValueError) else f"{type(e).__name__}: {e}"
+            scores[name] = ModelScore(name, label, None, None, error)
+
+        def union(group):
+            return list(dict.fromkeys(f for _, _, predictor in group for f in predictor.feature_order))
+
+        for start in range(0, len(names), self.max_resident):
+            group = []
+            for name in names[start:start + self.max_resident]:
+                label = entries[name].label if name in entries else name
+                try:
+                    predictor = self.get(name)
+                    missing = sorted(f for f in predictor.feature_order if f not in record)
+                    if missing:
+                        raise ValueError(f"缺少模型所需的特征: {missing}")
+                    group.append((name, label, predictor))
+                except Exception as e:
+                    failed(name, label, e)
+            try:
+                features_df = records_frame([record], union(group)) if group else None
+            except ValueError:
+                # 有取值缺失或不是数值时逐个模型检查，只有用到这些特征的模型返回错误
+                valid = []
+                for name, label, predictor in group:
+                    try:
+                        predictor.frame([record])
+                        valid.append((name, label, predictor))
+                    except ValueError as e:
+                        failed(name, label, e)
+                group = valid
+                features_df = records_frame([record], union(group)) if group else None
+            # 分类特征的可选项按各模型自己的定义检查
+            valid = []
+            for name, label, predictor in group:
+                try:
+                    check_options(features_df[predictor.feature_order], predictor.input_ranges)
+                    valid.append((name, label, predictor))
+                except ValueError as e:
+                    failed(name, label, e)
+            group = valid
+            if not group:
+                continue
+            stacked, tree_ranges = stack_forests([predictor.engine for _, _, predictor in group],
+                                                 [predictor.feature_order for _, _, predictor in group])
+            per_tree = stacked.tree_predictions(features_df)
+            for (name, label, predictor), (first, last) in zip(group, tree_ranges):
+                model_df = features_df[predictor.feature_order]
+                prediction = FlatForest.summarize(per_tree[:, first:last], predictor.engine.classes_)
+                shap_values = predictor.explain(model_df) if explain else None
+                result = predictor.results(model_df, prediction, shap_values)[0]
+                scores[name] = ModelScore(name, label, predictor.version, result, None)
+        return [scores[name] for name in names]
+
+    # 可JSON序列化的模型列表，供HTTP接口和命令行使用
+    def describe(self):
+        entries = self.entries()
+        with self._lock:
+            resident = set(self._resident)
+        return [{
+            "name": entry.name,
+            "label": entry.label,
+            "description": entry.description,
+            "model_path": entry.model_path,
+            "features": list(entry.ranges),
+            "resident": entry.name in resident or (entry.name == DEFAULT_MODEL_NAME and self._default is not None),
+        } for entry in entries.values()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": len(self._entries),
+                "resident": list(self._resident),
+                "max_resident": self.max_resident,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "errors": dict(self.errors),
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多模型注册表 - 列出模型目录中的模型，或用多个模型为同一患者评分")
+    parser.add_argument("--dir", default=MODEL_REGISTRY_DIR, help="模型目录")
+    parser.add_argument("--compare", nargs="*", metavar="MODEL",
+                        help="用这些模型为同一患者评分，不给模型名时使用全部模型")
+    parser.add_argument("--patient", help="患者特征 (JSON文件或JSON字符串)，默认使用各特征的默认值")
+    parser.add_argument("--explain", action="store_true", help="同时输出各模型的SHAP贡献值")
+    parser.add_argument("--max-resident", type=int, default=MODEL_REGISTRY_MAX_RESIDENT)
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.dir, args.max_resident)
+    entries = registry.entries()
+    if args.compare is None:
+        for entry in entries.values():
+            print(f"{entry.name:<24}{entry.label}  ({entry.model_path}，{len(entry.ranges)} 个特征)")
+        return 0
+
+    names = args.compare or list(entries)
+    if args.patient:
+        source = args.patient
+        if os.path.exists(source):
+            with open(source, encoding="utf-8") as f:
+                source = f.read()
+        record = json.loads(source)
+    else:
+        record = {}
+        for name in names:
+            if name in entries:
+                for feature, properties in entries[name].ranges.items():
+                    record.setdefault(feature, properties["default"])
+    scores = registry.compare(record, names, args.explain)
+    print(json.dumps([score._asdict() for score in scores], ensure_ascii=False, indent=2))
+    return 0 if all(score.error is None for score in scores) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
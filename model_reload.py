@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+
+from model_core import MODEL_PATH, feature_ranges, model_file_hash, model_file_signature, schema_mismatch
+from predictor import Predictor
+
+# 检查模型文件是否变化的轮询间隔（秒）
+DEFAULT_POLL_INTERVAL = 2.0
+
+logger = logging.getLogger("prediction.reload")
+
+
+# 模型热更新：后台轮询模型文件，新版本加载、校验并预热完成后整体替换当前的预测核心。
+# 调用方在每次请求开始时取一次current并在整个请求中使用该引用，替换发生时进行中的请求仍在旧版本上完成。
+class ModelReloader:
+    def __init__(self, model_path=MODEL_PATH, ranges=feature_ranges, warm_up=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, on_swap=None):
+        self.model_path = model_path
+        self.ranges = ranges
+        self.poll_interval = poll_interval
+        self.on_swap = on_swap
+        # 预热函数接收候选的预测核心；默认构建解释器并跑一次完整预测
+        self._warm_up = warm_up or (lambda predictor: predictor.warm_up())
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # 首次加载失败直接抛出，由调用方处理
+        self._current = self._load_candidate()
+        self._signature = self._current.signature
+        self._pending_signature = None
+        self._failed_signature = None
+        self.loaded_at = time.time()
+        self.reloads = 0
+        self.last_error = None
+
+    # 当前生效的预测核心；替换只是一次引用赋值，读取方不会看到半加载的状态
+    @property
+    def current(self):
+        return self._current
+
+    # 加载、校验并预热一个候选版本，任一步失败都不影响当前版本
+    def _load_candidate(self):
+        candidate = Predictor.load(self.model_path, self.ranges)
+        missing, _ = schema_mismatch(candidate.feature_order, self.ranges)
+        if missing:
+            raise ValueError(f"模型要求的特征未在feature_ranges中定义: {missing}")
+        self._warm_up(candidate)
+        return candidate
+
+    # 一次轮询：模型文件签名变化且在两次轮询之间保持不变（写入已完成）时才加载新版本
+    def check(self):
+        signature = model_file_signature(self.model_path)
+        if signature is None or signature in (self._signature, self._failed_signature):
+            self._pending_signature = None
+            return False
+        if signature != self._pending_signature:
+            # 文件刚发生变化，可能仍在写入，等下一次轮询确认
+            self._pending_signature = signature
+            return False
+        self._pending_signature = None
+        return self.reload(signature)
+
+    def reload(self, signature=None):
+        with self._reload_lock:
+            signature = signature or model_file_signature(self.model_path)
+            try:
+                # 只是被touch、内容未变时不必重新加载
+                if model_file_hash(self.model_path) == self._current.version:
+                    self._signature = signature
+                    self._failed_signature = None
+                    self.last_error = None
+                    return False
+                candidate = self._load_candidate()
+            except Exception as e:
+                # 同一个有问题的文件不反复尝试，直到它再次变化
+                self._failed_signature = signature
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning("模型热更新失败，继续使用版本 %s: %s", self._current.version, self.last_error)
+                return False
+            previous = self._current
+            self._current = candidate
+            self._signature = signature
+            self._failed_signature = None
+            self.loaded_at = time.time()
+            self.reloads += 1
+            self.last_error = None
+        logger.info("模型已从版本 %s 切换到 %s", previous.version, candidate.version)
+        if self.on_swap is not None:
+            self.on_swap(candidate, previous)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("检查模型文件时出错")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="model-reloader", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self):
+        return {
+            "model_version": self._current.version,
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at)),
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
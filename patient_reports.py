@@ -0,0 +1,422 @@
+import argparse
+import html
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from string import Template
+
+import numpy as np
+import pandas as pd
+
+from batch_scoring import check_columns, iter_input_chunks
+from charts import DECREASING_COLOR, INCREASING_COLOR, waterfall_rows
+from model_core import (HIGH_RISK_THRESHOLD, LOW_RISK_THRESHOLD, MODEL_PATH, death_class_explanation,
+                        feature_ranges, risk_category, validate_features)
+
+warnings.filterwarnings('ignore')
+
+REPORT_FORMATS = ("html", "pdf")
+
+# A4纸张尺寸（英寸）
+PAGE_SIZE = (8.27, 11.69)
+
+# 瀑布图最多显示的行数，与应用中的瀑布图一致
+MAX_DISPLAY = 7
+
+# 每个任务交给工作进程的报告数
+DEFAULT_CHUNK_REPORTS = 16
+
+# 每个工作进程至少分到的报告数；启动进程并初始化字体和页面模板约需1秒，报告较少时在当前进程中绘制更快
+MIN_REPORTS_PER_WORKER = 50
+
+# 与应用页脚相同的免责声明
+DISCLAIMER = "免责声明：本预测工具仅供临床医生参考，不能替代专业医疗判断。预测结果应结合患者的完整临床情况进行综合评估。"
+
+# 风险类别的显示颜色与仪表盘分段颜色一致
+GAUGE_COLORS = {"green": "#2e9e4f", "orange": "#f0a020", "red": "#d62728"}
+
+# 一位患者的报告内容，在主进程中批量预测和解释后交给工作进程绘制
+PatientReport = namedtuple('PatientReport', [
+    'patient_id', 'feature_values', 'death_risk_percent', 'tree_low_percent', 'tree_high_percent',
+    'shap_values', 'base_value',
+])
+
+# 一次批量生成的结果：reports为 (患者编号, 文件路径列表)
+ReportRun = namedtuple('ReportRun', ['reports', 'elapsed_s', 'reports_per_second', 'workers', 'mean_render_ms'])
+
+# HTML报告：整页图表以SVG内嵌，文字保留为文本，可直接在浏览器中打印为A4
+_HTML_PAGE = Template("""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+  @page { size: A4; margin: 0; }
+  body { margin: 0; background: #f0f2f6; font-family: 'Microsoft YaHei', sans-serif; }
+  .page { width: 210mm; margin: 0 auto; background: white; }
+  .page svg { width: 100%; height: auto; display: block; }
+  @media print { body { background: white; } }
+</style>
+</head>
+<body><div class="page">
+$svg
+</div></body>
+</html>
+""")
+
+_HTML_INDEX = Template("""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>患者预测报告</title>
+<style>
+  body { font-family: 'Microsoft YaHei', sans-serif; margin: 2rem; }
+  table { border-collapse: collapse; }
+  th, td { border: 1px solid #d0d4dc; padding: 4px 10px; text-align: left; }
+  th { background: #f0f2f6; }
+</style>
+</head>
+<body>
+<h2>患者预测报告（$count 份）</h2>
+<p>模型版本 $model_version ｜ 生成时间 $generated_at</p>
+<table>
+<tr><th>患者编号</th><th>三年死亡风险</th><th>风险类别</th><th>报告</th></tr>
+$rows
+</table>
+</body>
+</html>
+""")
+
+
+# 整理上传的队列并批量预测和解释：去掉有缺失或超出范围取值的行，返回 (报告内容列表, 去掉的行数)。
+# 已评分的文件（batch_scoring.py的输出）同样适用，概率由当前模型重新计算，与瀑布图保持一致
+def prepare_reports(frame, predictor, id_column=None):
+    check_columns(frame.columns, predictor.feature_order)
+    if id_column is not None and id_column not in frame.columns:
+        raise ValueError(f"输入文件中没有患者编号列: {id_column}")
+    features = frame[predictor.feature_order].apply(pd.to_numeric, errors='coerce')
+    valid = validate_features(features, predictor.feature_order, predictor.ranges) == ""
+    if id_column is not None:
+        patient_ids = frame[id_column].astype(str).to_numpy()
+        duplicated = sorted(set(patient_ids[valid][pd.Series(patient_ids[valid]).duplicated().to_numpy()]))
+        if duplicated:
+            raise ValueError(f"患者编号重复: {duplicated[:5]}")
+        # 不同编号去掉文件名中不允许的字符后可能相同（如 A/1 与 A_1），后写的报告会覆盖先写的；
+        # 按小写比较，不区分大小写的文件系统上同样不会冲突
+        stems = {}
+        for patient_id in patient_ids[valid]:
+            stems.setdefault(report_file_stem(patient_id).lower(), []).append(patient_id)
+        collisions = [ids for ids in stems.values() if len(ids) > 1]
+        if collisions:
+            raise ValueError("以下患者编号转换为文件名后相同，请先修改编号: "
+                             + "；".join("、".join(ids) for ids in collisions[:5]))
+    else:
+        patient_ids = np.array([f"{row + 1:05d}" for row in range(len(frame))])
+    features = features[valid].astype(float).reset_index(drop=True)
+    patient_ids = patient_ids[valid]
+    if not len(features):
+        return [], int((~valid).sum())
+
+    prediction = predictor.predict(features)
+    explanation = predictor.explain(features)
+    reports = []
+    for row in range(len(features)):
+        shap_values, base_value, _ = death_class_explanation(explanation, row)
+        reports.append(PatientReport(patient_ids[row], features.iloc[row].to_numpy(),
+                                     float(prediction.proba[row, 1] * 100),
+                                     float(prediction.tree_low[row] * 100), float(prediction.tree_high[row] * 100),
+                                     np.asarray(shap_values, dtype=float), base_value))
+    return reports, int((~valid).sum())
+
+
+# 单页报告的绘制上下文：字体、页面布局、仪表盘分段、表格标签和瀑布图的条形在构建时只创建一次，
+# 每份报告只更新随患者变化的文字、指针和条形位置后保存，不再重复创建图表和查找字体
+class ReportRenderer:
+    def __init__(self, feature_order, ranges=feature_ranges, model_version="", generated_at=None,
+                 max_display=MAX_DISPLAY):
+        from matplotlib.figure import Figure
+        from matplotlib.lines import Line2D
+        from matplotlib.patches import Wedge
+
+        from fonts import chinese_font
+
+        self.feature_order = list(feature_order)
+        self.ranges = ranges
+        self.max_display = max_display
+        self.font = chinese_font()
+        self.figure = Figure(figsize=PAGE_SIZE, facecolor="white")
+        generated_at = generated_at or time.strftime("%Y-%m-%d %H:%M")
+        self._header = f"模型版本：{model_version}　　生成时间：{generated_at}"
+
+        # 标题
+        self._text(0.5, 0.955, "胃癌术后三年生存预测报告", 18, ha="center", weight="bold")
+        self._subtitle = self._text(0.5, 0.928, "", 9, ha="center", color="#4b5563")
+        self._rule(0.912)
+
+        # 死亡风险仪表盘：左半为0%，右半为100%，按风险分层阈值分段着色
+        self._text(0.06, 0.885, "三年死亡风险", 12, weight="bold")
+        gauge = self.figure.add_axes([0.06, 0.665, 0.40, 0.21])
+        gauge.set_xlim(-1.2, 1.2)
+        gauge.set_ylim(-0.45, 1.2)
+        gauge.set_aspect("equal")
+        gauge.axis("off")
+        for low, high, color in ((0, LOW_RISK_THRESHOLD, "green"), (LOW_RISK_THRESHOLD, HIGH_RISK_THRESHOLD, "orange"),
+                                 (HIGH_RISK_THRESHOLD, 100, "red")):
+            gauge.add_patch(Wedge((0, 0), 1.0, self._angle(high), self._angle(low), width=0.28,
+                                  facecolor=GAUGE_COLORS[color], edgecolor="white"))
+        for tick in (0, LOW_RISK_THRESHOLD, HIGH_RISK_THRESHOLD, 100):
+            radians = np.radians(self._angle(tick))
+            gauge.text(1.12 * np.cos(radians), 1.12 * np.sin(radians), f"{tick}", ha="center", va="center",
+                       fontproperties=self.font, size=8, color="#4b5563")
+        self._needle = gauge.add_line(Line2D([0, 0], [0, 0.8], color="#1f2a44", linewidth=3,
+                                             solid_capstyle="round"))
+        gauge.add_patch(Wedge((0, 0), 0.07, 0, 360, facecolor="#1f2a44"))
+        self._gauge_value = gauge.text(0, -0.28, "", ha="center", va="center", fontproperties=self.font,
+                                       size=18, weight="bold")
+
+        # 概率与风险类别
+        self._values = {}
+        for i, label in enumerate(("三年死亡风险", "三年生存概率", "风险类别", "各树预测范围 (P10–P90)")):
+            y = 0.835 - i * 0.045
+            self._text(0.54, y, label, 10, color="#4b5563")
+            self._values[label] = self._text(0.94, y, "", 12, ha="right", weight="bold")
+
+        # 患者临床特征
+        self._rule(0.648)
+        self._text(0.06, 0.622, "患者临床特征", 12, weight="bold")
+        self._inputs = []
+        for i, feature in enumerate(self.feature_order):
+            y = 0.592 - i * 0.024
+            description = ranges.get(feature, {}).get("description", "")
+            self._text(0.08, y, feature, 10)
+            self._text(0.32, y, description, 9, color="#6b7280")
+            self._inputs.append(self._text(0.94, y, "", 10, ha="right"))
+
+        # 瀑布图：条形数固定，每份报告只移动条形、改颜色和标签
+        top = 0.592 - len(self.feature_order) * 0.024
+        self._rule(top)
+        self._text(0.06, top - 0.026, "特征对预测的影响（SHAP）", 12, weight="bold")
+        self._waterfall = self.figure.add_axes([0.34, 0.13, 0.58, top - 0.19])
+        n_rows = min(self.max_display, len(self.feature_order))
+        self._bars = self._waterfall.barh(np.arange(n_rows), np.zeros(n_rows), height=0.6)
+        self._bar_labels = [self._waterfall.text(0, y, "", va="center", fontproperties=self.font, size=8)
+                            for y in range(n_rows)]
+        self._base_line = self._waterfall.axvline(0, color="#6b7280", linewidth=1, linestyle="--")
+        self._prediction_line = self._waterfall.axvline(0, color="#111827", linewidth=1)
+        self._waterfall.set_ylim(-0.6, n_rows - 0.4)
+        self._waterfall.spines[["top", "right"]].set_visible(False)
+        self._waterfall.grid(axis="x", color="#e5e7eb", linewidth=0.6)
+        self._waterfall.set_axisbelow(True)
+        self._waterfall.tick_params(axis="x", labelsize=8)
+        self._text(0.06, 0.085, "红色条表示该特征增加死亡风险，蓝色条表示该特征降低死亡风险；数值为对死亡概率的贡献。",
+                   8, color="#4b5563")
+
+        self._rule(0.065)
+        self._text(0.06, 0.045, DISCLAIMER, 8, color="#6b7280")
+
+    def _text(self, x, y, text, size, **kwargs):
+        return self.figure.text(x, y, text, fontproperties=self.font, size=size, **kwargs)
+
+    def _rule(self, y):
+        from matplotlib.lines import Line2D
+        self.figure.add_artist(Line2D([0.06, 0.94], [y, y], color="#d0d4dc", linewidth=0.8))
+
+    # 仪表盘上死亡概率（百分比）对应的角度：0%在左侧180°，100%在右侧0°
+    @staticmethod
+    def _angle(percent):
+        return 180 - 1.8 * percent
+
+    # 把一位患者的内容填入页面模板
+    def fill(self, report):
+        death = report.death_risk_percent
+        label, color = risk_category(death)
+        self._subtitle.set_text(f"患者编号：{report.patient_id}　　{self._header}")
+
+        radians = np.radians(self._angle(death))
+        self._needle.set_data([0, 0.8 * np.cos(radians)], [0, 0.8 * np.sin(radians)])
+        self._gauge_value.set_text(f"{death:.1f}%")
+        self._values["三年死亡风险"].set_text(f"{death:.1f}%")
+        self._values["三年生存概率"].set_text(f"{100 - death:.1f}%")
+        self._values["风险类别"].set_text(label)
+        self._values["风险类别"].set_color(GAUGE_COLORS[color])
+        self._values["各树预测范围 (P10–P90)"].set_text(
+            f"{report.tree_low_percent:.1f}% – {report.tree_high_percent:.1f}%")
+
+        for text, feature, value in zip(self._inputs, self.feature_order, report.feature_values):
+            unit = self.ranges.get(feature, {}).get("unit", "")
+            text.set_text(f"{value:g} {unit}".strip())
+
+        # 瀑布从底部的基准值开始累加，贡献最大的特征在最上方
+        labels, contributions = waterfall_rows(report.shap_values, self.feature_order, report.feature_values,
+                                               self.max_display)
+        left = report.base_value
+        ends = [left]
+        for y, (bar, text, contribution) in enumerate(zip(self._bars, self._bar_labels, contributions)):
+            bar_color = INCREASING_COLOR if contribution > 0 else DECREASING_COLOR
+            bar.set_x(left)
+            bar.set_width(contribution)
+            bar.set_facecolor(bar_color)
+            end = left + contribution
+            text.set_text(f"{contribution:+.3f}")
+            text.set_color(bar_color)
+            text.set_position((end, y))
+            text.set_horizontalalignment("left" if contribution > 0 else "right")
+            left = end
+            ends.append(end)
+        prediction = report.base_value + float(np.sum(report.shap_values))
+        low, high = min(ends), max(ends)
+        padding = max(high - low, 0.05) * 0.2
+        self._waterfall.set_xlim(low - padding, high + padding)
+        self._waterfall.set_yticks(np.arange(len(labels)), labels, fontproperties=self.font, size=9)
+        self._base_line.set_xdata([report.base_value] * 2)
+        self._prediction_line.set_xdata([prediction] * 2)
+        self._waterfall.set_xlabel(f"E[f(X)] = {report.base_value:.3f}  →  f(x) = {prediction:.3f}",
+                                   fontproperties=self.font, size=9)
+
+    # 绘制一份报告，返回 格式 -> 文件内容(bytes)
+    def render(self, report, formats=REPORT_FORMATS):
+        import matplotlib
+
+        self.fill(report)
+        outputs = {}
+        title = f"预测报告 - {report.patient_id}"
+        for file_format in formats:
+            buffer = io.BytesIO()
+            if file_format == "pdf":
+                self.figure.savefig(buffer, format="pdf", metadata={"Title": title})
+                outputs[file_format] = buffer.getvalue()
+            else:
+                # 文字以文本形式写入SVG，体积小且可选中、可搜索
+                with matplotlib.rc_context({"svg.fonttype": "none"}):
+                    self.figure.savefig(buffer, format="svg")
+                svg = buffer.getvalue().decode("utf-8")
+                svg = svg[svg.index("<svg"):]
+                outputs[file_format] = _HTML_PAGE.substitute(title=html.escape(title), svg=svg).encode("utf-8")
+        return outputs
+
+
+# 患者编号转为可用作文件名的字符串
+def report_file_stem(patient_id):
+    return re.sub(r"[^\w\-.]", "_", str(patient_id)).strip(".") or "_"
+
+
+# 绘制并写出一份报告，返回写出的文件路径
+def write_report(renderer, report, output_dir, formats=REPORT_FORMATS):
+    paths = []
+    for file_format, content in renderer.render(report, formats).items():
+        path = os.path.join(output_dir, f"{report_file_stem(report.patient_id)}.{file_format}")
+        with open(path, "wb") as f:
+            f.write(content)
+        paths.append(path)
+    return paths
+
+
+# 工作进程中的绘制上下文和输出设置，由_init_worker在进程启动时构建一次
+_worker_state = None
+
+
+def _init_worker(feature_order, ranges, model_version, generated_at, output_dir, formats):
+    global _worker_state
+    _worker_state = (ReportRenderer(feature_order, ranges, model_version, generated_at), output_dir, formats)
+
+
+# 在工作进程中生成一组报告，返回 [(患者编号, 文件路径列表, 绘制耗时ms)]
+def _render_chunk(reports):
+    renderer, output_dir, formats = _worker_state
+    results = []
+    for report in reports:
+        start = time.perf_counter()
+        paths = write_report(renderer, report, output_dir, formats)
+        results.append((report.patient_id, paths, (time.perf_counter() - start) * 1000))
+    return results
+
+
+def _write_index(reports, results, output_dir, model_version, generated_at):
+    paths = dict(results)
+    rows = []
+    for report in reports:
+        label, color = risk_category(report.death_risk_percent)
+        links = " ".join(f'<a href="{html.escape(os.path.basename(p))}">{os.path.splitext(p)[1][1:].upper()}</a>'
+                         for p in paths[report.patient_id])
+        rows.append(f'<tr><td>{html.escape(str(report.patient_id))}</td><td>{report.death_risk_percent:.1f}%</td>'
+                    f'<td style="color:{GAUGE_COLORS[color]}">{label}</td><td>{links}</td></tr>')
+    with open(os.path.join(output_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(_HTML_INDEX.substitute(count=len(reports), model_version=html.escape(model_version),
+                                       generated_at=generated_at, rows="\n".join(rows)))
+
+
+# 批量生成报告：把报告分组交给进程池，每个工作进程只初始化一次字体和页面模板；
+# 只有一个工作进程时直接在当前进程中绘制。另写出汇总所有报告的index.html
+def generate_reports(reports, output_dir, feature_order, ranges=feature_ranges, model_version="",
+                     formats=REPORT_FORMATS, workers=None, chunk_reports=DEFAULT_CHUNK_REPORTS, progress=None):
+    start = time.perf_counter()
+    workers = workers or min(os.cpu_count() or 1, max(1, len(reports) // MIN_REPORTS_PER_WORKER))
+    generated_at = time.strftime("%Y-%m-%d %H:%M")
+    os.makedirs(output_dir, exist_ok=True)
+    # 分组数至少是工作进程数的几倍，各进程的负载更均衡
+    chunk_reports = max(1, min(chunk_reports, -(-len(reports) // (workers * 4))))
+    chunks = [reports[i:i + chunk_reports] for i in range(0, len(reports), chunk_reports)]
+    results, render_ms = [], []
+
+    def collect(chunk_results):
+        for patient_id, paths, elapsed_ms in chunk_results:
+            results.append((patient_id, paths))
+            render_ms.append(elapsed_ms)
+        if progress is not None:
+            progress(len(results), len(reports))
+
+    initargs = (feature_order, ranges, model_version, generated_at, output_dir, formats)
+    if workers == 1:
+        _init_worker(*initargs)
+        for chunk in chunks:
+            collect(_render_chunk(chunk))
+    else:
+        # 使用spawn启动工作进程，避免在Streamlit等多线程进程中fork
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=initargs) as executor:
+            for future in as_completed([executor.submit(_render_chunk, chunk) for chunk in chunks]):
+                collect(future.result())
+    _write_index(reports, results, output_dir, model_version, generated_at)
+    elapsed = time.perf_counter() - start
+    return ReportRun(results, elapsed, len(results) / elapsed if elapsed > 0 else 0.0, workers,
+                     float(np.mean(render_ms)) if render_ms else 0.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量患者报告 - 为队列中每位患者生成可打印的HTML/PDF预测报告")
+    parser.add_argument("input", help="患者特征文件或batch_scoring.py的评分结果 (CSV 或 Parquet)")
+    parser.add_argument("--output-dir", default="reports", help="报告输出目录")
+    parser.add_argument("--format", nargs="+", choices=REPORT_FORMATS, default=list(REPORT_FORMATS),
+                        help="报告格式")
+    parser.add_argument("--id-column", default=None, help="患者编号列，默认按行号编号")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="工作进程数，默认按报告数决定，最多等于CPU核数")
+    args = parser.parse_args(argv)
+
+    from predictor import Predictor
+    predictor = Predictor.load(args.model)
+    frame = pd.concat(iter_input_chunks(args.input), ignore_index=True)
+    try:
+        reports, dropped = prepare_reports(frame, predictor, args.id_column)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    run = generate_reports(reports, args.output_dir, predictor.feature_order, predictor.ranges, predictor.version,
+                           tuple(args.format), args.workers,
+                           progress=lambda done, total: print(f"\r已生成 {done}/{total} 份", end="", file=sys.stderr))
+    print(file=sys.stderr)
+    print(f"{len(run.reports)} 份报告（去掉 {dropped} 行缺失或超出范围）-> {args.output_dir}/")
+    print(f"耗时 {run.elapsed_s:.2f} s，{run.reports_per_second:.1f} 份/秒；"
+          f"{run.workers} 个进程，单份平均绘制 {run.mean_render_ms:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from compact_model import find_compact, load_compact
+from forest_engine import FlatForest
+from model_core import (MODEL_PATH, CachedExplainer, death_class_explanation, feature_ranges,
+                        load_model_file, model_feature_order, model_file_hash,
+                        model_file_signature, risk_category, schema_mismatch, validate_features, warm_up)
+from tree_shap import FastTreeExplainer
+
+
+# 把患者记录（特征名 -> 取值的字典列表）按feature_order整理成数值DataFrame，缺少特征、取值不是有限数值，
+# 或给出ranges时分类特征取值不在可选项内，都抛出ValueError
+def records_frame(records, feature_order, ranges=None):
+    records = list(records)
+    missing = sorted({f for record in records for f in feature_order if f not in record})
+    if missing:
+        raise ValueError(f"缺少模型所需的特征: {missing}")
+    features_df = pd.DataFrame([{f: record[f] for f in feature_order} for record in records],
+                               columns=feature_order)
+    numeric = features_df.apply(pd.to_numeric, errors='coerce').astype(float)
+    # JSON中的1e400等解析为inf，与NaN一样不能送入模型
+    invalid = sorted(f for f in feature_order if not np.isfinite(numeric[f]).all())
+    if invalid:
+        raise ValueError(f"特征取值缺失或不是有限数值: {invalid}")
+    if ranges is not None:
+        check_options(numeric, ranges)
+    return numeric
+
+
+# 分类特征（如TNM分期）的取值必须是定义中的可选项之一，否则抛出ValueError；数值特征超出范围只作为警告
+def check_options(features_df, ranges):
+    invalid = [f"{feature}={value:g}" for feature, properties in ranges.items()
+               if properties["type"] != "numerical" and feature in features_df.columns
+               for value in features_df[feature].unique() if value not in properties["options"]]
+    if invalid:
+        raise ValueError(f"分类特征取值不在可选范围内: {invalid}")
+
+
+# 不依赖Streamlit的预测核心：模型、展平推理引擎和SHAP解释器，供Streamlit应用、HTTP接口和命令行工具共用
+class Predictor:
+    def __init__(self, model=None, model_path=MODEL_PATH, ranges=feature_ranges, engine=None, version=None):
+        self._model = model
+        self.model_path = model_path
+        # 优先使用传入的推理引擎（如内存映射的紧凑格式），否则由sklearn模型展平得到
+        self.engine = engine if engine is not None else FlatForest.from_model(model)
+        self.feature_order = model_feature_order(self.engine, ranges)
+        self.ranges = ranges
+        # 模型特征与UI定义的对照只在加载时计算一次：按模型顺序排列的输入定义，以及两边不一致的特征
+        self.input_ranges = {f: ranges[f] for f in self.feature_order if f in ranges}
+        self.missing_features, self.unused_features = schema_mismatch(self.feature_order, ranges)
+        self.signature = model_file_signature(model_path)
+        self.version = version or model_file_hash(model_path)
+        self._explainer = None
+        self._lock = threading.Lock()
+
+    # 存在与模型文件匹配的紧凑格式时直接内存映射加载，sklearn模型推迟到需要时再反序列化
+    @classmethod
+    def load(cls, model_path=MODEL_PATH, ranges=feature_ranges, use_compact=True):
+        version = model_file_hash(model_path)
+        compact_path = find_compact(model_path, version) if use_compact else None
+        if compact_path is not None:
+            return cls(None, model_path, ranges, engine=load_compact(compact_path), version=version)
+        return cls(load_model_file(model_path), model_path, ranges, version=version)
+
+    # sklearn模型只在SHAP解释或批量评分需要时才加载
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = load_model_file(self.model_path)
+        return self._model
+
+    # 解释器在第一次需要时构建，之后一直复用。推理引擎带有节点样本权重时使用展平森林上的向量化TreeSHAP，
+    # 不必反序列化sklearn模型、也不必导入shap；旧版紧凑格式没有该数据时退回shap解释器
+    @property
+    def explainer(self):
+        if self._explainer is None:
+            explainer = self._fast_explainer()
+            model = self.model if explainer is None else None
+            with self._lock:
+                if self._explainer is None:
+                    self._explainer = explainer or CachedExplainer(model)
+        return self._explainer
+
+    def _fast_explainer(self):
+        if getattr(self.engine, 'cover', None) is None:
+            return None
+        try:
+            return FastTreeExplainer(self.engine)
+        except (ValueError, MemoryError):
+            return None
+
+    def warm_up(self):
+        return warm_up(self.engine, self.explainer, self.feature_order)
+
+    # 把患者记录（特征名 -> 取值的字典列表）整理成模型顺序的DataFrame
+    def frame(self, records):
+        return records_frame(records, self.feature_order, self.input_ranges)
+
+    # 一次森林遍历得到类别、概率和树间波动
+    def predict(self, features_df):
+        return self.engine.predict_detailed(features_df)
+
+    # 提前停止的快速预测：默认只用确定性界（z=None），风险类别与全森林严格一致，提前停止的行概率为估计值；
+    # 传入z启用置信区间可以更早停止，但类别只在统计意义上一致
+    def predict_fast(self, features_df, z=None, **options):
+        return self.engine.predict_anytime(features_df, z=z, **options)
+
+    def explain(self, features_df):
+        return self.explainer(features_df)
+
+    # 把预测结果整理成可JSON序列化的字典，概率均为百分比
+    def results(self, features_df, prediction, shap_values=None):
+        problems = validate_features(features_df, self.feature_order, self.ranges)
+        results = []
+        for row in range(len(features_df)):
+            death_probability = float(prediction.proba[row, 1] * 100)
+            label, _ = risk_category(death_probability)
+            result = {
+                "death_risk_percent": death_probability,
+                "survival_percent": 100 - death_probability,
+                "risk_category": label,
+                "predicted_class": prediction.predicted_class[row].item(),
+                "tree_spread": {
+                    "p10_percent": float(prediction.tree_low[row] * 100),
+                    "p90_percent": float(prediction.tree_high[row] * 100),
+                    "std_percent": float(prediction.tree_std[row] * 100),
+                    "death_votes": float(prediction.death_votes[row]),
+                },
+                "warnings": [p for p in problems[row].split(";") if p],
+                "model_version": self.version,
+            }
+            if shap_values is not None:
+                contributions, base_value, _ = death_class_explanation(shap_values, row)
+                result["explanation"] = {
+                    "base_value": base_value,
+                    "contributions": {f: float(v) for f, v in zip(self.feature_order, contributions)},
+                }
+            results.append(result)
+        return results
+
+    def predict_records(self, records, explain=False):
+        features_df = self.frame(records)
+        prediction = self.predict(features_df)
+        shap_values = self.explain(features_df) if explain else None
+        return self.results(features_df, prediction, shap_values)
@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+
+from model_core import feature_ranges
+
+# 缓存的最大条目数
+DEFAULT_MAX_ENTRIES = 2048
+
+# 数值特征的量化精度（小数位数），与滑块0.1的步长一致
+NUMERICAL_DECIMALS = 1
+
+
+# 按feature_input_order把输入规范化为可哈希的元组：数值特征按滑块步长取整，分类特征转为int
+def make_cache_key(feature_values, feature_order, ranges=feature_ranges):
+    key = []
+    for feature in feature_order:
+        value = feature_values[feature]
+        properties = ranges.get(feature, {"type": "numerical"})
+        if properties["type"] == "categorical":
+            key.append(int(value))
+        else:
+            # 加0.0把-0.0统一为0.0
+            key.append(round(float(value), NUMERICAL_DECIMALS) + 0.0)
+    return tuple(key)
+
+
+# 线程安全的LRU结果缓存，按量化后的患者输入保存预测结果和SHAP值，供所有会话共享。
+# 条目按模型版本（文件内容哈希）区分，多个模型共用同一缓存；模型文件变化后旧版本的条目不再命中，按LRU逐渐淘汰。
+# 不用修改时间和大小作键：不同路径的模型文件、或被同样大小的新文件在同一时刻覆盖时签名可能相同
+class PredictionCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # field为调用方需要的字段：只有条目中已有该字段才计为命中。条目只有部分字段时（如快速模式只写入了SHAP值）
+    # 计为未命中，但仍返回该条目，其中已有的字段可以复用
+    def get(self, key, model_version=None, field=None):
+        key = (model_version, key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            if entry is None or (field is not None and field not in entry):
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    # 写入或更新条目的部分字段（如先写预测结果，SHAP值算完后再补充）
+    def put(self, key, model_version=None, **fields):
+        key = (model_version, key)
+        with self._lock:
+            entry = self._entries.pop(key, {})
+            entry.update(fields)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
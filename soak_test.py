@@ -0,0 +1,220 @@
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+from memory_guard import live_figures, rss_bytes
+from model_core import synthetic_patients
+from result_cache import DEFAULT_MAX_ENTRIES
+
+warnings.filterwarnings('ignore')
+
+# 每个模拟会话的预测次数，之后关闭该会话、打开新会话（用户陆续来去）
+DEFAULT_SESSION_LENGTH = 50
+
+# 预热阶段占总预测次数的比例，不计入增长；预热次数至少为结果缓存的容量，缓存填满前的增长是预期的
+DEFAULT_WARMUP_FRACTION = 0.25
+
+# 预热之后允许的常驻内存增长（MB）
+DEFAULT_MAX_GROWTH_MB = 20.0
+
+
+# 与APP4.py一次点击“开始预测”相同的处理，不经过Streamlit：整理输入、查结果缓存、森林遍历、
+# 仪表盘、SHAP、瀑布图和审计记录；图表序列化为JSON，与st.plotly_chart发送给浏览器的内容相同
+class CoreRequests:
+    def __init__(self, audit=None):
+        from charts import build_risk_gauge, build_shap_waterfall
+        from model_core import death_class_explanation, risk_category
+        from predictor import Predictor
+        from result_cache import PredictionCache, make_cache_key
+
+        self.predictor = Predictor.load()
+        self.predictor.warm_up()
+        self.cache = PredictionCache()
+        self.audit = audit
+        self._gauge, self._waterfall = build_risk_gauge, build_shap_waterfall
+        self._explanation, self._category, self._key = death_class_explanation, risk_category, make_cache_key
+
+    def __call__(self, record):
+        predictor = self.predictor
+        features_df = predictor.frame([record])
+        key = self._key(record, predictor.feature_order)
+        entry = self.cache.get(key, predictor.version, field='prediction') or {}
+        prediction = entry.get('prediction')
+        if prediction is None:
+            prediction = predictor.predict(features_df)
+            self.cache.put(key, predictor.version, prediction=prediction)
+        death_probability = prediction.proba[0, 1] * 100
+        self._gauge(death_probability).to_json()
+        shap_values = entry.get('shap_values')
+        if shap_values is None:
+            shap_values = predictor.explain(features_df)
+            self.cache.put(key, predictor.version, shap_values=shap_values)
+        contributions, base_value, shown_values = self._explanation(shap_values)
+        self._waterfall(contributions, base_value, predictor.feature_order, shown_values).to_json()
+        if self.audit is not None:
+            self.audit.record("soak", predictor.version, record, death_probability,
+                              self._category(death_probability)[0])
+
+
+# 通过AppTest驱动APP4.py：每个会话打开页面后连续预测session_length次，之后换一个新会话
+class AppRequests:
+    def __init__(self, app_path, session_length, timeout):
+        self.app_path = app_path
+        self.session_length = session_length
+        self.timeout = timeout
+        self.errors = 0
+        self._at = None
+        self._count = 0
+
+    def __call__(self, record):
+        from streamlit.testing.v1 import AppTest
+
+        from load_test import fill_inputs, predict_button
+        if self._at is None or self._count >= self.session_length:
+            self._at = AppTest.from_file(self.app_path, default_timeout=self.timeout)
+            self._at.run()
+            self._count = 0
+        fill_inputs(self._at, record)
+        predict_button(self._at).click()
+        self._at.run()
+        self._count += 1
+        if len(self._at.exception) or len(self._at.error):
+            self.errors += 1
+
+
+# 预热后各采样点的常驻内存：线性拟合的斜率（MB/千次）和首尾增长（MB，各取前后3个采样点的中位数）
+def memory_trend(samples, warmup):
+    steady = [(n, rss) for n, rss, _ in samples if n >= warmup and rss is not None]
+    if len(steady) < 2:
+        return None, None
+    counts = np.array([n for n, _ in steady], dtype=float)
+    rss = np.array([r for _, r in steady], dtype=float) / 2**20
+    slope = np.polyfit(counts, rss, 1)[0] * 1000
+    growth = float(np.median(rss[-3:]) - np.median(rss[:3]))
+    return float(slope), growth
+
+
+def run_soak(requests, n_predictions, sample_every, warmup, seed=0, trace=False, progress=None):
+    rng = np.random.default_rng(seed)
+    # 输入步长为0.1，与页面滑块一致；绝大多数输入互不相同，结果缓存会被填满
+    patients = synthetic_patients(n_predictions, rng=rng).round(1).to_dict("records")
+    samples = []
+    top_growth = []
+    snapshot = None
+    start = time.perf_counter()
+    for i, record in enumerate(patients, 1):
+        requests(record)
+        if i == warmup and trace:
+            tracemalloc.start()
+            snapshot = tracemalloc.take_snapshot()
+        if i % sample_every == 0 or i == n_predictions:
+            # 先回收循环引用，只留下真正仍被引用的对象
+            gc.collect()
+            figures = live_figures()
+            samples.append((i, rss_bytes(), figures))
+            if progress is not None:
+                progress(i, samples[-1])
+    elapsed = time.perf_counter() - start
+    if snapshot is not None:
+        stats = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+        top_growth = [(f"{s.traceback[0].filename}:{s.traceback[0].lineno}", s.size_diff) for s in stats[:10]]
+        tracemalloc.stop()
+    slope, growth = memory_trend(samples, warmup)
+    return {
+        "predictions": n_predictions,
+        "warmup": warmup,
+        "elapsed_s": elapsed,
+        "predictions_per_second": n_predictions / elapsed if elapsed > 0 else 0.0,
+        "samples": [{"predictions": n, "rss_mb": rss / 2**20 if rss is not None else None, "figures": figures}
+                    for n, rss, figures in samples],
+        "slope_mb_per_1k": slope,
+        "growth_mb": growth,
+        "top_growth": top_growth,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="浸泡测试 - 长时间连续预测，检查进程内存是否保持平稳")
+    parser.add_argument("--mode", choices=["app", "core"], default="app",
+                        help="app: 用AppTest驱动APP4.py；core: 直接调用同样的预测、解释和图表代码，速度快得多")
+    parser.add_argument("--predictions", type=int, default=10000, help="预测次数")
+    parser.add_argument("--session-length", type=int, default=DEFAULT_SESSION_LENGTH,
+                        help="app模式下每个会话的预测次数")
+    parser.add_argument("--sample-every", type=int, default=None, help="每隔多少次预测采样一次内存，默认共采样50次")
+    parser.add_argument("--warmup-fraction", type=float, default=DEFAULT_WARMUP_FRACTION)
+    parser.add_argument("--max-growth-mb", type=float, default=DEFAULT_MAX_GROWTH_MB,
+                        help="预热后的内存增长超过该值时以非零状态退出")
+    parser.add_argument("--tracemalloc", action="store_true", help="预热后启动tracemalloc，结束时列出增长最多的代码位置")
+    parser.add_argument("--timeout", type=float, default=60, help="app模式下单次页面运行的超时 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    # 审计库写到临时目录，耗时日志丢弃，指标文件不写，只观察内存；结束后删除临时目录
+    workdir = tempfile.mkdtemp(prefix="soak-")
+    audit = None
+    try:
+        os.environ.setdefault("PREDICTION_AUDIT_DB", os.path.join(workdir, "audit.db"))
+        os.environ.setdefault("PREDICTION_TIMING_LOG", os.devnull)
+        os.environ.setdefault("METRICS_PATH", "")
+        if args.mode == "app":
+            requests = AppRequests("APP4.py", args.session_length, args.timeout)
+        else:
+            from audit_log import AuditLog
+            audit = AuditLog(os.environ["PREDICTION_AUDIT_DB"])
+            requests = CoreRequests(audit)
+        return _run_and_report(args, requests)
+    finally:
+        # 先写完审计记录并停止其后台线程，再删除临时目录
+        if audit is not None:
+            audit.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_and_report(args, requests):
+    sample_every = args.sample_every or max(1, args.predictions // 50)
+    warmup = min(max(int(args.predictions * args.warmup_fraction), DEFAULT_MAX_ENTRIES), args.predictions // 2)
+    if warmup < DEFAULT_MAX_ENTRIES:
+        print(f"预测次数较少，预热阶段填不满结果缓存（{DEFAULT_MAX_ENTRIES} 条），测得的增长包含缓存本身", file=sys.stderr)
+    print(f"{args.mode} 模式，{args.predictions} 次预测（前 {warmup} 次为预热），每 {sample_every} 次采样一次内存")
+
+    def progress(done, sample):
+        _, rss, figures = sample
+        if done % (sample_every * 5) == 0 or done == args.predictions:
+            figure_text = "、".join(f"{k} {v}" for k, v in figures.items()) or "无"
+            print(f"  {done:>7} 次  常驻内存 {rss / 2**20:7.1f} MB  存活图表 {figure_text}")
+
+    result = run_soak(requests, args.predictions, sample_every, warmup, args.seed, args.tracemalloc, progress)
+    result["mode"] = args.mode
+    print(f"用时 {result['elapsed_s']:.0f} s（{result['predictions_per_second']:.1f} 次/秒）")
+    if result["growth_mb"] is not None:
+        print(f"预热后内存增长 {result['growth_mb']:+.1f} MB，斜率 {result['slope_mb_per_1k']:+.2f} MB/千次")
+    for where, size in result["top_growth"]:
+        print(f"  {size / 1024:+9.0f} KB  {where}")
+    if args.mode == "app" and requests.errors:
+        print(f"页面出错 {requests.errors} 次", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+    pyplot_figures = result["samples"][-1]["figures"].get("pyplot", 0) if result["samples"] else 0
+    failed = (result["growth_mb"] is not None and result["growth_mb"] > args.max_growth_mb) or pyplot_figures > 0
+    if args.mode == "app":
+        failed = failed or requests.errors > 0
+    if failed:
+        print("内存没有保持平稳", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# 冷启动各阶段的时间预算（秒），超出即视为回归
+DEFAULT_BUDGETS = {
+    "import": 2.0,            # 导入应用依赖的模块（不含shap）
+    "model_load": 2.0,        # 加载模型文件并构建展平推理引擎
+    "warm_up": 5.0,           # 构建SHAP解释器并完成一次预热预测
+    "first_prediction": 0.1,  # 预热后第一次真实预测（森林遍历 + SHAP + 图表构建）
+}
+
+# 在全新的解释器进程中执行，避免已导入模块影响测量结果
+_MEASURE_SCRIPT = r"""
+import json, sys, time, warnings
+warnings.filterwarnings('ignore')
+timings = {}
+
+start = time.perf_counter()
+import streamlit
+import charts, batch_scoring, model_core, predictor, result_cache
+timings["import"] = time.perf_counter() - start
+
+start = time.perf_counter()
+core = predictor.Predictor.load(sys.argv[1])
+timings["model_load"] = time.perf_counter() - start
+
+start = time.perf_counter()
+core.warm_up()
+feature_order = core.feature_order
+timings["warm_up"] = time.perf_counter() - start
+
+import numpy as np
+features_df = model_core.synthetic_patients(1, rng=np.random.default_rng(0), feature_order=feature_order)
+start = time.perf_counter()
+prediction = core.predict(features_df)
+shap_values = core.explain(features_df)
+charts.build_risk_gauge(prediction.proba[0, 1] * 100)
+contributions, base_value, shown_values = model_core.death_class_explanation(shap_values)
+charts.build_shap_waterfall(contributions, base_value, feature_order, shown_values)
+timings["first_prediction"] = time.perf_counter() - start
+
+print(json.dumps(timings))
+"""
+
+
+def measure(model_path):
+    output = subprocess.run([sys.executable, "-c", _MEASURE_SCRIPT, model_path],
+                            capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    from model_core import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="冷启动时间预算检查：导入、模型加载、预热和首次预测")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--repeat", type=int, default=3, help="重复测量次数，取各阶段中位数")
+    parser.add_argument("--budget", action="append", default=[], metavar="阶段=秒",
+                        help="覆盖默认预算，例如 --budget warm_up=5")
+    parser.add_argument("--json", help="把测量结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in args.budget:
+        stage, _, seconds = item.partition("=")
+        if stage not in budgets:
+            parser.error(f"未知阶段: {stage}")
+        budgets[stage] = float(seconds)
+
+    runs = [measure(args.model) for _ in range(args.repeat)]
+    results = {stage: sorted(run[stage] for run in runs)[len(runs) // 2] for stage in budgets}
+
+    over_budget = False
+    for stage, seconds in results.items():
+        status = "OK" if seconds <= budgets[stage] else "超出预算"
+        over_budget |= seconds > budgets[stage]
+        print(f"{stage:<18}{seconds * 1000:>10.1f} ms   预算 {budgets[stage] * 1000:>8.0f} ms   {status}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"timings": results, "budgets": budgets}, f, ensure_ascii=False, indent=2)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import argparse
+import sys
+import time
+import warnings
+from collections import namedtuple
+from math import factorial
+
+import numpy as np
+
+from model_core import MODEL_PATH, load_model_file, synthetic_patients
+
+warnings.filterwarnings('ignore')
+
+# 每块处理的行数：中间数组约为 行数 × 叶子路径数，按块计算控制内存
+DEFAULT_BLOCK_ROWS = 1024
+
+# 不超过该行数时直接取表求和，省去构造稀疏矩阵的固定开销
+SMALL_BATCH_ROWS = 16
+
+# 叶子路径上不同特征数的上限；贡献表大小为 路径数 × 2^该数 × 特征数
+MAX_PATH_FEATURES = 10
+
+# 贡献表和区间表预计占用内存的上限（字节），超过时不构建，调用方退回shap；构建耗时与表的大小大致成正比
+MAX_TABLE_BYTES = 64 * 2**20
+
+# 与shap对照时允许的最大绝对误差
+DEFAULT_TOLERANCE = 1e-9
+
+# 与shap.Explanation同名的字段，death_class_explanation等函数可直接使用；values为死亡类的贡献值 (n_rows, n_features)
+TreeShapValues = namedtuple('TreeShapValues', ['values', 'base_values', 'data', 'feature_names'])
+
+
+# 从根到每个叶子的路径，同一特征的多次分裂合并为一个取值区间 (lo, hi]：
+# 返回 (所在树, 叶子节点, 路径上各特征, 各特征区间下界, 上界, 各特征的cover比例之积)
+def leaf_paths(engine):
+    left, right = np.asarray(engine.left), np.asarray(engine.right)
+    feature = np.asarray(engine.feature)
+    threshold = np.asarray(engine.threshold, dtype=np.float64)
+    cover = np.asarray(engine.cover, dtype=np.float64)
+    paths = []
+    for tree, root in enumerate(np.asarray(engine.roots)):
+        stack = [(int(root), {})]
+        while stack:
+            node, conditions = stack.pop()
+            if left[node] == node:
+                features = list(conditions)
+                paths.append((tree, node, features,
+                              [conditions[f][0] for f in features], [conditions[f][1] for f in features],
+                              [conditions[f][2] for f in features]))
+                continue
+            f, t = int(feature[node]), threshold[node]
+            lo, hi, zero = conditions.get(f, (-np.inf, np.inf, 1.0))
+            for child, child_lo, child_hi in ((int(left[node]), lo, min(hi, t)), (int(right[node]), max(lo, t), hi)):
+                child_conditions = dict(conditions)
+                child_conditions[f] = (child_lo, child_hi, zero * cover[child] / cover[node])
+                stack.append((child, child_conditions))
+    return paths
+
+
+# 不枚举叶子路径，估计FastTreeExplainer的贡献表和区间表占用的内存上限（字节）：
+# 叶子数 × 2^(路径上可能的最多特征数) × 特征数，加上各特征 (分裂阈值数+1) × 叶子数 的区间表
+def explainer_table_bytes(engine):
+    left = np.asarray(engine.left)
+    internal = left != np.arange(len(left))
+    n_leaves = int((~internal).sum())
+    n_features = engine.n_features_in_
+    max_d = min(int(engine.max_depth), n_features)
+    feature = np.asarray(engine.feature)[internal]
+    threshold = np.asarray(engine.threshold)[internal]
+    n_thresholds = sum(np.unique(threshold[feature == f]).size for f in range(n_features))
+    bits_itemsize = 1 if max_d <= 8 else 2
+    return n_leaves * 2 ** max_d * n_features * 8 + (n_thresholds + n_features) * n_leaves * bits_itemsize
+
+
+# 路径上d个特征、每种“满足/不满足路径条件”组合下各特征的贡献系数。对特征i：
+#   sum_{S ⊆ D\{i}} |S|!(d-|S|-1)!/d! · prod_{j∈S} o_j · prod_{j∉S,j≠i} z_j · (o_i - z_i)
+# 其中o_j为该组合下特征j是否满足条件，z_j为路径上该特征各分裂cover比例之积。返回 (路径数, 2^d, d)
+def path_weights(zero_fractions):
+    n_paths, d = zero_fractions.shape
+    patterns = ((np.arange(2 ** d)[:, None] >> np.arange(d)) & 1).astype(np.float64)
+    table = np.zeros((n_paths, 2 ** d, d))
+    for i in range(d):
+        others = [j for j in range(d) if j != i]
+        for mask in range(2 ** (d - 1)):
+            subset = [others[k] for k in range(d - 1) if mask >> k & 1]
+            rest = [j for j in others if j not in subset]
+            weight = factorial(len(subset)) * factorial(d - len(subset) - 1) / factorial(d)
+            table[:, :, i] += (weight * zero_fractions[:, rest].prod(axis=1)[:, None]
+                               * patterns[:, subset].prod(axis=1)[None, :])
+        table[:, :, i] *= patterns[None, :, i] - zero_fractions[:, i:i + 1]
+    return table
+
+
+# 展平森林上的批量TreeSHAP（path-dependent，与shap.TreeExplainer对sklearn随机森林的默认算法相同）。
+# 构建时把每条叶子路径在全部 2^d 种条件组合下对各特征的贡献预先算好；解释时先按各特征的分裂阈值
+# 确定每行落在哪个区间，查表得到每条路径的条件组合编号，再用一次稀疏矩阵乘法把各路径的贡献累加到特征上
+class FastTreeExplainer:
+    def __init__(self, engine, class_index=1, block_rows=DEFAULT_BLOCK_ROWS, max_table_bytes=MAX_TABLE_BYTES):
+        if getattr(engine, 'cover', None) is None:
+            raise ValueError("推理引擎缺少节点样本权重(cover)，请用新版本重新转换紧凑格式")
+        # 较深的森林叶子多、路径长，表会很大，先估计再决定是否构建
+        estimated = explainer_table_bytes(engine)
+        if estimated > max_table_bytes:
+            raise ValueError(f"预计查表约 {estimated / 2**20:.0f} MB，超过上限 {max_table_bytes / 2**20:.0f} MB")
+        self.engine = engine
+        self.block_rows = block_rows
+        self.feature_names = (list(engine.feature_names_in_) if hasattr(engine, 'feature_names_in_')
+                              else None)
+        n_features = engine.n_features_in_
+        n_trees = engine.n_estimators
+        value = np.asarray(engine.value, dtype=np.float64)[:, class_index]
+        cover = np.asarray(engine.cover, dtype=np.float64)
+        paths = leaf_paths(engine)
+        max_d = max(len(p[2]) for p in paths)
+        if max_d > MAX_PATH_FEATURES:
+            raise ValueError(f"叶子路径上的不同特征数 {max_d} 超过 {MAX_PATH_FEATURES}，查表过大")
+
+        # 基准值：各树叶子取值按cover加权的平均，再对所有树求平均
+        root_cover = cover[np.asarray(engine.roots)]
+        self.expected_value = float(sum(value[leaf] * cover[leaf] / root_cover[tree]
+                                        for tree, leaf, *_ in paths) / n_trees)
+
+        # 贡献表：第p条路径、条件组合k对特征f的贡献在第 p*2^max_d + k 行第f列，叶子取值和1/树数已乘入
+        self.n_paths = len(paths)
+        self._patterns = 2 ** max_d
+        self._table = np.zeros((self.n_paths, self._patterns, n_features))
+        for d in range(1, max_d + 1):
+            rows = [r for r, p in enumerate(paths) if len(p[2]) == d]
+            if not rows:
+                continue
+            weights = path_weights(np.array([paths[r][5] for r in rows]))
+            weights *= (np.array([value[paths[r][1]] for r in rows]) / n_trees)[:, None, None]
+            for i, r in enumerate(rows):
+                self._table[r, :2 ** d][:, paths[r][2]] = weights[i]
+        self._table = self._table.reshape(-1, n_features)
+        self._offsets = np.arange(self.n_paths) * self._patterns
+
+        # 各特征的分裂阈值（升序）和区间表：x落在第b个区间（恰有b个阈值小于x）时，
+        # 该特征为第p条路径的条件组合编号贡献 _bits[f][b, p]
+        self._thresholds = []
+        self._bits = []
+        pattern_dtype = np.uint8 if max_d <= 8 else np.uint16
+        for f in range(n_features):
+            slots = [(r, j) for r, p in enumerate(paths) for j, pf in enumerate(p[2]) if pf == f]
+            bounds = np.array([b for r, j in slots for b in (paths[r][3][j], paths[r][4][j])])
+            thresholds = np.unique(bounds[np.isfinite(bounds)]) if len(slots) else np.empty(0)
+            bits = np.zeros((len(thresholds) + 1, self.n_paths), dtype=pattern_dtype)
+            for r, j in slots:
+                lo, hi = paths[r][3][j], paths[r][4][j]
+                # 区间 (lo, hi] 对应 lo的序号+1 到 hi的序号 之间的区间编号
+                first = np.searchsorted(thresholds, lo) + 1 if np.isfinite(lo) else 0
+                last = np.searchsorted(thresholds, hi) if np.isfinite(hi) else len(thresholds)
+                bits[first:last + 1, r] += 1 << j
+            self._thresholds.append(thresholds)
+            self._bits.append(bits)
+
+    # 死亡类的SHAP值 (n_rows, n_features)
+    def shap_values(self, X):
+        # 与推理引擎一致：输入先转为float32，再与float64阈值比较
+        X = self.engine._as_array(X).astype(np.float64)
+        result = np.empty(X.shape, dtype=np.float64)
+        for start in range(0, X.shape[0], self.block_rows):
+            block = X[start:start + self.block_rows]
+            pattern = np.zeros((len(block), self.n_paths), dtype=self._bits[0].dtype)
+            for f, (thresholds, bits) in enumerate(zip(self._thresholds, self._bits)):
+                pattern += bits[np.searchsorted(thresholds, block[:, f], side='left')]
+            # 每行在每条路径上恰好选中贡献表的一行：构造0/1稀疏矩阵后与贡献表相乘即完成累加
+            columns = (self._offsets + pattern).ravel()
+            if len(block) <= SMALL_BATCH_ROWS:
+                result[start:start + len(block)] = self._table[columns].reshape(len(block), self.n_paths, -1).sum(axis=1)
+                continue
+            from scipy.sparse import csr_matrix
+            selection = csr_matrix((np.ones(columns.size), columns,
+                                    np.arange(0, columns.size + 1, self.n_paths)),
+                                   shape=(len(block), self._table.shape[0]))
+            result[start:start + len(block)] = selection @ self._table
+        return result
+
+    # 与shap解释器的调用方式一致，返回带values/base_values/data字段的结果
+    def __call__(self, features_df):
+        data = self.engine._as_array(features_df).astype(np.float64)
+        values = self.shap_values(data)
+        return TreeShapValues(values, np.full(len(values), self.expected_value), data, self.feature_names)
+
+
+# 与shap.TreeExplainer对照，返回 (最大绝对误差, shap的死亡类SHAP值, 本实现的SHAP值)
+def compare_with_shap(model, explainer, X):
+    import shap
+    reference = shap.TreeExplainer(model).shap_values(X, check_additivity=False)
+    if isinstance(reference, list):
+        reference = reference[1]
+    elif reference.ndim == 3:
+        reference = reference[:, :, 1]
+    actual = explainer.shap_values(X)
+    return float(np.abs(reference - actual).max()), reference, actual
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="展平森林上的批量TreeSHAP - 与shap对照并计时")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型文件路径")
+    parser.add_argument("--check-rows", type=int, default=2000, help="与shap对照的随机样本数")
+    parser.add_argument("--bench-rows", type=int, nargs="+", default=[1, 1000, 100000], help="计时的行数")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from forest_engine import FlatForest
+    from forest_engine import threshold_edge_cases
+    model = load_model_file(args.model)
+    engine = FlatForest.from_model(model)
+    start = time.perf_counter()
+    explainer = FastTreeExplainer(engine)
+    build_ms = (time.perf_counter() - start) * 1000
+    feature_order = list(engine.feature_names_in_)
+    print(f"{engine.n_estimators} 棵树、{explainer.n_paths} 条叶子路径，构建耗时 {build_ms:.1f} ms")
+
+    samples = synthetic_patients(args.check_rows, rng=np.random.default_rng(args.seed), feature_order=feature_order)
+    X = np.vstack([samples.to_numpy(dtype=np.float64), threshold_edge_cases(engine, seed=args.seed)])
+    max_error, _, actual = compare_with_shap(model, explainer, X)
+    additivity = np.abs(actual.sum(axis=1) + explainer.expected_value - engine.predict_proba(X)[:, 1]).max()
+    print(f"与shap对照 {len(X)} 行: 最大绝对误差 {max_error:.2e}；SHAP值之和与预测概率的最大差 {additivity:.2e}")
+
+    import shap
+    reference = shap.TreeExplainer(model)
+    for n_rows in args.bench_rows:
+        X = synthetic_patients(n_rows, rng=np.random.default_rng([args.seed, n_rows]), feature_order=feature_order)
+        repeat = 50 if n_rows == 1 else 3
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            explainer.shap_values(X)
+            timings.append((time.perf_counter() - start) * 1000)
+        fast_ms = float(np.median(timings))
+        # shap逐行在C++中遍历，10万行要数十秒，只计时一部分行再按比例估计
+        reference_rows = min(n_rows, 2000)
+        start = time.perf_counter()
+        reference.shap_values(X[:reference_rows], check_additivity=False)
+        reference_ms = (time.perf_counter() - start) * 1000 * n_rows / reference_rows
+        estimate = "（按前2000行估计）" if reference_rows < n_rows else ""
+        print(f"{n_rows:>7} 行: {fast_ms:10.2f} ms  shap {reference_ms:10.2f} ms{estimate}  "
+              f"({reference_ms / fast_ms:.1f}x)")
+    return 0 if max_error <= args.tolerance else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from model_core import feature_ranges
+
+# 单特征风险曲线和双特征热图每个数值特征的网格点数
+DEFAULT_CURVE_POINTS = 201
+DEFAULT_HEATMAP_POINTS = 41
+
+
+# 特征取值网格：数值特征在feature_ranges的min/max之间等距取点，分类特征取全部选项；
+# 传入current时把当前取值并入网格，曲线上的当前点就是实际预测值
+def feature_grid(feature, points=DEFAULT_CURVE_POINTS, ranges=feature_ranges, current=None):
+    properties = ranges[feature]
+    if properties["type"] == "numerical":
+        grid = np.linspace(float(properties["min"]), float(properties["max"]), points)
+    else:
+        grid = np.asarray(properties["options"], dtype=float)
+    if current is not None:
+        grid = np.union1d(grid, [float(current)])
+    return grid
+
+
+# 以当前患者为基准复制成多行，只改变指定特征的取值
+def _grid_frame(base_record, feature_order, columns):
+    n_rows = len(next(iter(columns.values())))
+    frame = pd.DataFrame({f: np.full(n_rows, float(base_record[f])) for f in feature_order})
+    for feature, values in columns.items():
+        frame[feature] = values
+    return frame
+
+
+# 单特征风险曲线：其他特征固定为当前取值，整个网格一次批量送入森林，返回 (网格, 死亡概率百分比)
+def sweep_feature(predictor, base_record, feature, points=DEFAULT_CURVE_POINTS):
+    grid = feature_grid(feature, points, predictor.ranges, current=base_record[feature])
+    frame = _grid_frame(base_record, predictor.feature_order, {feature: grid})
+    return grid, predictor.engine.predict_proba(frame)[:, 1] * 100
+
+
+# 双特征风险热图：两个特征网格的笛卡尔积一次批量送入森林，返回 (x网格, y网格, 死亡概率百分比矩阵[y, x])
+def sweep_pair(predictor, base_record, feature_x, feature_y, points=DEFAULT_HEATMAP_POINTS):
+    grid_x = feature_grid(feature_x, points, predictor.ranges)
+    grid_y = feature_grid(feature_y, points, predictor.ranges)
+    mesh_x, mesh_y = np.meshgrid(grid_x, grid_y)
+    frame = _grid_frame(base_record, predictor.feature_order,
+                        {feature_x: mesh_x.ravel(), feature_y: mesh_y.ravel()})
+    risk = predictor.engine.predict_proba(frame)[:, 1] * 100
+    return grid_x, grid_y, risk.reshape(mesh_x.shape)
+
+
+# 网格中某个取值（已并入网格）处的风险
+def risk_at(grid, risk, value):
+    return float(risk[np.searchsorted(grid, float(value))])